@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+"""
+Alert-path benchmark against a local Home Assistant stand-in.
+
+A local HTTP server answers /api/services/light/turn_on and turn_off with
+configurable latency, error rate (HTTP 503) and connection drops. For each
+scenario the benchmark measures:
+
+- blocking: how long AlertManager.trigger_alert holds up the detection loop
+- end-to-end latency: from the alert being committed until the stand-in
+  acknowledged its delivery (p50/p99, from the outbox timestamps)
+- storm throughput: alerts accepted per second and how long the backlog takes
+  to drain when alerts fire back to back
+- loop blocking: a simulated detection loop (cycle of --cycle-ms) runs while
+  the storm fires; reports the share of loop time spent inside trigger_alert
+  and the worst cycle overrun
+
+The 'inline' rows call the bulb API directly from the loop for comparison.
+
+Usage:
+    python3 alert_benchmark.py
+    python3 alert_benchmark.py --latency 2000 --error-rate 0.3 --drop-rate 0.1
+    python3 alert_benchmark.py --output alerts.json
+"""
+
+import argparse
+import json
+import os
+import random
+import shutil
+import socket
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+# name -> (latency ms, error rate, drop rate, server up)
+SCENARIOS = {
+    'healthy': (20, 0.0, 0.0, True),
+    'slow': (1500, 0.0, 0.0, True),
+    'flaky': (50, 0.3, 0.1, True),
+    'down': (0, 0.0, 0.0, False),
+}
+
+
+class BulbStandIn:
+    """Local stand-in for the Home Assistant light services"""
+
+    def __init__(self, latency=0.0, error_rate=0.0, drop_rate=0.0, seed=0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.drop_rate = drop_rate
+        self.random = random.Random(seed)
+        self.requests = []  # (received, path, status, idempotency key)
+        self.lock = threading.Lock()
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                received = time.time()
+                self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                with stand_in.lock:
+                    roll = stand_in.random.random()
+                time.sleep(stand_in.latency)
+
+                if self.path not in ('/api/services/light/turn_on', '/api/services/light/turn_off'):
+                    status = 404
+                elif roll < stand_in.drop_rate:
+                    status = None  # Connection dropped without a response
+                elif roll < stand_in.drop_rate + stand_in.error_rate:
+                    status = 503
+                else:
+                    status = 200
+                with stand_in.lock:
+                    stand_in.requests.append((received, self.path, status, self.headers.get('Idempotency-Key')))
+
+                if status is None:
+                    self.close_connection = True
+                    self.connection.shutdown(socket.SHUT_RDWR)
+                    return
+                self.send_response(status)
+                self.send_header('Content-Length', '2')
+                self.end_headers()
+                self.wfile.write(b'[]')
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def _closed_port_url():
+    """URL of a local port with nothing listening (connection refused)"""
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return f"http://127.0.0.1:{sock.getsockname()[1]}"
+
+
+def percentile(samples, fraction):
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def _make_alert_manager(url, work_dir, retry):
+    """AlertManager with rate limits off, audio off and a private outbox"""
+    from alert_manager import AlertManager
+    from config import Config
+
+    # Configured before AlertManager starts, which would otherwise open (and flush) the
+    # production outbox when SMART_BULB_API_URL is set and alerts are pending there
+    config = Config()
+    config.SMART_BULB_API_URL = url
+    config.AUDIO_ALERT_ENABLED = False
+    config.ALERT_COOLDOWN = 0
+    config.MAX_ALERTS_PER_HOUR = 10 ** 9
+    config.ALERT_OUTBOX_FILE = os.path.join(work_dir, 'alerts.db')
+    config.ALERT_FLUSH_INTERVAL = 0.05
+    config.ALERT_RETRY_INITIAL = retry
+    config.ALERT_RETRY_MAX = retry * 4
+    return AlertManager(config=config)
+
+
+def run_loop(trigger, alerts, cycle, alert_every):
+    """
+    Simulated detection loop firing an alert every `alert_every` cycles
+    Returns per-alert blocking times, total loop time and the worst overrun.
+    """
+    blocked = []
+    overruns = []
+    start = time.perf_counter()
+    cycles = alerts * alert_every
+    for i in range(cycles):
+        cycle_start = time.perf_counter()
+        time.sleep(cycle)  # Stand-in for capture and detection
+        if i % alert_every == 0:
+            t = time.perf_counter()
+            trigger()
+            blocked.append(time.perf_counter() - t)
+        overruns.append(time.perf_counter() - cycle_start - cycle)
+    return blocked, time.perf_counter() - start, max(overruns)
+
+
+def run_scenario(latency, error_rate, drop_rate, up, alerts, cycle, drain_timeout, retry, inline):
+    """Run one scenario through the outbox (or inline) and return its measurements"""
+    work_dir = tempfile.mkdtemp(prefix='lightdetect_alerts_')
+    stand_in = BulbStandIn(latency, error_rate, drop_rate).start() if up else None
+    url = stand_in.url if stand_in else _closed_port_url()
+    alert_manager = _make_alert_manager(url, work_dir, retry)
+
+    if inline:
+        trigger = alert_manager.trigger_smart_bulb_alert
+    else:
+        def trigger():
+            alert_manager.last_alert_time = None
+            alert_manager.trigger_alert({'detected': True, 'confidence': 1.0})
+
+    try:
+        with mock.patch('builtins.print'):
+            # Steady alerts from a running loop, then a storm of back-to-back alerts
+            blocked, loop_time, worst_overrun = run_loop(trigger, alerts, cycle, alert_every=5)
+
+            storm_start = time.perf_counter()
+            for _ in range(alerts):
+                trigger()
+            storm_time = time.perf_counter() - storm_start
+
+            drain_time = None
+            if not inline and up:
+                deadline = time.perf_counter() + drain_timeout
+                while time.perf_counter() < deadline:
+                    if alert_manager.outbox_stats()['backlog'] == 0:
+                        drain_time = time.perf_counter() - storm_start
+                        break
+                    time.sleep(0.02)
+            alert_manager.cleanup()
+        if not inline:
+            # The run's alerts went to its own outbox, never the production one
+            assert os.path.dirname(alert_manager.outbox.path) == work_dir, alert_manager.outbox.path
+
+        result = {
+            'mode': 'inline' if inline else 'outbox',
+            'alerts': 2 * alerts,
+            'block_p50_ms': percentile(blocked, 0.5) * 1000,
+            'block_p99_ms': percentile(blocked, 0.99) * 1000,
+            'block_max_ms': max(blocked) * 1000,
+            'loop_blocked_share': sum(blocked) / loop_time,
+            'worst_overrun_ms': worst_overrun * 1000,
+            'storm_alerts_per_sec': alerts / storm_time,
+            'drain_s': drain_time,
+            'requests': len(stand_in.requests) if stand_in else None,
+        }
+
+        if not inline:
+            from alert_outbox import AlertOutbox
+            outbox = AlertOutbox(os.path.join(work_dir, 'alerts.db'))
+            lags = [row[0] for row in outbox.conn.execute(
+                "SELECT delivered - created FROM outbox WHERE delivered IS NOT NULL")]
+            result['delivered'] = len(lags)
+            result['pending'] = outbox.stats()['backlog']
+            result['e2e_p50_ms'] = percentile(lags, 0.5) * 1000 if lags else None
+            result['e2e_p99_ms'] = percentile(lags, 0.99) * 1000 if lags else None
+            outbox.close()
+        return result
+    finally:
+        if stand_in:
+            stand_in.stop()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def _ms(value):
+    return f"{value:>9.1f}" if value is not None else f"{'-':>9}"
+
+
+def print_results(results):
+    print(f"{'scenario':<16} {'block p50':>9} {'block p99':>9} {'loop blk':>8} {'e2e p50':>9} "
+          f"{'e2e p99':>9} {'storm/s':>9} {'drain s':>8} {'reqs':>5} {'lost':>5}")
+    print("-" * 98)
+    for name, r in results.items():
+        drain = f"{r['drain_s']:>8.2f}" if r.get('drain_s') is not None else f"{'-':>8}"
+        lost = r['alerts'] - r['delivered'] - r['pending'] if 'delivered' in r else None
+        print(f"{name:<16} {_ms(r['block_p50_ms'])} {_ms(r['block_p99_ms'])} {r['loop_blocked_share']:>8.1%} "
+              f"{_ms(r.get('e2e_p50_ms'))} {_ms(r.get('e2e_p99_ms'))} {r['storm_alerts_per_sec']:>9.0f} "
+              f"{drain} {r['requests'] if r['requests'] is not None else '-':>5} "
+              f"{lost if lost is not None else '-':>5}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark alert delivery against a local bulb API stand-in")
+    parser.add_argument('--alerts', type=int, default=20, help="alerts per phase (loop and storm)")
+    parser.add_argument('--cycle-ms', type=float, default=20, help="simulated detection cycle length")
+    parser.add_argument('--latency', type=float, help="custom scenario: stand-in latency in ms")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="custom scenario: share of HTTP 503s")
+    parser.add_argument('--drop-rate', type=float, default=0.0, help="custom scenario: share of dropped connections")
+    parser.add_argument('--retry', type=float, default=0.2, help="outbox retry delay in seconds")
+    parser.add_argument('--drain-timeout', type=float, default=30.0, help="seconds to wait for the backlog to clear")
+    parser.add_argument('--no-inline', action='store_true', help="skip the direct-call comparison rows")
+    parser.add_argument('--output', help="write JSON results to this file")
+    args = parser.parse_args()
+
+    scenarios = dict(SCENARIOS)
+    if args.latency is not None:
+        scenarios = {'custom': (args.latency, args.error_rate, args.drop_rate, True)}
+
+    results = {}
+    for name, (latency, error_rate, drop_rate, up) in scenarios.items():
+        for inline in ((False,) if args.no_inline else (False, True)):
+            label = f"{name}[{'inline' if inline else 'outbox'}]"
+            print(f"Running {label}...", flush=True)
+            results[label] = run_scenario(latency / 1000, error_rate, drop_rate, up, args.alerts,
+                                          args.cycle_ms / 1000, args.drain_timeout, args.retry, inline)
+
+    print()
+    print_results(results)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"\nResults written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
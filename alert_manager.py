@@ -1,16 +1,27 @@
-import requests
 import time
 import os
 import subprocess
 from datetime import datetime, timedelta
 from config import Config
+from metrics import NullMetrics
 
 class AlertManager:
-    def __init__(self):
-        self.config = Config()
+    def __init__(self, metrics=None, config=None):
+        self.config = config or Config()
+        self.metrics = metrics or NullMetrics()
         self.last_alert_time = None
         self.alert_count = 0
         self.last_hour = datetime.now().hour
+        self.outbox = None  # Opened on the first network alert (or at start-up if alerts are pending)
+        self.flusher = None
+        if self.config.SMART_BULB_API_URL and os.path.exists(self.config.ALERT_OUTBOX_FILE):
+            self._open_outbox()  # Deliver alerts left over from a previous run
+    
+    def _open_outbox(self):
+        from alert_outbox import AlertOutbox, OutboxFlusher
+        self.outbox = AlertOutbox(self.config.ALERT_OUTBOX_FILE)
+        self.flusher = OutboxFlusher(self.outbox, {'smart_bulb': self.deliver_smart_bulb_alerts},
+                                     config=self.config, metrics=self.metrics).start()
     
     def should_alert(self):
         """Check if we should send an alert based on cooldown and rate limiting"""
@@ -37,15 +48,16 @@ class AlertManager:
         """Trigger all configured alerts"""
         if not self.should_alert():
             print("Alert suppressed due to cooldown or rate limiting")
+            self.metrics.inc('alerts_suppressed')
             return False
         
         print("🚨 RED LIGHT DETECTED - TRIGGERING ALERTS! 🚨")
         
         success = True
         
-        # Smart bulb alert
+        # Smart bulb alert: committed to the outbox, delivered in the background
         if self.config.SMART_BULB_API_URL:
-            success &= self.trigger_smart_bulb_alert()
+            success &= self.queue_smart_bulb_alert(analysis_result)
         
         # Audio alert
         if self.config.AUDIO_ALERT_ENABLED:
@@ -54,20 +66,45 @@ class AlertManager:
         # Update alert tracking
         self.last_alert_time = datetime.now()
         self.alert_count += 1
+        self.metrics.inc('alerts_sent')
         
         return success
     
-    def trigger_smart_bulb_alert(self):
+    def queue_smart_bulb_alert(self, analysis_result):
+        """Commit a smart bulb alert to the outbox and wake the flusher"""
+        try:
+            if self.outbox is None:
+                self._open_outbox()
+            self.outbox.enqueue('smart_bulb', {
+                'time': time.time(),
+                'confidence': analysis_result.get('confidence'),
+            })
+            self.flusher.wake()
+            return True
+        except Exception as e:
+            print(f"Could not queue smart bulb alert: {e}")
+            return False
+    
+    def deliver_smart_bulb_alerts(self, alerts, idempotency_key):
+        """Outbox sender: one bulb command covers a batch of pending alerts"""
+        print(f"Delivering {len(alerts)} smart bulb alert(s)")
+        return self.trigger_smart_bulb_alert(idempotency_key)
+    
+    def trigger_smart_bulb_alert(self, idempotency_key=None):
         """Trigger smart bulb alert via API"""
         try:
             if not self.config.SMART_BULB_API_URL:
                 return False
             
+            import requests  # Deferred: only needed once an alert fires
+            
             # Example for Home Assistant API
             headers = {
                 'Authorization': f'Bearer {self.config.SMART_BULB_API_KEY}',
                 'Content-Type': 'application/json'
             }
+            if idempotency_key:
+                headers['Idempotency-Key'] = idempotency_key
             
             # Turn on bulbs with red color
             data = {
@@ -123,6 +160,8 @@ class AlertManager:
             if not self.config.SMART_BULB_API_URL:
                 return False
             
+            import requests
+            
             headers = {
                 'Authorization': f'Bearer {self.config.SMART_BULB_API_KEY}',
                 'Content-Type': 'application/json'
@@ -151,6 +190,16 @@ class AlertManager:
             print(f"Clear smart bulbs error: {e}")
             return False
     
+    def outbox_stats(self):
+        """Backlog and delivery lag of the alert outbox, or None if it is not in use"""
+        return self.outbox.stats() if self.outbox else None
+    
     def cleanup(self):
-        """Clean up resources (no GPIO)"""
-        pass 
\ No newline at end of file
+        """Stop the outbox flusher (pending alerts are delivered on the next start)"""
+        if self.flusher and not self.flusher.stop():
+            # Closing the connection under a running delivery would fail it; the
+            # daemon thread ends with the process and the outbox is closed with it
+            print("Alert delivery still in progress, leaving the outbox open")
+            return
+        if self.outbox:
+            self.outbox.close() 
\ No newline at end of file
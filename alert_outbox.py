@@ -0,0 +1,238 @@
+"""
+Durable alert outbox.
+
+Alerts are committed to a SQLite table (WAL, synchronous=FULL) before the
+detection loop moves on; delivery happens later on a background thread. An
+unreachable Home Assistant therefore neither loses alerts nor blocks
+detection: undelivered rows stay in the outbox, survive restarts and are
+retried with exponential backoff.
+
+Each alert gets a unique idempotency key. The flusher delivers up to
+ALERT_BATCH_SIZE pending alerts of one kind per request. The alerts of a
+batch are fixed at its first attempt and the batch is identified by the key
+of its first alert, sent as the Idempotency-Key header; a retry resends the
+same alerts under the same key, so a receiver that deduplicates on it ignores
+a batch that was delivered but not acknowledged.
+Alerts older than ALERT_MAX_AGE are given up and marked expired.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+from config import Config
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    key TEXT UNIQUE NOT NULL,
+    kind TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    created REAL NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt REAL NOT NULL,
+    delivered REAL,
+    expired INTEGER NOT NULL DEFAULT 0,
+    last_error TEXT,
+    batch TEXT
+)
+"""
+_PENDING = "delivered IS NULL AND expired = 0"
+
+
+class AlertOutbox:
+    """SQLite table of alerts awaiting delivery"""
+
+    def __init__(self, path=None, readonly=False):
+        self.path = path or Config.ALERT_OUTBOX_FILE
+        if readonly:
+            self.conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, timeout=5)
+        else:
+            directory = os.path.dirname(self.path)
+            if directory and not os.path.exists(directory):
+                os.makedirs(directory)
+            self.conn = sqlite3.connect(self.path, timeout=5, check_same_thread=False)
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=FULL")  # A committed alert survives power loss
+            self.conn.execute(_SCHEMA)
+            columns = [row[1] for row in self.conn.execute("PRAGMA table_info(outbox)")]
+            if 'batch' not in columns:
+                self.conn.execute("ALTER TABLE outbox ADD COLUMN batch TEXT")  # Outbox from an older version
+            self.conn.execute(f"CREATE INDEX IF NOT EXISTS outbox_pending ON outbox (next_attempt) WHERE {_PENDING}")
+            self.conn.commit()
+        self.conn.row_factory = sqlite3.Row
+        self.lock = threading.Lock()  # The detection loop and the flusher share the connection
+
+    def enqueue(self, kind, payload, key=None):
+        """Commit an alert; returns its idempotency key (re-enqueuing a key is a no-op)"""
+        key = key or uuid.uuid4().hex
+        now = time.time()
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT OR IGNORE INTO outbox (key, kind, payload, created, next_attempt) VALUES (?, ?, ?, ?, ?)",
+                (key, kind, json.dumps(payload), now, now))
+        return key
+
+    def due(self, limit, now=None):
+        """Pending alerts ready for an attempt, oldest first"""
+        now = time.time() if now is None else now
+        with self.lock:
+            rows = self.conn.execute(
+                f"SELECT * FROM outbox WHERE {_PENDING} AND next_attempt <= ? ORDER BY id LIMIT ?",
+                (now, limit)).fetchall()
+        return [dict(row, payload=json.loads(row['payload'])) for row in rows]
+
+    def batch(self, batch):
+        """Pending alerts of a batch that was attempted before"""
+        with self.lock:
+            rows = self.conn.execute(f"SELECT * FROM outbox WHERE {_PENDING} AND batch = ? ORDER BY id",
+                                     (batch,)).fetchall()
+        return [dict(row, payload=json.loads(row['payload'])) for row in rows]
+
+    def assign_batch(self, ids, batch):
+        with self.lock, self.conn:
+            self.conn.executemany("UPDATE outbox SET batch = ? WHERE id = ?", [(batch, i) for i in ids])
+
+    def mark_delivered(self, ids):
+        now = time.time()
+        with self.lock, self.conn:
+            self.conn.executemany("UPDATE outbox SET delivered = ?, last_error = NULL WHERE id = ?",
+                                  [(now, i) for i in ids])
+
+    def mark_failed(self, ids, error, retry_at):
+        with self.lock, self.conn:
+            self.conn.executemany(
+                "UPDATE outbox SET attempts = attempts + 1, last_error = ?, next_attempt = ? WHERE id = ?",
+                [(error, retry_at, i) for i in ids])
+
+    def expire(self, max_age):
+        """Give up on alerts older than max_age seconds; returns how many"""
+        with self.lock, self.conn:
+            cursor = self.conn.execute(f"UPDATE outbox SET expired = 1 WHERE {_PENDING} AND created < ?",
+                                       (time.time() - max_age,))
+        return cursor.rowcount
+
+    def prune(self, keep):
+        """Delete finished alerts older than keep seconds"""
+        with self.lock, self.conn:
+            self.conn.execute(f"DELETE FROM outbox WHERE NOT ({_PENDING}) AND created < ?",
+                              (time.time() - keep,))
+
+    def stats(self):
+        """Backlog size, age of the oldest pending alert and recent delivery lag"""
+        now = time.time()
+        with self.lock:
+            backlog, oldest = self.conn.execute(
+                f"SELECT COUNT(*), MIN(created) FROM outbox WHERE {_PENDING}").fetchone()
+            last = self.conn.execute(
+                "SELECT delivered - created FROM outbox WHERE delivered IS NOT NULL "
+                "ORDER BY delivered DESC LIMIT 1").fetchone()
+            delivered, expired = self.conn.execute(
+                "SELECT COUNT(delivered), SUM(expired) FROM outbox").fetchone()
+            error = self.conn.execute(
+                f"SELECT last_error FROM outbox WHERE {_PENDING} AND last_error IS NOT NULL "
+                "ORDER BY id DESC LIMIT 1").fetchone()
+        return {
+            'backlog': backlog,
+            'oldest_pending_age': now - oldest if oldest is not None else 0.0,
+            'last_delivery_lag': last[0] if last else None,
+            'delivered': delivered,
+            'expired': expired or 0,
+            'last_error': error[0] if error else None,
+        }
+
+    def close(self):
+        self.conn.close()
+
+
+class OutboxFlusher:
+    """Background thread delivering outbox alerts in batches"""
+
+    def __init__(self, outbox, senders, config=None, metrics=None):
+        self.outbox = outbox
+        self.senders = senders  # kind -> callable(payloads, idempotency_key) returning True on success
+        self.config = config or Config()
+        self.metrics = metrics
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='alert-outbox', daemon=True)
+        self._last_prune = 0.0
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def wake(self):
+        """Deliver now instead of at the next poll"""
+        self._wake.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                while self.flush_once() and not self._stop.is_set():
+                    pass  # Full batch sent; more may be waiting
+            except Exception as e:
+                print(f"Alert outbox error: {e}")
+            self._wake.wait(self.config.ALERT_FLUSH_INTERVAL)
+            self._wake.clear()
+
+    def flush_once(self):
+        """Attempt one batch of due alerts; returns True if a full batch was delivered"""
+        now = time.time()
+        if now - self._last_prune >= 3600:
+            self._last_prune = now
+            expired = self.outbox.expire(self.config.ALERT_MAX_AGE)
+            if expired:
+                print(f"Gave up on {expired} alerts older than {self.config.ALERT_MAX_AGE}s")
+            self.outbox.prune(self.config.ALERT_OUTBOX_RETENTION)
+
+        due = self.outbox.due(self.config.ALERT_BATCH_SIZE, now)
+        if not due:
+            return False
+
+        # One request per kind. A retried batch is resent as it was; a new one
+        # takes the due alerts of the oldest alert's kind and is named by its key.
+        first = due[0]
+        if first['batch']:
+            batch = self.outbox.batch(first['batch'])
+        else:
+            batch = [alert for alert in due if alert['kind'] == first['kind'] and not alert['batch']]
+            self.outbox.assign_batch([alert['id'] for alert in batch], first['key'])
+        key = first['batch'] or first['key']
+        kind = first['kind']
+        ids = [alert['id'] for alert in batch]
+        sender = self.senders.get(kind)
+        try:
+            if sender is None:
+                raise ValueError(f"no sender for alert kind {kind!r}")
+            delivered = sender([alert['payload'] for alert in batch], key)
+            error = None if delivered else "not acknowledged"
+        except Exception as e:
+            delivered, error = False, str(e)
+
+        if delivered:
+            self.outbox.mark_delivered(ids)
+            if self.metrics:
+                self.metrics.inc('alerts_delivered', len(ids))
+            return len(due) == self.config.ALERT_BATCH_SIZE
+
+        attempts = max(alert['attempts'] for alert in batch)
+        delay = min(self.config.ALERT_RETRY_INITIAL * 2 ** attempts, self.config.ALERT_RETRY_MAX)
+        self.outbox.mark_failed(ids, error, time.time() + delay)
+        if self.metrics:
+            self.metrics.inc('alert_delivery_failures')
+        print(f"Alert delivery failed ({error}); {len(ids)} alerts kept, retry in {delay:.1f}s")
+        return False
+
+    def stop(self, timeout=5.0):
+        """Stop the thread; undelivered alerts stay queued for the next start
+
+        Returns False if the thread is still inside a delivery after the timeout.
+        """
+        self._stop.set()
+        self._wake.set()
+        self._thread.join(timeout)
+        return not self._thread.is_alive()
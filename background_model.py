@@ -0,0 +1,117 @@
+"""
+Incremental per-pixel background model.
+
+Ambient light shifts the absolute red ratio: daylight makes red surfaces and
+reflections pass the red thresholds, and the LED's own glow changes with the
+exposure. The background model keeps a running average of each pixel's red
+signal (the R channel, or luma for the lores stream) and counts a red pixel
+only when it is brighter than its background by BACKGROUND_MIN_DELTA, so
+red that is always there does not add to the red ratio.
+
+- A global gain, measured on the pixels that are not red, scales the
+  background before comparing. A room light switching on therefore does not
+  turn every red surface into foreground.
+- The background follows changes with a time constant of
+  BACKGROUND_TIME_CONSTANT seconds (cv2.accumulateWeighted, in place).
+  Foreground pixels (the lit LED) are only absorbed over
+  BACKGROUND_ABSORB_TIME, so a steady LED keeps being detected.
+- All buffers are allocated when the frame size changes; a frame costs a few
+  O(pixels) OpenCV passes into them and no allocation.
+
+The background is indexed by crop pixel position, so it is reset whenever
+the detection box moves or changes size (see follow()). The first frame
+after a reset initializes the background and is judged on the absolute red
+count.
+"""
+
+import math
+import time
+
+import cv2
+import numpy as np
+
+from config import Config
+
+
+class BackgroundModel:
+    def __init__(self, config=None):
+        self.config = config or Config()
+        self.shape = None
+        self.box = None  # Detection box the background was built on
+        self.background = None  # float32 running average of the red signal
+        self.last_update = None
+        self.frames = 0
+
+    def reset(self):
+        """Forget the background; the next frame re-initializes it"""
+        self.shape = None
+
+    def follow(self, box):
+        """Reset when the detection box moved: its pixels no longer line up with the background"""
+        if box != self.box:
+            self.box = box
+            self.reset()
+
+    def _allocate(self, shape):
+        self.shape = shape
+        self.background = np.zeros(shape, dtype=np.float32)
+        self.signal = np.zeros(shape, dtype=np.uint8)
+        self.red = np.zeros(shape, dtype=np.uint8)
+        self.not_red = np.zeros(shape, dtype=np.uint8)
+        self.difference = np.zeros(shape, dtype=np.float32)
+        self.foreground = np.zeros(shape, dtype=np.uint8)
+        self.not_foreground = np.zeros(shape, dtype=np.uint8)
+        self.last_update = None
+
+    def _alpha(self, time_constant, elapsed):
+        """Per-update weight for a time constant in seconds (0 = never update)"""
+        if time_constant <= 0:
+            return 0.0
+        return 1.0 - math.exp(-elapsed / time_constant)
+
+    def foreground_rgb(self, image, red_mask, now=None):
+        """Foreground red pixel count of an RGB image and its 0/255 red mask"""
+        height, width = image.shape[:2]
+        if self.shape != (height, width):
+            self._allocate((height, width))
+        cv2.extractChannel(image, 0, dst=self.signal)
+        return self._update(red_mask, now)
+
+    def foreground_yuv(self, y, red_mask, now=None):
+        """Foreground red pixel count of a YUV420 frame, red mask at chroma resolution"""
+        if self.shape != red_mask.shape:
+            self._allocate(red_mask.shape)
+        cv2.resize(y, (self.shape[1], self.shape[0]), dst=self.signal, interpolation=cv2.INTER_NEAREST)
+        return self._update(red_mask, now)
+
+    def _update(self, red_mask, now):
+        cv2.compare(red_mask.view(np.uint8), 0, cv2.CMP_GT, dst=self.red)  # bool or 0/255 -> 0/255
+        now = time.monotonic() if now is None else now
+        self.frames += 1
+        if self.last_update is None:
+            self.background[:] = self.signal
+            self.last_update = now
+            return cv2.countNonZero(self.red)
+
+        # Global illumination change, measured where nothing is red
+        cv2.bitwise_not(self.red, dst=self.not_red)
+        current = cv2.mean(self.signal, mask=self.not_red)[0]
+        reference = cv2.mean(self.background, mask=self.not_red)[0]
+        gain = current / reference if reference >= 1.0 else 1.0
+
+        cv2.addWeighted(self.signal, 1.0, self.background, -gain, 0.0, dst=self.difference,
+                        dtype=cv2.CV_32F)
+        cv2.compare(self.difference, self.config.BACKGROUND_MIN_DELTA, cv2.CMP_GT, dst=self.foreground)
+        cv2.bitwise_and(self.foreground, self.red, dst=self.foreground)
+
+        elapsed = now - self.last_update
+        self.last_update = now
+        cv2.bitwise_not(self.foreground, dst=self.not_foreground)
+        cv2.accumulateWeighted(self.signal, self.background,
+                               self._alpha(self.config.BACKGROUND_TIME_CONSTANT, elapsed),
+                               mask=self.not_foreground)
+        absorb = self._alpha(self.config.BACKGROUND_ABSORB_TIME, elapsed)
+        if absorb > 0:
+            cv2.accumulateWeighted(self.signal, self.background, absorb, mask=self.foreground)
+
+        return cv2.countNonZero(self.foreground)
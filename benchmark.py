@@ -0,0 +1,291 @@
+#!/usr/bin/env python3
+"""
+Benchmark suite for the capture -> detect -> save -> alert pipeline.
+
+Usage:
+    python3 benchmark.py                           # run and print results
+    python3 benchmark.py --output bench.json       # also write JSON results
+    python3 benchmark.py --compare baseline.json   # flag regressions
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+from unittest import mock
+
+import cv2
+import numpy as np
+
+# Frame sizes (width, height) from the LED ROI up to the full still resolution
+FRAME_SIZES = {
+    'roi': (96, 54),        # CAMERA_ROI (5% x 5%) of a 1080p frame
+    'crop': (384, 432),     # CROP_* region of a 1080p frame
+    '480p': (640, 480),
+    '720p': (1280, 720),
+    '1080p': (1920, 1080),
+}
+
+DEFAULT_TOLERANCE = 0.15  # 15% slower than baseline counts as a regression
+MIN_REGRESSION_MS = 0.05  # Ignore slowdowns smaller than timer noise
+
+
+def make_frame(width, height, led_on=True, seed=0):
+    """Create a deterministic synthetic RGB meter frame"""
+    rng = np.random.default_rng(seed)
+    image = rng.integers(40, 60, size=(height, width, 3), dtype=np.uint8)
+
+    if led_on:
+        center = (width // 2, height // 2)
+        radius = max(2, min(width, height) // 8)
+        cv2.circle(image, center, radius, (255, 0, 0), -1)  # Red in RGB
+
+    return image
+
+
+def time_call(func, repeat, warmup=2):
+    """Time func() repeat times and return per-call statistics in milliseconds"""
+    for _ in range(warmup):
+        func()
+
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - start) * 1000.0)
+
+    samples.sort()
+    p95_index = min(len(samples) - 1, int(round(0.95 * (len(samples) - 1))))
+    median = statistics.median(samples)
+
+    return {
+        'repeat': repeat,
+        'min_ms': samples[0],
+        'median_ms': median,
+        'mean_ms': statistics.fmean(samples),
+        'p95_ms': samples[p95_index],
+        'stdev_ms': statistics.stdev(samples) if len(samples) > 1 else 0.0,
+        'ops_per_sec': 1000.0 / median if median > 0 else 0.0,
+    }
+
+
+def _make_camera(image_dir):
+    """Create a CameraManager that never touches real camera hardware"""
+    from camera_manager import CameraManager
+
+    with mock.patch.object(CameraManager, 'setup_camera'):
+        camera = CameraManager()
+    camera.config.IMAGE_DIR = image_dir
+    camera.config.IMAGE_INDEX_FILE = os.path.join(image_dir, 'index.db')
+    return camera
+
+
+def _make_alert_manager():
+    """Create an AlertManager with network and audio calls mocked out"""
+    from alert_manager import AlertManager
+    from config import Config
+
+    config = Config()
+    config.SMART_BULB_API_URL = 'http://bench.invalid'
+    config.AUDIO_ALERT_ENABLED = True
+    config.ALERT_OUTBOX_FILE = os.path.join(tempfile.mkdtemp(prefix='lightdetect_bench_'), 'alerts.db')
+    return AlertManager(config=config)  # Never the production outbox
+
+
+def run_benchmarks(repeat=20, sizes=None):
+    """Run every benchmark and return a dict keyed by 'name[size]'"""
+    from background_model import BackgroundModel
+    from light_detector import DetectionParams, LightDetector, bgr_to_yuv420
+    from pixel_classifier import train
+
+    sizes = sizes or list(FRAME_SIZES)
+    detector = LightDetector()
+    results = {}
+
+    # Pixel classifier backend, trained on one synthetic on/off pair
+    classifier_params = DetectionParams(detector.config)
+    classifier_params.classifier = train([(make_frame(384, 432), 1, None),
+                                          (make_frame(384, 432, led_on=False), 0, None)])
+    classifier_params.threshold = classifier_params.classifier.ratio_threshold
+
+    image_dir = tempfile.mkdtemp(prefix='lightdetect_bench_')
+    try:
+        camera = _make_camera(image_dir)
+
+        for size in sizes:
+            width, height = FRAME_SIZES[size]
+            frame = make_frame(width, height)
+            analysis = detector.analyze_image(frame)
+
+            results[f'detect_red_light[{size}]'] = time_call(
+                lambda: detector.detect_red_light(frame), repeat)
+            results[f'analyze_image[{size}]'] = time_call(
+                lambda: detector.analyze_image(frame), repeat)
+            with mock.patch.object(detector.config, 'EARLY_EXIT_ENABLED', True):
+                early_exit_params = DetectionParams(detector.config)
+            with mock.patch.object(detector, 'params', early_exit_params):
+                results[f'analyze_image_early_exit[{size}]'] = time_call(
+                    lambda: detector.analyze_image(frame), repeat)
+            planes = bgr_to_yuv420(cv2.cvtColor(frame, cv2.COLOR_RGB2BGR)[:height & ~3, :width & ~1])
+            results[f'analyze_yuv420[{size}]'] = time_call(
+                lambda: detector.analyze_yuv420(*planes), repeat)
+            results[f'detect_red_light_classifier[{size}]'] = time_call(
+                lambda: detector.detect_red_light(frame, classifier_params), repeat)
+            with mock.patch.object(detector, 'params', classifier_params):
+                classifier_params.yuv_lut  # Build outside the timed calls
+                results[f'analyze_yuv420_classifier[{size}]'] = time_call(
+                    lambda: detector.analyze_yuv420(*planes), repeat)
+            background = BackgroundModel(detector.config)
+            red_mask = detector.red_mask(frame)
+            background.foreground_rgb(frame, red_mask)
+            results[f'background_update[{size}]'] = time_call(
+                lambda: background.foreground_rgb(frame, red_mask), repeat)
+            results[f'create_debug_image[{size}]'] = time_call(
+                lambda: detector.create_debug_image(frame, analysis), repeat)
+            results[f'crop_to_detection_region[{size}]'] = time_call(
+                lambda: camera._crop_to_detection_region(frame), repeat)
+            results[f'save_image[{size}]'] = time_call(
+                lambda: camera._save_image(frame), repeat)
+
+        # Cleanup cost with a full image directory
+        from image_store import ImageStore
+        camera.image_store.close()
+        cleanup_dir = os.path.join(image_dir, 'cleanup')
+        os.makedirs(cleanup_dir)
+        camera.config.IMAGE_DIR = cleanup_dir
+        camera.config.IMAGE_INDEX_FILE = os.path.join(cleanup_dir, 'index.db')
+        store = ImageStore(camera.config, background=False)
+
+        def cleanup_full_dir():
+            rows = []
+            for i in range(camera.config.MAX_IMAGES + 10):
+                filename = f'capture_{i:08d}.jpg'
+                open(os.path.join(cleanup_dir, filename), 'wb').close()
+                rows.append((filename, i))
+            with store.index.conn:
+                store.index.conn.executemany(
+                    "INSERT OR REPLACE INTO captures (filename, timestamp) VALUES (?, ?)", rows)
+            store.cleanup()
+
+        results['cleanup_old_images'] = time_call(cleanup_full_dir, repeat)
+
+        # Stage timer overhead (should stay well under 1% of a cycle)
+        from metrics import PipelineMetrics
+        metrics = PipelineMetrics(os.path.join(image_dir, 'metrics.bin'))
+
+        def stage_timer():
+            with metrics.time('detect'):
+                pass
+
+        results['metrics_stage_timer'] = time_call(stage_timer, repeat)
+
+    finally:
+        shutil.rmtree(image_dir, ignore_errors=True)
+
+    # Alert dispatch with HTTP and audio mocked out
+    alert_manager = _make_alert_manager()
+    response = mock.Mock(status_code=200)
+
+    def trigger_alert():
+        alert_manager.last_alert_time = None
+        alert_manager.alert_count = 0
+        alert_manager.trigger_alert({'detected': True})
+
+    with mock.patch('requests.post', return_value=response), \
+            mock.patch('alert_manager.subprocess.run'), \
+            mock.patch('alert_manager.os.path.exists', return_value=True), \
+            mock.patch('builtins.print'):
+        results['trigger_alert[mocked]'] = time_call(trigger_alert, repeat)
+        alert_manager.cleanup()
+    shutil.rmtree(os.path.dirname(alert_manager.config.ALERT_OUTBOX_FILE), ignore_errors=True)
+
+    return results
+
+
+def collect_metadata():
+    """Describe the machine and library versions the results came from"""
+    return {
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'numpy': np.__version__,
+        'opencv': cv2.__version__,
+    }
+
+
+def compare_results(current, baseline, tolerance=DEFAULT_TOLERANCE):
+    """
+    Compare median timings against a baseline
+    Returns: list of (name, baseline_ms, current_ms, ratio, regressed)
+    """
+    rows = []
+    for name, result in current.items():
+        if name not in baseline:
+            continue
+        base_ms = baseline[name]['median_ms']
+        cur_ms = result['median_ms']
+        ratio = cur_ms / base_ms if base_ms > 0 else float('inf')
+        regressed = ratio > 1.0 + tolerance and cur_ms - base_ms > MIN_REGRESSION_MS
+        rows.append((name, base_ms, cur_ms, ratio, regressed))
+    return rows
+
+
+def print_results(results):
+    """Print results as a table"""
+    print(f"{'benchmark':<36} {'median ms':>10} {'p95 ms':>10} {'ops/s':>10}")
+    print("-" * 70)
+    for name, result in results.items():
+        print(f"{name:<36} {result['median_ms']:>10.3f} {result['p95_ms']:>10.3f} "
+              f"{result['ops_per_sec']:>10.1f}")
+
+
+def print_comparison(rows, tolerance):
+    """Print a baseline comparison table"""
+    print(f"\nComparison against baseline (tolerance {tolerance:.0%})")
+    print(f"{'benchmark':<36} {'base ms':>10} {'now ms':>10} {'ratio':>7}")
+    print("-" * 70)
+    for name, base_ms, cur_ms, ratio, regressed in rows:
+        flag = '  REGRESSION' if regressed else ''
+        print(f"{name:<36} {base_ms:>10.3f} {cur_ms:>10.3f} {ratio:>7.2f}{flag}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the light detection pipeline")
+    parser.add_argument('--repeat', type=int, default=20, help="timed iterations per benchmark")
+    parser.add_argument('--sizes', nargs='+', choices=list(FRAME_SIZES), help="frame sizes to run")
+    parser.add_argument('--output', help="write JSON results to this file")
+    parser.add_argument('--compare', help="baseline JSON file to compare against")
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help="allowed slowdown ratio before flagging a regression")
+    args = parser.parse_args()
+
+    results = run_benchmarks(repeat=args.repeat, sizes=args.sizes)
+    report = {'meta': collect_metadata(), 'results': results}
+
+    print_results(results)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"\nResults written to {args.output}")
+
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            baseline = json.load(f)
+        rows = compare_results(results, baseline['results'], args.tolerance)
+        print_comparison(rows, args.tolerance)
+        if any(row[4] for row in rows):
+            print("\n⚠️ Performance regressions detected")
+            sys.exit(1)
+        print("\n✅ No regressions")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+"""
+Threshold sweep and auto-calibration for the HSV red light detector.
+
+Each labeled image is reduced once to a compact 3D HSV histogram (full hue
+resolution, saturation/value quantized to SV_STEP). Suffix sums over that
+histogram turn "pixels with H <= hue_max and S >= sat_min and V >= val_min"
+into a table lookup, so every (RED_HUE_MAX, RED_SATURATION_MIN, RED_VALUE_MIN,
+RED_LIGHT_THRESHOLD) combination is scored without re-thresholding pixels.
+
+Usage:
+    python3 calibrate.py --on samples/on --off samples/off
+    python3 calibrate.py --labels labels.csv --output calibration.json
+"""
+
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+from config import Config
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+
+HUE_BINS = 180
+SV_STEP = 8  # Saturation/value resolution; candidate minimums are multiples of this
+SV_BINS = 256 // SV_STEP
+HUE_WRAP_MIN = 160  # Second red hue band used by LightDetector (160-180)
+
+DEFAULT_HUE_CANDIDATES = list(range(0, 41, 2))
+DEFAULT_THRESHOLDS = [round(t, 3) for t in np.arange(0.005, 0.6, 0.005)]
+
+
+def build_histogram(image_rgb):
+    """Compact 3D HSV histogram (hue x saturation x value) of an RGB image"""
+    hsv = cv2.cvtColor(image_rgb, cv2.COLOR_RGB2HSV)
+    hist = cv2.calcHist([hsv], [0, 1, 2], None, [HUE_BINS, SV_BINS, SV_BINS],
+                        [0, 180, 0, 256, 0, 256])
+    return hist.astype(np.uint32)
+
+
+def red_pixel_table(hist, hue_candidates):
+    """
+    Red pixel counts for every candidate setting, via box sums over the histogram
+    Returns: array [len(hue_candidates), SV_BINS, SV_BINS] where entry [h, s, v]
+    counts pixels LightDetector would mark red with RED_HUE_MAX=hue_candidates[h],
+    RED_SATURATION_MIN=s*SV_STEP and RED_VALUE_MIN=v*SV_STEP
+    """
+    # Suffix sums over S and V: count of pixels with S >= s and V >= v per hue
+    at_least = hist[:, ::-1, ::-1].cumsum(axis=1).cumsum(axis=2)[:, ::-1, ::-1]
+    # Prefix sum over hue: count with H <= h
+    by_hue = at_least.cumsum(axis=0, dtype=np.int64)
+
+    hue_max = np.minimum(np.asarray(hue_candidates), HUE_BINS - 1)
+    low_band = by_hue[hue_max]
+    # Pixels in the 160-180 band not already covered by [0, hue_max]
+    wrap_start = np.maximum(hue_max, HUE_WRAP_MIN - 1)
+    high_band = by_hue[HUE_BINS - 1][np.newaxis] - by_hue[wrap_start]
+    return low_band + high_band
+
+
+def load_labels(on_dirs, off_dirs, labels_csv):
+    """Return a list of (path, label) pairs"""
+    samples = []
+    for directories, label in ((on_dirs or [], 1), (off_dirs or [], 0)):
+        for directory in directories:
+            for name in sorted(os.listdir(directory)):
+                if name.lower().endswith(IMAGE_EXTENSIONS):
+                    samples.append((os.path.join(directory, name), label))
+
+    if labels_csv:
+        base = os.path.dirname(labels_csv)
+        with open(labels_csv, newline='') as f:
+            for row in csv.DictReader(f):
+                label = str(row['label']).strip().lower() in ('1', 'true', 'on', 'yes')
+                samples.append((os.path.join(base, row['path']), int(label)))
+
+    return samples
+
+
+def score_images(samples, hue_candidates):
+    """Build histograms and red ratio tables for all labeled images"""
+    ratios = []
+    labels = []
+    for path, label in samples:
+        image = cv2.imread(path)
+        if image is None:
+            print(f"Skipping unreadable image: {path}", file=sys.stderr)
+            continue
+        image_rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+        total = image_rgb.shape[0] * image_rgb.shape[1]
+        table = red_pixel_table(build_histogram(image_rgb), hue_candidates)
+        # float64 so ratio > threshold matches LightDetector exactly at the boundary
+        ratios.append((table / total).ravel())
+        labels.append(label)
+
+    return np.array(ratios), np.array(labels, dtype=bool)
+
+
+def sweep(ratios, labels, thresholds):
+    """
+    Confusion counts for every setting and RED_LIGHT_THRESHOLD
+    Returns: (tp, fp) arrays of shape [settings, thresholds]
+    """
+    thresholds = np.asarray(thresholds)
+    # Detection is ratio > threshold, so image i fires for thresholds[:k_i]
+    k = np.searchsorted(thresholds, ratios, side='left')
+    n_thresholds = len(thresholds)
+
+    def fired_counts(rows):
+        counts = np.zeros((ratios.shape[1], n_thresholds + 1), dtype=np.int64)
+        settings = np.broadcast_to(np.arange(ratios.shape[1]), rows.shape)
+        np.add.at(counts, (settings.ravel(), rows.ravel()), 1)
+        # Images with k_i > t fire at threshold t: reverse cumulative sum
+        return counts[:, ::-1].cumsum(axis=1)[:, ::-1][:, 1:]
+
+    return fired_counts(k[labels]), fired_counts(k[~labels])
+
+
+def pareto_frontier(points):
+    """Keep points not dominated in (precision, recall)"""
+    frontier = []
+    best_precision = -1.0
+    for point in sorted(points, key=lambda p: (-p['recall'], -p['precision'])):
+        if point['precision'] > best_precision:
+            frontier.append(point)
+            best_precision = point['precision']
+    return frontier
+
+
+def calibrate(samples, hue_candidates=None, thresholds=None, beta=1.0):
+    """Run the full sweep; returns a dict with the frontier and recommendation"""
+    hue_candidates = hue_candidates or DEFAULT_HUE_CANDIDATES
+    thresholds = thresholds or DEFAULT_THRESHOLDS
+
+    start = time.monotonic()
+    ratios, labels = score_images(samples, hue_candidates)
+    histogram_time = time.monotonic() - start
+    if not labels.any() or labels.all():
+        raise ValueError("Need both 'on' and 'off' labeled images")
+
+    start = time.monotonic()
+    tp, fp = sweep(ratios, labels, thresholds)
+    positives = labels.sum()
+    precision = np.divide(tp, tp + fp, out=np.ones(tp.shape), where=(tp + fp) > 0)
+    recall = tp / positives
+    beta2 = beta * beta
+    denom = beta2 * precision + recall
+    f_score = np.divide((1 + beta2) * precision * recall, denom, out=np.zeros(tp.shape), where=denom > 0)
+    sweep_time = time.monotonic() - start
+
+    shape = (len(hue_candidates), SV_BINS, SV_BINS)
+
+    def describe(setting, t):
+        h, s, v = np.unravel_index(setting, shape)
+        return {
+            'RED_HUE_MAX': int(hue_candidates[h]),
+            'RED_SATURATION_MIN': int(s * SV_STEP),
+            'RED_VALUE_MIN': int(v * SV_STEP),
+            'RED_LIGHT_THRESHOLD': float(thresholds[t]),
+            'precision': float(precision[setting, t]),
+            'recall': float(recall[setting, t]),
+            'f_score': float(f_score[setting, t]),
+        }
+
+    # Many settings share the same confusion counts; keep one per (tp, fp) pair
+    key = tp * (len(labels) + 1) + fp
+    _, first = np.unique(key[tp > 0], return_index=True)
+    candidates = np.flatnonzero(tp > 0)[first]
+    frontier = pareto_frontier([describe(*np.unravel_index(i, tp.shape)) for i in candidates])
+
+    setting, t = np.unravel_index(np.argmax(f_score), f_score.shape)
+    return {
+        'images': int(len(labels)),
+        'positives': int(positives),
+        'settings_evaluated': int(f_score.size),
+        'histogram_seconds': histogram_time,
+        'sweep_seconds': sweep_time,
+        'recommended': describe(setting, t),
+        'frontier': frontier,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Calibrate HSV detection thresholds from labeled images")
+    parser.add_argument('--on', nargs='+', help="directories of images with the LED on")
+    parser.add_argument('--off', nargs='+', help="directories of images with the LED off")
+    parser.add_argument('--labels', help="CSV file with 'path' and 'label' columns")
+    parser.add_argument('--beta', type=float, default=1.0,
+                        help="F-beta weighting for the recommendation (>1 favors recall)")
+    parser.add_argument('--output', help="write the full result as JSON")
+    args = parser.parse_args()
+
+    samples = load_labels(args.on, args.off, args.labels)
+    if not samples:
+        parser.error("no labeled images given (use --on/--off or --labels)")
+
+    result = calibrate(samples, beta=args.beta)
+
+    print(f"Scored {result['settings_evaluated']:,} settings over {result['images']} images "
+          f"({result['positives']} on) - histograms {result['histogram_seconds']:.2f}s, "
+          f"sweep {result['sweep_seconds']:.2f}s")
+
+    print("\nPrecision/recall frontier")
+    print(f"{'precision':>9} {'recall':>7}  {'hue_max':>7} {'sat_min':>7} {'val_min':>7} {'threshold':>9}")
+    for point in result['frontier']:
+        print(f"{point['precision']:>9.3f} {point['recall']:>7.3f}  {point['RED_HUE_MAX']:>7} "
+              f"{point['RED_SATURATION_MIN']:>7} {point['RED_VALUE_MIN']:>7} "
+              f"{point['RED_LIGHT_THRESHOLD']:>9.3f}")
+
+    rec = result['recommended']
+    print(f"\nRecommended config.py values (F{args.beta:g} = {rec['f_score']:.3f}, "
+          f"precision {rec['precision']:.3f}, recall {rec['recall']:.3f}):")
+    print(f"    RED_LIGHT_THRESHOLD = {rec['RED_LIGHT_THRESHOLD']}  # currently {Config.RED_LIGHT_THRESHOLD}")
+    print(f"    RED_HUE_MAX = {rec['RED_HUE_MAX']}  # currently {Config.RED_HUE_MAX}")
+    print(f"    RED_SATURATION_MIN = {rec['RED_SATURATION_MIN']}  # currently {Config.RED_SATURATION_MIN}")
+    print(f"    RED_VALUE_MIN = {rec['RED_VALUE_MIN']}  # currently {Config.RED_VALUE_MIN}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2)
+        print(f"\nFull results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -4,28 +4,50 @@ import time
 import os
 from datetime import datetime
 from config import Config
+from metrics import NullMetrics
+from light_detector import DetectionParams, LightDetector, bgr_to_yuv420, split_yuv420
 
 class CameraManager:
-    def __init__(self):
+    def __init__(self, metrics=None):
         self.config = Config()
+        self.metrics = metrics or NullMetrics()
+        self.params = DetectionParams(self.config)  # Replaced as a whole on config reload
         self.picam2 = None
+        self.frame_source = None
+        self.recorder = None
+        self.warmup_frames = 0
+        self.warmup_time = 0.0
+        self.last_capture = None  # Last RGB crop, or (main frame, precropped) from capture_yuv
+        self.image_store = None  # Created on the first save
+        self.roi_tracker = None
+        self.capture_scale = 1.0  # Thermal control: main stream size relative to CAMERA_RESOLUTION
+        self.crop_scale = 1.0  # Thermal control: configured crop shrunk around its center
+        self.detection_box = None  # Pixel box of the last capture's crop (None for precropped replays)
+        if self.config.ROI_TRACKING_ENABLED:
+            from roi_tracker import RoiTracker
+            self.roi_tracker = RoiTracker()
+            self._mask_detector = LightDetector()
         self.setup_camera()
         
     def setup_camera(self):
         """Initialize the Pi Camera"""
+        if self.config.CAMERA_SOURCE:
+            self.setup_replay(self.config.CAMERA_SOURCE)
+            return
+        
         try:
             # Try to import picamera2
             try:
                 from picamera2 import Picamera2
                 self.picam2 = Picamera2()
-                camera_config = self.picam2.create_still_configuration(
-                    main={"size": self.config.CAMERA_RESOLUTION},
-                    controls={"FrameDurationLimits": (33333, 33333)}  # 30 FPS
-                )
-                self.picam2.configure(camera_config)
+                lores = None
+                if self.config.DETECTION_STREAM == 'lores':
+                    lores = {"size": self.config.LORES_RESOLUTION, "format": "YUV420"}
+                self._configure(lores)
                 self.picam2.start()
-                time.sleep(2)  # Allow camera to warm up
-                print("Camera initialized successfully with picamera2")
+                self._wait_for_convergence()
+                print(f"Camera initialized successfully with picamera2 "
+                      f"(AE/AWB settled after {self.warmup_frames} frames, {self.warmup_time:.2f}s)")
             except ImportError:
                 print("picamera2 not available - this is expected on non-Pi systems")
                 self.picam2 = None
@@ -37,30 +59,301 @@ class CameraManager:
             print(f"Failed to initialize camera: {e}")
             self.picam2 = None
     
+    def _configure(self, lores):
+        """Configure the main stream at CAMERA_RESOLUTION scaled by capture_scale"""
+        width, height = self.config.CAMERA_RESOLUTION
+        main = {"size": (int(width * self.capture_scale) & ~1, int(height * self.capture_scale) & ~1)}
+        camera_config = self.picam2.create_still_configuration(
+            main=main,
+            lores=lores,
+            controls={"FrameDurationLimits": (33333, 33333)}  # 30 FPS
+        )
+        self.picam2.align_configuration(camera_config)
+        self.picam2.configure(camera_config)
+    
+    def set_params(self, params):
+        """Swap in reloaded detection parameters (crop box and the ROI tracker's red mask)"""
+        self.params = params
+        if self.roi_tracker is not None:
+            self._mask_detector.params = params
+    
+    def set_quality(self, capture_scale=1.0, crop_scale=1.0):
+        """
+        Change the capture resolution and crop size (thermal control)
+        The camera is reconfigured in place; replay frames are decimated instead.
+        """
+        self.crop_scale = crop_scale
+        if capture_scale == self.capture_scale:
+            return
+        self.capture_scale = capture_scale
+        if self.picam2 is None:
+            return
+        try:
+            lores = None
+            if self.config.DETECTION_STREAM == 'lores':
+                lores = {"size": self.config.LORES_RESOLUTION, "format": "YUV420"}
+            self.picam2.stop()
+            self._configure(lores)
+            self.picam2.start()
+            self._wait_for_convergence()
+        except Exception as e:
+            print(f"Error changing capture resolution: {e}")
+    
+    def reinitialize(self):
+        """
+        Close and reopen the camera to recover from a failure
+        Returns True if the camera is available again. Replay sources are kept.
+        """
+        if self.frame_source is not None:
+            return True
+        
+        if self.picam2 is not None:
+            try:
+                self.picam2.close()
+            except Exception as e:
+                print(f"Error closing camera: {e}")
+            self.picam2 = None
+        
+        self.warmup_frames = 0
+        self.setup_camera()
+        return self.picam2 is not None
+    
+    def _wait_for_convergence(self):
+        """Wait until auto-exposure and white balance settle instead of a fixed sleep"""
+        start = time.monotonic()
+        deadline = start + self.config.CAMERA_WARMUP_TIMEOUT
+        tolerance = self.config.CAMERA_WARMUP_TOLERANCE
+        previous = None
+        stable = 0
+        
+        while time.monotonic() < deadline:
+            metadata = self.picam2.capture_metadata()
+            self.warmup_frames += 1
+            
+            if metadata.get('AeLocked'):
+                break
+            
+            gains = metadata.get('ColourGains') or (0.0, 0.0)
+            current = (metadata.get('ExposureTime', 0), metadata.get('AnalogueGain', 0.0)) + tuple(gains)
+            if previous is not None and all(
+                    abs(c - p) <= tolerance * max(abs(p), 1e-6) for c, p in zip(current, previous)):
+                stable += 1
+                if stable >= self.config.CAMERA_WARMUP_STABLE_FRAMES:
+                    break
+            else:
+                stable = 0
+            previous = current
+        
+        self.warmup_time = time.monotonic() - start
+    
+    def setup_replay(self, path):
+        """Replay recorded frames instead of using the camera"""
+        from frame_source import create_frame_source
+        
+        self.frame_source = create_frame_source(
+            path, fps=self.config.REPLAY_FPS, loop=self.config.REPLAY_LOOP)
+        print(f"Replaying {len(self.frame_source)} frames from {path}")
+    
     def capture_image(self, save_image=True):
         """Capture an image and optionally save it"""
         try:
-            if self.picam2 is None:
-                # Create a mock image for testing
-                return self._create_mock_image()
+            if self.picam2 is None and self.frame_source is None:
+                # Never pass a synthetic frame off as a capture outside development
+                return self._create_mock_image() if self.config.MOCK_CAMERA else None
             
             # Capture image
-            image = self.picam2.capture_array()
+            with self.metrics.time('capture'):
+                image, metadata = self._capture_frame()
             
-            # Convert BGR to RGB
-            image_rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+            if image is None:
+                return None  # Replay exhausted
             
-            # Crop to detection region
-            cropped_image = self._crop_to_detection_region(image_rgb)
+            if self.frame_source is not None and self.frame_source.precropped:
+                cropped_image = image
+            else:
+                # Convert BGR to RGB
+                with self.metrics.time('color_convert'):
+                    image_rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+                
+                if self.roi_tracker is not None and self.roi_tracker.needs_scan():
+                    self._scan_for_led(self._mask_detector.red_mask(image_rgb))
+                
+                # Crop to detection region
+                with self.metrics.time('crop'):
+                    self.detection_box = self._detection_box(*image_rgb.shape[:2])
+                    cropped_image = self._crop_to_detection_region(image_rgb)
+                
+                if self.roi_tracker is not None:
+                    self.roi_tracker.update(self._mask_detector.red_mask(cropped_image))
+                
+                if self.config.RECORD_RAW_FRAMES:
+                    self._record_frame(cropped_image, image.shape, metadata)
             
+            self.last_capture = cropped_image
             if save_image:
-                self._save_image(cropped_image)
+                with self.metrics.time('save'):
+                    self._save_image(cropped_image)
             
             return cropped_image
             
         except Exception as e:
             print(f"Error capturing image: {e}")
-            return self._create_mock_image()
+            return None
+    
+    def capture_yuv(self, save_image=True):
+        """
+        Capture the lores YUV420 stream cropped to the detection region
+        The full-resolution main stream is only fetched when archiving.
+        Returns: (y, u, v) planes, or None if no frame is available
+        """
+        try:
+            width, height = self.config.LORES_RESOLUTION
+            
+            with self.metrics.time('capture'):
+                if self.picam2 is not None:
+                    if save_image:
+                        (main, lores), _ = self.picam2.capture_arrays(["main", "lores"])
+                    else:
+                        main, lores = None, self.picam2.capture_array("lores")
+                    planes = split_yuv420(lores, width, height)
+                else:
+                    # Replay or mock: derive the lores stream from the full frame
+                    if self.frame_source is not None:
+                        main, _ = self._capture_frame()
+                    elif self.config.MOCK_CAMERA:
+                        main = self._create_mock_image()
+                    else:
+                        main = None
+                    if main is None:
+                        return None  # Replay exhausted or no camera
+                    if self.frame_source is not None and self.frame_source.precropped:
+                        # Recorded crops are RGB already; trim to YUV420-friendly dimensions
+                        main = cv2.cvtColor(main, cv2.COLOR_RGB2BGR)
+                        lores = main[:main.shape[0] & ~3, :main.shape[1] & ~1]
+                    else:
+                        lores = cv2.resize(main, (width, height), interpolation=cv2.INTER_AREA)
+                    planes = bgr_to_yuv420(lores, self.config.LORES_FULL_RANGE)
+            
+            precropped = self.frame_source is not None and self.frame_source.precropped
+            if self.roi_tracker is not None and not precropped and self.roi_tracker.needs_scan():
+                self._scan_for_led(self._mask_detector.yuv_red_mask(*planes).view(np.uint8))
+            
+            with self.metrics.time('crop'):
+                if precropped:
+                    cropped_planes = planes
+                else:
+                    cropped_planes = self._crop_yuv(*planes)
+            
+            if self.roi_tracker is not None and not precropped:
+                self.roi_tracker.update(self._mask_detector.yuv_red_mask(*cropped_planes).view(np.uint8))
+            
+            self.last_capture = (main, precropped) if main is not None else None
+            if save_image and main is not None:
+                with self.metrics.time('save'):
+                    self._save_main(main, precropped)
+            
+            return cropped_planes
+            
+        except Exception as e:
+            print(f"Error capturing lores image: {e}")
+            return None
+    
+    def save_last_capture(self):
+        """
+        Save the most recent capture (for callers that capture with save_image=False)
+        The lores path on the camera fetches a fresh main frame, since none was captured.
+        """
+        try:
+            capture = self.last_capture
+            if capture is None and self.picam2 is not None and self.config.DETECTION_STREAM == 'lores':
+                capture = (self.picam2.capture_array("main"), False)
+            if capture is None:
+                return False
+            
+            with self.metrics.time('save'):
+                if isinstance(capture, tuple):
+                    self._save_main(*capture)
+                else:
+                    self._save_image(capture)
+            return True
+            
+        except Exception as e:
+            print(f"Error saving image: {e}")
+            return False
+    
+    def _save_main(self, main, precropped):
+        """Save a BGR main-stream frame cropped to the detection region"""
+        main_rgb = cv2.cvtColor(main, cv2.COLOR_BGR2RGB)
+        self._save_image(main_rgb if precropped else self._crop_to_detection_region(main_rgb))
+    
+    def _scan_for_led(self, mask):
+        """Run a full-frame LED scan and report when the ROI moves"""
+        previous = self.roi_tracker.roi
+        roi = self.roi_tracker.discover(mask)
+        if roi != previous:
+            print(f"LED found, tracking ROI {', '.join(f'{v:.3f}' for v in roi)} "
+                  f"({(roi[2] - roi[0]) * (roi[3] - roi[1]):.2%} of the frame)")
+        elif roi is None:
+            print("No LED found in full-frame scan, using the configured crop")
+    
+    def _crop_yuv(self, y, u, v):
+        """Crop Y, U, V planes to the detection region (even-aligned for chroma)"""
+        left, top, right, bottom = self._detection_box(*y.shape[:2])
+        left, top, right, bottom = left & ~1, top & ~1, right & ~1, bottom & ~1
+        self.detection_box = (left, top, right, bottom)
+        
+        return (y[top:bottom, left:right],
+                u[top // 2:bottom // 2, left // 2:right // 2],
+                v[top // 2:bottom // 2, left // 2:right // 2])
+    
+    def _capture_frame(self):
+        """Return (frame, metadata) from the replay source or the camera"""
+        if self.frame_source is not None:
+            frame = self.frame_source.read()
+            step = round(1 / self.capture_scale)
+            if frame is not None and step > 1 and not self.frame_source.precropped:
+                frame = frame[::step, ::step]  # Stands in for a lower camera resolution
+            return frame, {}
+        
+        if not self.config.RECORD_RAW_FRAMES:
+            return self.picam2.capture_array(), {}
+        
+        # A request gives the exposure metadata for exactly this frame
+        request = self.picam2.capture_request()
+        try:
+            return request.make_array("main"), request.get_metadata()
+        finally:
+            request.release()
+    
+    def _record_frame(self, image, source_shape, metadata):
+        """Append the cropped frame to the raw recording"""
+        try:
+            previous = None
+            if self.recorder is not None and not self.recorder.fits(image.shape):
+                # A crop reload or a thermal level grew the frame: continue in a larger recording
+                print(f"Frame {image.shape} outgrew recording slots {self.recorder.shape}, starting a new recording")
+                previous = self.recorder.shape
+                self.recorder.close()
+                self.recorder = None
+            if self.recorder is None:
+                from frame_recorder import FrameRecorder
+                # Size slots for the configured crop too, since a tracked ROI can grow
+                left, top, right, bottom = self._crop_box(*source_shape[:2])
+                slot_shape = (max(image.shape[0], bottom - top), max(image.shape[1], right - left),
+                              image.shape[2])
+                if previous:
+                    slot_shape = tuple(max(a, b) for a, b in zip(slot_shape, previous))
+                self.recorder = FrameRecorder(self.config.RECORD_FILE, slot_shape,
+                                              self.config.RECORD_CAPACITY)
+            
+            self.recorder.append(
+                image,
+                roi=self._detection_box(*source_shape[:2]),
+                exposure_us=metadata.get('ExposureTime', 0),
+                analog_gain=metadata.get('AnalogueGain', 0.0),
+            )
+        except Exception as e:
+            print(f"Error recording frame: {e}")
     
     def _create_mock_image(self):
         """Create a mock image for testing when camera is not available"""
@@ -80,45 +373,48 @@ class CameraManager:
         
         return image
     
+    def _detection_box(self, height, width):
+        """Pixel box (left, top, right, bottom) of the detection region"""
+        if self.roi_tracker is not None and self.roi_tracker.roi is not None:
+            left, top, right, bottom = self.roi_tracker.roi
+            return int(width * left), int(height * top), int(width * right), int(height * bottom)
+        
+        left, top, right, bottom = self._crop_box(height, width)
+        if self.crop_scale < 1.0:
+            shrink_x = int((right - left) * (1 - self.crop_scale) / 2)
+            shrink_y = int((bottom - top) * (1 - self.crop_scale) / 2)
+            left, top, right, bottom = left + shrink_x, top + shrink_y, right - shrink_x, bottom - shrink_y
+        return left, top, right, bottom
+    
+    def _crop_box(self, height, width):
+        """Pixel box of the configured CROP_* region"""
+        return self.params.crop_box(height, width)
+    
     def _crop_to_detection_region(self, image):
         """Crop image to focus on the LED area"""
-        height, width = image.shape[:2]
-        
-        left = int(width * self.config.CROP_LEFT)
-        top = int(height * self.config.CROP_TOP)
-        right = int(width * self.config.CROP_RIGHT)
-        bottom = int(height * self.config.CROP_BOTTOM)
+        left, top, right, bottom = self._detection_box(*image.shape[:2])
         
         return image[top:bottom, left:right]
     
     def _save_image(self, image):
-        """Save image with timestamp"""
-        if not os.path.exists(self.config.IMAGE_DIR):
-            os.makedirs(self.config.IMAGE_DIR)
-        
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        filename = f"{self.config.IMAGE_DIR}/capture_{timestamp}.jpg"
-        
-        # Convert RGB to BGR for saving
-        image_bgr = cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
-        cv2.imwrite(filename, image_bgr)
-        
-        # Clean up old images
-        self._cleanup_old_images()
+        """Save image with timestamp (thumbnails and indexing run in the background)"""
+        if self.image_store is None:
+            from image_store import ImageStore
+            self.image_store = ImageStore(self.config, metrics=self.metrics)
+        self.image_store.save(image)
     
     def _cleanup_old_images(self):
         """Keep only the most recent images"""
-        if not os.path.exists(self.config.IMAGE_DIR):
-            return
-        
-        files = [f for f in os.listdir(self.config.IMAGE_DIR) if f.endswith('.jpg')]
-        files.sort(reverse=True)  # Newest first
-        
-        # Remove excess files
-        for file in files[self.config.MAX_IMAGES:]:
-            os.remove(os.path.join(self.config.IMAGE_DIR, file))
+        if self.image_store is not None:
+            self.image_store.cleanup()
     
     def close(self):
         """Clean up camera resources"""
         if self.picam2:
-            self.picam2.close() 
\ No newline at end of file
+            self.picam2.close()
+        if self.frame_source:
+            self.frame_source.close()
+        if self.recorder:
+            self.recorder.close()
+        if self.image_store:
+            self.image_store.close()
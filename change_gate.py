@@ -0,0 +1,74 @@
+"""
+Change gating for the detection loop.
+
+Each frame is reduced to a tiny block-mean signature (CHANGE_GATE_SIZE square
+per channel). If no block moved by more than CHANGE_GATE_THRESHOLD since the
+last analyzed frame, the previous analysis is reused and the frame is not
+saved. A full analysis is still forced every CHANGE_GATE_MAX_AGE seconds.
+"""
+
+import time
+
+import cv2
+import numpy as np
+
+from config import Config
+
+
+class ChangeGate:
+    def __init__(self):
+        self.config = Config()
+        self.signature = None
+        self.analysis = None
+        self.last_analyzed = None
+        self._pending = None
+        self.frames = 0
+        self.reused = 0
+
+    def signature_of(self, image):
+        """Block means of an RGB image or a (y, u, v) plane tuple, plus its shape"""
+        planes = image if isinstance(image, tuple) else (image,)
+        size = (self.config.CHANGE_GATE_SIZE, self.config.CHANGE_GATE_SIZE)
+        # INTER_AREA averages whole blocks, so sensor noise mostly cancels out
+        blocks = [cv2.resize(p, size, interpolation=cv2.INTER_AREA).astype(np.int16) for p in planes]
+        return tuple(p.shape for p in planes), blocks
+
+    def check(self, image):
+        """
+        Return the previous analysis if the frame is unchanged, else None
+        After a None result, call store() with the new analysis.
+        """
+        self.frames += 1
+        signature = self.signature_of(image)
+        self._pending = signature
+
+        if self.signature is None or self.signature[0] != signature[0]:
+            return None
+        if time.monotonic() - self.last_analyzed >= self.config.CHANGE_GATE_MAX_AGE:
+            return None
+
+        change = max(int(np.abs(new - old).max()) for new, old in zip(signature[1], self.signature[1]))
+        if change > self.config.CHANGE_GATE_THRESHOLD:
+            return None
+
+        self.reused += 1
+        return dict(self.analysis, reused=True)
+
+    def store(self, analysis):
+        """Remember the analysis of the frame passed to the last check()"""
+        self.signature = self._pending
+        self.analysis = analysis
+        self.last_analyzed = time.monotonic()
+
+    def reset(self):
+        """Force a full analysis of the next frame (e.g. after detection settings change)"""
+        self.signature = None
+
+    def stats(self):
+        """Frames seen, analyses reused and the skip rate"""
+        return {
+            'frames': self.frames,
+            'analyzed': self.frames - self.reused,
+            'reused': self.reused,
+            'skip_rate': self.reused / self.frames if self.frames else 0.0,
+        }
@@ -8,6 +8,26 @@ class Config:
     CAMERA_RESOLUTION = (1920, 1080)  # Full HD
     CAMERA_FPS = 30
     CAMERA_ROTATION = 0  # Adjust if camera is mounted differently
+    CAMERA_WARMUP_TIMEOUT = 2.0  # Max seconds to wait for auto-exposure/white balance
+    CAMERA_WARMUP_TOLERANCE = 0.02  # Relative change treated as converged
+    CAMERA_WARMUP_STABLE_FRAMES = 3  # Consecutive stable frames required
+    MOCK_CAMERA = False  # Serve a synthetic frame when no camera is present (development only)
+    
+    # Health monitoring (see health.py): the camera is reinitialized in-process
+    # when captures keep failing, are too slow or frames stop arriving
+    HEALTH_ERROR_STREAK = 3  # Consecutive failed (or slow) captures before recovering
+    HEALTH_MAX_CAPTURE_LATENCY = 5.0  # Seconds; slower captures count towards the streak
+    HEALTH_MAX_FRAME_AGE = 60  # Seconds without a good frame before recovering
+    HEALTH_BACKOFF_INITIAL = 2.0  # Seconds before a second recovery attempt, doubling after
+    HEALTH_BACKOFF_MAX = 60.0
+    HEALTH_MAX_RECOVERIES = 5  # Failed recoveries before the systemd watchdog restarts the service
+    HEALTH_STALL_TIMEOUT = 30  # Seconds past DETECTION_INTERVAL without loop activity = hung
+    
+    # Detection stream: 'main' converts full frames to RGB/HSV, 'lores' classifies
+    # a low-resolution YUV420 stream directly (main is then only used for archiving)
+    DETECTION_STREAM = 'main'
+    LORES_RESOLUTION = (640, 360)  # Height must be a multiple of 4
+    LORES_FULL_RANGE = True  # picamera2 still configurations use full-range sYCC
     
     # Detection settings
     DETECTION_INTERVAL = 15  # seconds between checks
@@ -17,10 +37,65 @@ class Config:
     RED_SATURATION_MIN = 100  # Minimum saturation
     RED_VALUE_MIN = 100  # Minimum brightness
     
+    # Detector backend: 'hsv' uses the RED_* ranges above, 'classifier' a pixel
+    # classifier trained from labeled captures (see pixel_classifier.py), which
+    # brings its own red ratio threshold instead of RED_LIGHT_THRESHOLD
+    DETECTOR_BACKEND = 'hsv'
+    CLASSIFIER_MODEL_FILE = os.path.join(os.path.dirname(__file__), 'pixel_classifier.json')
+    
+    # Background model (see background_model.py): count only red pixels brighter
+    # than their running background, so ambient light and red surfaces do not
+    # add to the red ratio. Early-exit detection is not used while enabled, and
+    # the model itself is not used with ROI_TRACKING_ENABLED (the box moves).
+    BACKGROUND_MODEL_ENABLED = False
+    BACKGROUND_TIME_CONSTANT = 120.0  # Seconds for the background to follow a change
+    BACKGROUND_ABSORB_TIME = 3600.0  # Seconds for a steady foreground to fade into the background (0 = never)
+    BACKGROUND_MIN_DELTA = 40  # R (or luma) levels above the background for a red pixel to count
+    
+    # Early exit: a full-resolution prefilter that skips the HSV conversion outside
+    # the box of pixels bright enough in R to be red (same results; check with
+    # `reanalyze.py --early-exit`)
+    EARLY_EXIT_ENABLED = False
+    EARLY_EXIT_MAX_AREA = 0.5  # Frame fraction the box may cover before the whole frame is converted
+    
+    # Change gating: reuse the previous analysis and skip the JPEG save when the
+    # frame's block-mean signature has not changed (see change_gate.py)
+    CHANGE_GATE_ENABLED = False
+    CHANGE_GATE_SIZE = 16  # Signature is SIZE x SIZE block means per channel
+    CHANGE_GATE_THRESHOLD = 6  # Largest block-mean change (0-255) treated as noise
+    CHANGE_GATE_MAX_AGE = 300  # Force a full analysis at least this often (seconds)
+    
+    # Pipelined mode: capture, analysis and I/O in separate processes sharing
+    # frames through shared memory (see pipeline.py)
+    PIPELINE_ENABLED = False
+    PIPELINE_SLOTS = 4  # Frame slots in the shared ring (each CAMERA_RESOLUTION x 3 bytes)
+    PIPELINE_DROP_POLICY = 'drop'  # 'drop' new frames when the ring is full, or 'block' capture
+    PIPELINE_MAX_SAVE_BACKLOG = 2  # Skip JPEG saves while more frames than this wait for I/O
+    PIPELINE_REPORT_INTERVAL = 60  # Seconds between throughput log lines
+    
+    # Power metering: count LED pulses and roll power up into 1 s / 1 min /
+    # 1 h / 1 day buckets (see pulse_meter.py); needs a fast detection loop
+    PULSE_METER_ENABLED = False
+    METER_IMPULSES_PER_KWH = 1000  # Printed on the meter, e.g. "1000 imp/kWh"
+    PULSE_MIN_INTERVAL = 0.05  # Seconds; lit frames closer than this to a pulse are the same blink
+    ROLLUP_DB_FILE = os.path.join(os.path.dirname(__file__), 'power.db')
+    ROLLUP_FLUSH_INTERVAL = 5.0  # Seconds between writes of pending buckets
+    ROLLUP_RETENTION = (86400, 30 * 86400, 365 * 86400, 3650 * 86400)  # Seconds kept per resolution
+    
     # Alert settings
     ALERT_COOLDOWN = 300  # 5 minutes between alerts
     MAX_ALERTS_PER_HOUR = 12  # Prevent spam
     
+    # Alert outbox: network alerts are committed to SQLite and delivered in the
+    # background with retries (see alert_outbox.py)
+    ALERT_OUTBOX_FILE = os.path.join(os.path.dirname(__file__), 'alerts.db')
+    ALERT_BATCH_SIZE = 20  # Pending alerts covered by one delivery
+    ALERT_FLUSH_INTERVAL = 5.0  # Seconds between delivery attempts when idle
+    ALERT_RETRY_INITIAL = 5.0  # Seconds before the first retry, doubling after each failure
+    ALERT_RETRY_MAX = 300.0
+    ALERT_MAX_AGE = 24 * 3600  # Give up on alerts older than this (seconds)
+    ALERT_OUTBOX_RETENTION = 7 * 24 * 3600  # Keep delivered/expired alerts this long
+    
     # Smart bulb settings (Alexa/Home Assistant)
     SMART_BULB_API_URL = os.getenv('SMART_BULB_API_URL', '')
     SMART_BULB_API_KEY = os.getenv('SMART_BULB_API_KEY', '')
@@ -31,11 +106,18 @@ class Config:
     
     # Logging
     LOG_LEVEL = 'INFO'
-    LOG_FILE = os.path.join(os.path.dirname(__file__), 'light_detector.log')
+    LOG_FILE = os.path.join(os.path.dirname(__file__), 'light_detector.log')  # JSON lines
+    LOG_MAX_BYTES = 5 * 1024 * 1024  # Rotate at this size...
+    LOG_ROTATE_INTERVAL = 24 * 3600  # ...or after this many seconds
+    LOG_BACKUP_COUNT = 5  # Rotated files kept (light_detector.log.1 ...)
     
     # Image storage
     IMAGE_DIR = os.path.join(os.path.dirname(__file__), 'images')
     MAX_IMAGES = 100  # Keep last 100 images
+    IMAGE_INDEX_FILE = ''  # SQLite index for the gallery ('' = index.db in IMAGE_DIR)
+    THUMBNAIL_WIDTHS = (320, 96)  # Thumbnail pyramid levels in pixels wide
+    THUMBNAIL_QUALITY = 80  # JPEG quality for thumbnails
+    IMAGE_CACHE_BYTES = 32 * 1024 * 1024  # Web interface memory cache for served images
     
     # Detection region (crop image to focus on LED area)
     # These are percentages of the image dimensions
@@ -48,6 +130,82 @@ class Config:
     # Example: --roi 0.64,0.50,0.05,0.05
     CAMERA_ROI = (0.64, 0.50, 0.05, 0.05)
 
+    # LED tracking (see roi_tracker.py): replace the CROP_* region with a tight box
+    # around the LED found by a full-frame scan and follow its centroid. A lit LED
+    # fills about half of the box, so RED_LIGHT_THRESHOLD keeps its meaning.
+    ROI_TRACKING_ENABLED = False
+    ROI_BLOB_SCALE = 1.25  # ROI side as a multiple of the LED diameter
+    ROI_MIN_SIZE = 0.01  # Minimum ROI side as a fraction of the frame width
+    ROI_MIN_BLOB_AREA = 12  # Smallest red blob treated as the LED (mask pixels)
+    ROI_SMOOTHING = 0.5  # Weight of the newest frame when resizing the ROI
+    ROI_RESCAN_INTERVAL = 300  # Seconds between full-frame scans
+
+    # Replay source for offline load testing: a directory of images or a .npy
+    # raw frame file. Empty means use the real camera.
+    CAMERA_SOURCE = os.getenv('CAMERA_SOURCE', '')
+    REPLAY_FPS = float(os.getenv('REPLAY_FPS', '0'))  # 0 = as fast as possible
+    REPLAY_LOOP = True
+
+    # Lossless raw recording of the frames the detector sees (see frame_recorder.py)
+    RECORD_RAW_FRAMES = False
+    RECORD_FILE = os.path.join(os.path.dirname(__file__), 'recordings', 'capture.ldraw')
+    RECORD_CAPACITY = 1440  # Frames kept in the ring (6 h at a 15 s interval, ~720 MB)
+
+    # Runtime overrides (see config_loader.py): a JSON file of {"SETTING": value} and
+    # LIGHT_DETECTOR_<SETTING> environment variables. Detection settings reload
+    # without a restart when the file changes.
+    CONFIG_FILE = os.getenv('LIGHT_DETECTOR_CONFIG', os.path.join(os.path.dirname(__file__), 'config.json'))
+    CONFIG_RELOAD_INTERVAL = 2.0  # Seconds between checks for file changes (0 disables)
+
+    # ROI live stream (see roi_stream.py): the detector shares its detection-region
+    # crop through a tmpfs file and the web interface serves it as MJPEG at /stream/roi
+    ROI_STREAM_ENABLED = True
+    ROI_STREAM_FILE = '/dev/shm/light_detector_roi.bin' if os.path.isdir('/dev/shm') else '/tmp/light_detector_roi.bin'
+    ROI_STREAM_FPS = 5  # Maximum stream rate (also bounded by the detection rate)
+    ROI_STREAM_SCALE = 2.0  # Resize factor applied to the crop
+    ROI_STREAM_QUALITY = 80  # JPEG quality
+
+    # Fleet reporting (see fleet_reporter.py): push detection state changes and
+    # heartbeats to a central fleet_aggregator.py; an empty URL disables it
+    FLEET_AGGREGATOR_URL = os.getenv('FLEET_AGGREGATOR_URL', '')  # http://host:8100/ingest or udp://host:8101
+    FLEET_NODE_ID = os.getenv('FLEET_NODE_ID', '')  # Defaults to the hostname
+    FLEET_REPORT_INTERVAL = 10.0  # Seconds between batches (each batch is also a heartbeat)
+    FLEET_BATCH_EVENTS = 40  # Events per batch; keeps a UDP batch in one datagram
+    FLEET_MAX_BUFFERED = 1000  # Events kept while the aggregator is unreachable (oldest dropped)
+    # Aggregator side
+    FLEET_HTTP_PORT = 8100
+    FLEET_UDP_PORT = 8101
+    FLEET_HISTORY_EVENTS = 1000  # Events kept per node
+    FLEET_HISTORY_SECONDS = 24 * 3600
+    FLEET_OFFLINE_AFTER = 60  # Seconds without a batch before a node shows as offline
+    FLEET_NODE_EXPIRY = 7 * 24 * 3600  # Forget nodes silent for this long
+
+    # Thermal/CPU quality control (see thermal_control.py): step capture resolution,
+    # crop size, frame rate and archiving down while the SoC is hot, throttled or
+    # the CPU is over budget, and back up once it has recovered
+    THERMAL_CONTROL_ENABLED = False
+    THERMAL_SOFT_LIMIT = 70.0  # °C; step down one level above this
+    THERMAL_HARD_LIMIT = 80.0  # °C; go straight to the lowest level (the firmware throttles from 80)
+    THERMAL_RESUME_MARGIN = 5.0  # °C below the soft limit before stepping back up
+    THERMAL_CPU_BUDGET = 0.8  # Busy fraction of all cores; step down above this
+    THERMAL_CHECK_INTERVAL = 10.0  # Seconds between readings
+    THERMAL_HOLD_TIME = 60.0  # Seconds at a level before stepping back up
+    # Per level, full quality first: (capture scale, crop scale, frame rate divisor, archive).
+    # A crop scale below 1.0 shrinks the crop around its center, so an LED near its edge
+    # is lost; the defaults keep the whole crop so detection works at every level.
+    THERMAL_LEVELS = (
+        (1.0, 1.0, 1, True),
+        (1.0, 1.0, 1, False),
+        (1.0, 1.0, 2, False),
+        (0.5, 1.0, 2, False),
+        (0.5, 1.0, 4, False),
+    )
+    THERMAL_SYSFS_ROOT = '/'  # Prefix for the /sys and /proc files read
+
+    # Metrics (shared with the web interface through a memory-mapped file)
+    METRICS_ENABLED = True
+    METRICS_FILE = '/tmp/light_detector_metrics.bin'
+
     @staticmethod
     def check_secrets():
         missing = []
@@ -0,0 +1,295 @@
+"""
+Runtime configuration overrides with hot reload.
+
+Settings in config.py can be overridden from a JSON file (CONFIG_FILE) such as
+
+    {"RED_LIGHT_THRESHOLD": 0.25, "CROP_LEFT": 0.45}
+
+and from LIGHT_DETECTOR_<SETTING> environment variables, which win over the
+file. Values are validated before anything is applied. ConfigWatcher polls the
+file and, on a valid change, updates Config and calls back so the detector and
+camera can swap in freshly compiled DetectionParams between frames.
+"""
+
+import json
+import os
+import threading
+import time
+
+from config import Config
+
+ENV_PREFIX = 'LIGHT_DETECTOR_'
+
+# Settings read once at start-up; changing them needs a restart
+RESTART_REQUIRED = {
+    'CAMERA_RESOLUTION', 'CAMERA_FPS', 'CAMERA_ROTATION', 'CAMERA_WARMUP_TIMEOUT',
+    'CAMERA_WARMUP_TOLERANCE', 'CAMERA_WARMUP_STABLE_FRAMES', 'DETECTION_STREAM',
+    'LORES_RESOLUTION', 'CAMERA_SOURCE', 'REPLAY_FPS', 'REPLAY_LOOP', 'RECORD_RAW_FRAMES',
+    'RECORD_FILE', 'RECORD_CAPACITY', 'METRICS_ENABLED', 'METRICS_FILE', 'LOG_LEVEL', 'LOG_FILE',
+    'LOG_MAX_BYTES', 'LOG_ROTATE_INTERVAL', 'LOG_BACKUP_COUNT',
+    'IMAGE_DIR', 'IMAGE_INDEX_FILE', 'ROI_TRACKING_ENABLED', 'CHANGE_GATE_ENABLED',
+    'PIPELINE_ENABLED', 'PIPELINE_SLOTS', 'CONFIG_RELOAD_INTERVAL',
+    'PULSE_METER_ENABLED', 'ROLLUP_DB_FILE', 'ALERT_OUTBOX_FILE', 'ROI_STREAM_ENABLED', 'ROI_STREAM_FILE',
+    'BACKGROUND_MODEL_ENABLED', 'FLEET_AGGREGATOR_URL', 'FLEET_NODE_ID', 'FLEET_MAX_BUFFERED',
+    'FLEET_HTTP_PORT', 'FLEET_UDP_PORT', 'FLEET_HISTORY_EVENTS', 'THERMAL_CONTROL_ENABLED',
+    'THERMAL_LEVELS', 'THERMAL_SYSFS_ROOT',
+}
+
+# Inclusive (min, max) bounds; None means unbounded
+RANGES = {
+    'RED_LIGHT_THRESHOLD': (0.0, 1.0),
+    'RED_HUE_MIN': (0, 179),
+    'RED_HUE_MAX': (0, 179),
+    'RED_SATURATION_MIN': (0, 255),
+    'RED_VALUE_MIN': (0, 255),
+    'CROP_LEFT': (0.0, 1.0),
+    'CROP_TOP': (0.0, 1.0),
+    'CROP_RIGHT': (0.0, 1.0),
+    'CROP_BOTTOM': (0.0, 1.0),
+    'DETECTION_INTERVAL': (0, None),
+    'ALERT_COOLDOWN': (0, None),
+    'MAX_ALERTS_PER_HOUR': (0, None),
+    'EARLY_EXIT_MAX_AREA': (0.0, 1.0),
+    'CHANGE_GATE_THRESHOLD': (0, 255),
+    'ROI_SMOOTHING': (0.0, 1.0),
+    'METER_IMPULSES_PER_KWH': (1, None),
+    'PULSE_MIN_INTERVAL': (0.0, None),
+    'ALERT_BATCH_SIZE': (1, None),
+    'ALERT_FLUSH_INTERVAL': (0.1, None),
+    'ROI_STREAM_FPS': (0.1, 30),
+    'ROI_STREAM_SCALE': (0.25, 8.0),
+    'ROI_STREAM_QUALITY': (10, 100),
+    'BACKGROUND_TIME_CONSTANT': (0.1, None),
+    'BACKGROUND_ABSORB_TIME': (0.0, None),
+    'BACKGROUND_MIN_DELTA': (0, 255),
+    'FLEET_REPORT_INTERVAL': (0.1, None),
+    'FLEET_BATCH_EVENTS': (1, None),
+    'FLEET_MAX_BUFFERED': (1, None),
+    'FLEET_HTTP_PORT': (0, 65535),
+    'FLEET_UDP_PORT': (0, 65535),
+    'FLEET_HISTORY_EVENTS': (1, None),
+    'FLEET_OFFLINE_AFTER': (1, None),
+    'THERMAL_SOFT_LIMIT': (30.0, 110.0),
+    'THERMAL_HARD_LIMIT': (30.0, 110.0),
+    'THERMAL_RESUME_MARGIN': (0.0, None),
+    'THERMAL_CPU_BUDGET': (0.05, 1.0),
+    'THERMAL_CHECK_INTERVAL': (0.1, None),
+    'THERMAL_HOLD_TIME': (0.0, None),
+}
+
+_baseline = None  # Config values before any overrides were applied
+_resolved = None  # Values from the last successful load (baseline + overrides)
+
+
+def tunable_settings():
+    """Names of the Config settings that may be overridden"""
+    return sorted(name for name, value in vars(Config).items()
+                  if name.isupper() and not callable(value) and name != 'CONFIG_FILE')
+
+
+def _baseline_values():
+    global _baseline
+    if _baseline is None:
+        _baseline = {name: getattr(Config, name) for name in tunable_settings()}
+    return _baseline
+
+
+def _coerce(name, value, default):
+    """Convert a JSON/env value to the type of the default, or raise ValueError"""
+    if isinstance(default, bool):
+        if not isinstance(value, bool):
+            raise ValueError(f"{name} must be true or false")
+        return value
+    if isinstance(default, int) and not isinstance(default, bool):
+        if isinstance(value, bool) or not isinstance(value, (int, float)) or value != int(value):
+            raise ValueError(f"{name} must be an integer")
+        return int(value)
+    if isinstance(default, float):
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            raise ValueError(f"{name} must be a number")
+        return float(value)
+    if isinstance(default, tuple):
+        if default and all(isinstance(d, tuple) for d in default):
+            # A list of entries (e.g. THERMAL_LEVELS): any count, each shaped like the first default
+            if not isinstance(value, (list, tuple)) or not value:
+                raise ValueError(f"{name} must be a non-empty list")
+            return tuple(_coerce(f"{name}[{i}]", v, default[0]) for i, v in enumerate(value))
+        if not isinstance(value, (list, tuple)) or len(value) != len(default):
+            raise ValueError(f"{name} must be a list of {len(default)} values")
+        return tuple(_coerce(f"{name}[{i}]", v, d) for i, (v, d) in enumerate(zip(value, default)))
+    if isinstance(default, str):
+        if not isinstance(value, str):
+            raise ValueError(f"{name} must be a string")
+        return value
+    return value
+
+
+def read_overrides(path):
+    """Overrides from the JSON file (if present) and the environment"""
+    overrides = {}
+    if path and os.path.exists(path):
+        with open(path, 'r') as f:
+            data = json.load(f)
+        if not isinstance(data, dict):
+            raise ValueError(f"{path} must contain a JSON object")
+        overrides.update(data)
+
+    settings = set(tunable_settings())
+    for key, raw in os.environ.items():
+        name = key[len(ENV_PREFIX):]
+        if key.startswith(ENV_PREFIX) and name in settings:
+            try:
+                overrides[name] = json.loads(raw)
+            except ValueError:
+                overrides[name] = raw  # Plain strings need no JSON quoting
+    return overrides
+
+
+def validate(overrides):
+    """
+    Check overrides against the known settings, their types and ranges
+    Returns the full set of resulting values; raises ValueError listing all problems.
+    """
+    baseline = _baseline_values()
+    values = dict(baseline)
+    errors = []
+
+    for name, value in overrides.items():
+        if name not in baseline:
+            errors.append(f"unknown setting {name}")
+            continue
+        try:
+            value = _coerce(name, value, baseline[name])
+        except ValueError as e:
+            errors.append(str(e))
+            continue
+        low, high = RANGES.get(name, (None, None))
+        if (low is not None and value < low) or (high is not None and value > high):
+            errors.append(f"{name}={value} is outside [{low}, {'inf' if high is None else high}]")
+            continue
+        values[name] = value
+
+    if values['CROP_LEFT'] >= values['CROP_RIGHT'] or values['CROP_TOP'] >= values['CROP_BOTTOM']:
+        errors.append("crop region is empty (CROP_LEFT < CROP_RIGHT and CROP_TOP < CROP_BOTTOM required)")
+    if values['DETECTION_STREAM'] not in ('main', 'lores'):
+        errors.append("DETECTION_STREAM must be 'main' or 'lores'")
+    if values['DETECTOR_BACKEND'] not in ('hsv', 'classifier'):
+        errors.append("DETECTOR_BACKEND must be 'hsv' or 'classifier'")
+    elif values['DETECTOR_BACKEND'] == 'classifier' and not os.path.exists(values['CLASSIFIER_MODEL_FILE']):
+        errors.append(f"DETECTOR_BACKEND 'classifier' needs a trained model at {values['CLASSIFIER_MODEL_FILE']}")
+    if values['THERMAL_SOFT_LIMIT'] >= values['THERMAL_HARD_LIMIT']:
+        errors.append("THERMAL_SOFT_LIMIT must be below THERMAL_HARD_LIMIT")
+    if not values['THERMAL_LEVELS'] or any(
+            len(level) != 4 or not 0 < level[0] <= 1 or not 0 < level[1] <= 1 or level[2] < 1
+            for level in values['THERMAL_LEVELS']):
+        errors.append("THERMAL_LEVELS entries must be (capture scale 0-1, crop scale 0-1, divisor >= 1, archive)")
+    if values['FLEET_AGGREGATOR_URL'] and \
+            values['FLEET_AGGREGATOR_URL'].split('://')[0] not in ('http', 'https', 'udp'):
+        errors.append("FLEET_AGGREGATOR_URL must start with http://, https:// or udp://")
+
+    if errors:
+        raise ValueError("; ".join(errors))
+    return values
+
+
+def apply(values, startup=False):
+    """
+    Set the values that changed since the last load on Config; returns their names
+    Settings changed in code (e.g. by command-line flags) are kept unless the
+    file changes them. After start-up, settings in RESTART_REQUIRED are left
+    alone with a warning and keep their running value, so the warning repeats
+    on every reload until the restart.
+    """
+    global _resolved
+    previous = _resolved or _baseline_values()
+    resolved = dict(values)
+    changed = []
+    for name, value in values.items():
+        if previous.get(name) == value:
+            continue
+        if not startup and name in RESTART_REQUIRED:
+            print(f"Config: {name} changes take effect after a restart")
+            resolved[name] = previous.get(name)
+            continue
+        setattr(Config, name, value)
+        changed.append(name)
+    _resolved = resolved
+    return changed
+
+
+def load_config(path=None):
+    """Apply file and environment overrides at start-up; returns the changed names"""
+    path = path or Config.CONFIG_FILE
+    _baseline_values()
+    try:
+        changed = apply(validate(read_overrides(path)), startup=True)
+    except ValueError as e:
+        print(f"Ignoring invalid configuration overrides: {e}")
+        return []
+    if changed:
+        print(f"Config overrides: {', '.join(changed)}")
+    return changed
+
+
+class ConfigWatcher:
+    """Poll the config file and apply valid changes from a background thread"""
+
+    def __init__(self, on_change, path=None, interval=None):
+        self.on_change = on_change  # Called with the list of changed setting names
+        self.path = path or Config.CONFIG_FILE
+        self.interval = interval or Config.CONFIG_RELOAD_INTERVAL
+        self.reloads = 0
+        self._signature = self._stat()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _stat(self):
+        try:
+            stat = os.stat(self.path)
+            return stat.st_mtime_ns, stat.st_size
+        except OSError:
+            return None
+
+    def check(self):
+        """Reload if the file changed; returns the changed names (or None)"""
+        signature = self._stat()
+        if signature == self._signature:
+            return None
+        self._signature = signature
+
+        try:
+            values = validate(read_overrides(self.path))
+        except ValueError as e:
+            # Keep running on the current settings; a later edit can fix the file
+            print(f"Config reload rejected: {e}")
+            return None
+
+        changed = apply(values)
+        if changed:
+            self.reloads += 1
+            self.on_change(changed)
+        return changed
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='config-watcher', daemon=True)
+        self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.check()
+            except Exception as e:
+                print(f"Error reloading config: {e}")
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+
+def start_watcher(on_change):
+    """Start a ConfigWatcher unless reloading is disabled"""
+    if not Config.CONFIG_RELOAD_INTERVAL:
+        return None
+    return ConfigWatcher(on_change).start()
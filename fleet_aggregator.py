@@ -0,0 +1,397 @@
+#!/usr/bin/env python3
+"""
+Central aggregator for a fleet of detector nodes.
+
+Each node runs a FleetReporter (fleet_reporter.py) that pushes batches over
+HTTP (POST /ingest) or UDP, one JSON object per request or datagram:
+
+    {"node": "pi-kitchen", "boot": 1704110400, "seq": 42,
+     "hb": {"t": 1704110410.0, "up": 10.0, "frames": 7, "det": 2, "conf": 0.91,
+            "ok": true, "w": 1830.0},
+     "events": [[1704110403.2, 1, 0.91], [1704110405.9, 0, 0.02]]}
+
+Events are detection state changes only; the heartbeat ("hb") carries the
+frame counts since the previous batch, so a node that detects every few
+seconds still sends a few hundred bytes per batch. (boot, seq) identifies a
+batch: retransmissions are dropped and gaps are counted as missed batches.
+
+State is kept in memory only: the latest heartbeat of each node and its
+last FLEET_HISTORY_EVENTS events (no older than FLEET_HISTORY_SECONDS).
+Nodes silent for FLEET_NODE_EXPIRY are forgotten. The fleet view is served
+as JSON (/api/fleet, /api/nodes/<node>, /api/stats) and as a small HTML
+table at /.
+
+Usage:
+    python3 fleet_aggregator.py
+    python3 fleet_aggregator.py --http-port 8100 --udp-port 0    # HTTP only
+"""
+
+import argparse
+import html
+import json
+import socket
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlparse
+
+from config import Config
+
+_PRUNE_INTERVAL = 60  # Seconds between retention sweeps
+_MAX_BODY = 1024 * 1024
+
+
+def _optional_float(value):
+    return None if value is None else float(value)
+
+
+def _parse_heartbeat(heartbeat):
+    """Heartbeat with known fields only, typed (raises on bad values)"""
+    return {
+        't': _optional_float(heartbeat.get('t')),
+        'up': _optional_float(heartbeat.get('up')),
+        'frames': int(heartbeat.get('frames', 0)),
+        'det': int(heartbeat.get('det', 0)),
+        'conf': float(heartbeat.get('conf', 0.0)),
+        'ok': bool(heartbeat.get('ok', True)),
+        'w': _optional_float(heartbeat.get('w')),
+    }
+
+
+class NodeState:
+    """Latest heartbeat and recent events of one node"""
+
+    def __init__(self, node, now, history):
+        self.node = node
+        self.first_seen = now
+        self.last_seen = now
+        self.address = None
+        self.boot = None
+        self.seq = -1
+        self.heartbeat = {}
+        self.events = deque(maxlen=history)  # (time, detected, confidence)
+        self.detected = False
+        self.last_detection = None
+        self.batches = 0
+        self.missed_batches = 0
+        self.frames = 0
+        self.detected_frames = 0
+
+    def status(self, now, offline_after):
+        if now - self.last_seen > offline_after:
+            return 'offline'
+        if not self.heartbeat.get('ok', True):
+            return 'unhealthy'
+        if self.batches > 1 and not self.heartbeat.get('frames'):
+            return 'stalled'  # Heartbeats arrive but no frames were analyzed
+        return 'online'
+
+    def summary(self, now, offline_after):
+        return {
+            'node': self.node,
+            'status': self.status(now, offline_after),
+            'detected': self.detected,
+            'last_detection': self.last_detection,
+            'last_seen': self.last_seen,
+            'address': self.address,
+            'uptime': self.heartbeat.get('up'),
+            'power_w': self.heartbeat.get('w'),
+            'frames': self.frames,
+            'detected_frames': self.detected_frames,
+            'batches': self.batches,
+            'missed_batches': self.missed_batches,
+        }
+
+
+class FleetState:
+    """Per-node state with bounded retention; safe to use from many threads"""
+
+    def __init__(self, config=None):
+        self.config = config or Config()
+        self.nodes = {}
+        self.started = time.time()
+        self.counters = {'batches': 0, 'events': 0, 'bytes': 0, 'duplicates': 0, 'rejected': 0,
+                         'http': 0, 'udp': 0}
+        self._lock = threading.Lock()
+        self._last_prune = time.monotonic()
+
+    def ingest(self, batch, transport, size=0, address=None):
+        """Apply one batch; returns False if it is malformed"""
+        try:
+            node = str(batch['node'])[:64]
+            seq = int(batch['seq'])
+            boot = batch.get('boot')
+            heartbeat = _parse_heartbeat(batch.get('hb') or {})
+            events = [(float(t), bool(detected), float(confidence))
+                      for t, detected, confidence in batch.get('events', ())]
+        except (KeyError, TypeError, ValueError, AttributeError):
+            with self._lock:
+                self.counters['rejected'] += 1
+            return False
+
+        now = time.time()
+        with self._lock:
+            self.counters[transport] += 1
+            self.counters['bytes'] += size
+            state = self.nodes.get(node)
+            if state is None:
+                state = self.nodes[node] = NodeState(node, now, self.config.FLEET_HISTORY_EVENTS)
+            state.last_seen = now
+            state.address = address
+            if boot == state.boot and seq <= state.seq:
+                self.counters['duplicates'] += 1  # Retransmitted after a lost response
+                return True
+            if boot == state.boot and state.seq >= 0:
+                state.missed_batches += seq - state.seq - 1
+            state.boot, state.seq = boot, seq
+
+            state.batches += 1
+            state.heartbeat = heartbeat
+            state.frames += heartbeat['frames']
+            state.detected_frames += heartbeat['det']
+            state.events.extend(events)
+            if events:
+                state.detected = events[-1][1]
+            for timestamp, detected, _ in events:
+                if detected:
+                    state.last_detection = timestamp
+            self.counters['batches'] += 1
+            self.counters['events'] += len(events)
+
+            if time.monotonic() - self._last_prune > _PRUNE_INTERVAL:
+                self._prune(now)
+        return True
+
+    def _prune(self, now):
+        """Drop events past FLEET_HISTORY_SECONDS and nodes past FLEET_NODE_EXPIRY"""
+        self._last_prune = time.monotonic()
+        oldest = now - self.config.FLEET_HISTORY_SECONDS
+        for node, state in list(self.nodes.items()):
+            if now - state.last_seen > self.config.FLEET_NODE_EXPIRY:
+                del self.nodes[node]
+                continue
+            while state.events and state.events[0][0] < oldest:
+                state.events.popleft()
+
+    def fleet(self):
+        """Fleet-wide view: totals and one summary row per node"""
+        now = time.time()
+        with self._lock:
+            rows = [state.summary(now, self.config.FLEET_OFFLINE_AFTER)
+                    for state in self.nodes.values()]
+        rows.sort(key=lambda row: row['node'])
+        statuses = [row['status'] for row in rows]
+        return {
+            'time': now,
+            'nodes': len(rows),
+            'online': statuses.count('online'),
+            'offline': statuses.count('offline'),
+            'unhealthy': statuses.count('unhealthy') + statuses.count('stalled'),
+            'detecting': sum(1 for row in rows if row['detected'] and row['status'] != 'offline'),
+            'node_list': rows,
+        }
+
+    def node(self, node, limit=100):
+        """Summary, latest heartbeat and the newest events of one node, or None"""
+        now = time.time()
+        with self._lock:
+            state = self.nodes.get(node)
+            if state is None:
+                return None
+            detail = state.summary(now, self.config.FLEET_OFFLINE_AFTER)
+            detail['heartbeat'] = dict(state.heartbeat)
+            events = list(state.events)[-limit:] if limit else []
+        detail['events'] = [{'time': t, 'detected': detected, 'confidence': confidence}
+                             for t, detected, confidence in events]
+        return detail
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters, nodes=len(self.nodes))
+        elapsed = max(time.time() - self.started, 1e-9)
+        stats['uptime'] = elapsed
+        stats['batches_per_second'] = stats['batches'] / elapsed
+        stats['events_per_second'] = stats['events'] / elapsed
+        return stats
+
+
+def render_fleet_html(fleet):
+    """Auto-refreshing HTML table of the fleet view"""
+    rows = []
+    for row in fleet['node_list']:
+        last = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(row['last_detection'])) \
+            if row['last_detection'] else '-'
+        power = f"{row['power_w']:.0f} W" if row['power_w'] is not None else '-'
+        rows.append(f"<tr class=\"{row['status']}\"><td><a href=\"/api/nodes/{html.escape(row['node'])}\">"
+                    f"{html.escape(row['node'])}</a></td><td>{row['status']}</td>"
+                    f"<td>{'ON' if row['detected'] else 'off'}</td><td>{last}</td><td>{power}</td>"
+                    f"<td>{fleet['time'] - row['last_seen']:.0f} s ago</td>"
+                    f"<td>{row['missed_batches']}</td></tr>")
+    return f"""<!DOCTYPE html>
+<html><head><meta charset="utf-8"><meta http-equiv="refresh" content="10">
+<title>Light Detector Fleet</title>
+<style>
+body {{ font-family: sans-serif; margin: 20px; }}
+table {{ border-collapse: collapse; }}
+td, th {{ padding: 4px 12px; border-bottom: 1px solid #ddd; text-align: left; }}
+.offline {{ color: #999; }} .unhealthy, .stalled {{ color: #c60; }}
+</style></head><body>
+<h1>Light Detector Fleet</h1>
+<p>{fleet['nodes']} nodes: {fleet['online']} online, {fleet['offline']} offline,
+{fleet['unhealthy']} unhealthy, {fleet['detecting']} detecting</p>
+<table><tr><th>Node</th><th>Status</th><th>Light</th><th>Last detection</th><th>Power</th>
+<th>Last batch</th><th>Missed</th></tr>
+{''.join(rows)}
+</table></body></html>"""
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024  # Many nodes connecting at once
+
+
+class FleetAggregator:
+    """HTTP and UDP ingest plus the fleet view, each on a background thread"""
+
+    def __init__(self, state=None, host='0.0.0.0', http_port=None, udp_port=None):
+        self.config = Config()
+        self.state = state or FleetState(self.config)
+        self.host = host
+        self.http_port = self.config.FLEET_HTTP_PORT if http_port is None else http_port
+        self.udp_port = self.config.FLEET_UDP_PORT if udp_port is None else udp_port
+        self.http_server = None
+        self.udp_socket = None
+        self._threads = []
+
+    def start(self, udp=True):
+        """Bind and serve; port 0 picks a free port (the bound ports are stored back)"""
+        state = self.state
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'  # Keep-alive: nodes reuse one connection
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length', 0))
+                if length > _MAX_BODY:
+                    self.close_connection = True  # Body left unread
+                    self._reply(413)
+                    return
+                body = self.rfile.read(length)
+                if urlparse(self.path).path != '/ingest':
+                    self._reply(404)
+                    return
+                try:
+                    batches = json.loads(body)
+                except ValueError:
+                    state.ingest(None, 'http')
+                    self._reply(400)
+                    return
+                if not isinstance(batches, list):
+                    batches = [batches]
+                ok = all([state.ingest(batch, 'http', len(body) // len(batches), self.client_address[0])
+                          for batch in batches]) if batches else False
+                self._reply(204 if ok else 400)
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                query = parse_qs(url.query)
+                if url.path == '/':
+                    self._reply(200, render_fleet_html(state.fleet()).encode(), 'text/html; charset=utf-8')
+                elif url.path == '/api/fleet':
+                    self._reply_json(state.fleet())
+                elif url.path == '/api/stats':
+                    self._reply_json(state.stats())
+                elif url.path.startswith('/api/nodes/'):
+                    try:
+                        limit = int(query.get('limit', ['100'])[0])
+                    except ValueError:
+                        limit = 100
+                    detail = state.node(unquote(url.path[len('/api/nodes/'):]), limit)
+                    if detail is None:
+                        self._reply(404)
+                    else:
+                        self._reply_json(detail)
+                else:
+                    self._reply(404)
+
+            def _reply_json(self, data):
+                self._reply(200, json.dumps(data).encode(), 'application/json')
+
+            def _reply(self, status, body=b'', content_type=None):
+                self.send_response(status)
+                if content_type:
+                    self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                if body:
+                    self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.http_server = _Server((self.host, self.http_port), Handler)
+        self.http_port = self.http_server.server_address[1]
+        self._start_thread(self.http_server.serve_forever)
+
+        if udp and self.udp_port is not None:
+            self.udp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self.udp_socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 * 1024 * 1024)
+            self.udp_socket.bind((self.host, self.udp_port))
+            self.udp_port = self.udp_socket.getsockname()[1]
+            self._start_thread(self._serve_udp)
+        return self
+
+    def _start_thread(self, target):
+        thread = threading.Thread(target=target, daemon=True)
+        thread.start()
+        self._threads.append(thread)
+
+    def _serve_udp(self):
+        while True:
+            try:
+                data, address = self.udp_socket.recvfrom(65535)
+            except OSError:
+                return  # Socket closed by stop()
+            try:
+                batch = json.loads(data)
+            except ValueError:
+                batch = None
+            self.state.ingest(batch, 'udp', len(data), address[0])
+
+    def stop(self):
+        if self.http_server:
+            self.http_server.shutdown()
+            self.http_server.server_close()
+        if self.udp_socket:
+            self.udp_socket.close()
+        for thread in self._threads:
+            thread.join(timeout=2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Collect detection events and heartbeats from detector nodes")
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--http-port', type=int, default=Config.FLEET_HTTP_PORT)
+    parser.add_argument('--udp-port', type=int, default=Config.FLEET_UDP_PORT,
+                        help="0 disables UDP ingest")
+    args = parser.parse_args()
+
+    aggregator = FleetAggregator(host=args.host, http_port=args.http_port, udp_port=args.udp_port)
+    aggregator.start(udp=args.udp_port != 0)
+    print(f"Fleet aggregator: http://{args.host}:{aggregator.http_port}/"
+          + (f", UDP ingest on port {aggregator.udp_port}" if aggregator.udp_socket else ""))
+    try:
+        while True:
+            time.sleep(60)
+            stats = aggregator.state.stats()
+            print(f"{stats['nodes']} nodes, {stats['batches']} batches, {stats['events']} events, "
+                  f"{stats['duplicates']} duplicates, {stats['rejected']} rejected")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        aggregator.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+"""
+Ingest load test for fleet_aggregator.py with simulated nodes on localhost.
+
+The aggregator runs in its own process on free ports. Each simulated node
+is a thread (spread over --processes load processes) with its own keep-alive
+HTTP connection or UDP socket, sending batches in the fleet_reporter.py
+format with --events state changes each.
+
+Scenarios, for each transport:
+- paced: every node sends one batch per --interval seconds (the production
+  interval is FLEET_REPORT_INTERVAL; a shorter interval simulates a
+  proportionally larger fleet)
+- saturated: every node sends back to back, giving the maximum ingest rate
+  (UDP senders then outrun the receiver, so losses are expected there)
+
+Reported per scenario: batches sent and accepted per second, events per
+second, losses (UDP) or errors (HTTP), request latency p50/p99 (HTTP), the
+time to render the fleet view, and how many nodes at FLEET_REPORT_INTERVAL
+the measured rate would carry. The load generator shares the machine with
+the aggregator, so the saturated rates are a lower bound.
+
+Usage:
+    python3 fleet_loadtest.py
+    python3 fleet_loadtest.py --nodes 1000 --duration 20 --transport http
+"""
+
+import argparse
+import http.client
+import json
+import multiprocessing
+import os
+import random
+import socket
+import threading
+import time
+
+from config import Config
+
+
+def simulated_batch(node, boot, seq, events, rng):
+    """Batch in the fleet_reporter.py format"""
+    now = time.time()
+    detected = rng.random() < 0.5
+    changes = []
+    for i in range(events):
+        changes.append([round(now - (events - i) * 0.5, 3), int(detected), round(rng.random(), 3)])
+        detected = not detected
+    heartbeat = {'t': round(now, 3), 'up': 100.0, 'frames': 10, 'det': events // 2,
+                 'conf': 0.9, 'ok': True, 'w': round(rng.uniform(100, 3000), 1)}
+    return json.dumps({'node': node, 'boot': boot, 'seq': seq, 'hb': heartbeat, 'events': changes},
+                      separators=(',', ':')).encode()
+
+
+def _run_aggregator(conn):
+    from fleet_aggregator import FleetAggregator
+    aggregator = FleetAggregator(host='127.0.0.1', http_port=0, udp_port=0).start()
+    conn.send((aggregator.http_port, aggregator.udp_port))
+    conn.recv()  # Stop request
+    aggregator.stop()
+
+
+def _simulate_node(name, transport, address, events, interval, end, result):
+    rng = random.Random(name)
+    boot = int(time.time())
+    seq = 0
+    sent = errors = 0
+    latencies = []
+    conn = http.client.HTTPConnection(*address, timeout=10) if transport == 'http' else None
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM) if transport == 'udp' else None
+    next_send = time.monotonic() + rng.uniform(0, interval)  # Nodes are not in step
+
+    while True:
+        if interval:
+            delay = next_send - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            next_send += interval
+        if time.monotonic() >= end:
+            break
+        seq += 1
+        body = simulated_batch(name, boot, seq, events, rng)
+        start = time.perf_counter()
+        try:
+            if sock:
+                sock.sendto(body, address)
+                time.sleep(0)  # Let the other nodes' threads send too
+            else:
+                conn.request('POST', '/ingest', body, {'Content-Type': 'application/json'})
+                response = conn.getresponse()
+                response.read()
+                if response.status != 204:
+                    errors += 1
+        except (OSError, http.client.HTTPException):
+            errors += 1
+            if conn:
+                conn.close()  # Reconnects on the next request
+        latencies.append(time.perf_counter() - start)
+        sent += 1
+
+    if conn:
+        conn.close()
+    if sock:
+        sock.close()
+    result.append((sent, errors, latencies))
+
+
+def _load_process(names, transport, address, events, interval, start, duration, queue):
+    time.sleep(max(0.0, start - time.time()))
+    end = time.monotonic() + duration
+    results = []
+    threads = [threading.Thread(target=_simulate_node,
+                                args=(name, transport, address, events, interval, end, results))
+               for name in names]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    sent = sum(r[0] for r in results)
+    errors = sum(r[1] for r in results)
+    latencies = [latency for r in results for latency in r[2]]
+    if len(latencies) > 20000:
+        latencies = random.Random(0).sample(latencies, 20000)
+    queue.put((sent, errors, latencies))
+
+
+def _get_json(port, path):
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+    conn.request('GET', path)
+    data = json.loads(conn.getresponse().read())
+    conn.close()
+    return data
+
+
+def run_scenario(transport, nodes, processes, events, interval, duration):
+    """Start an aggregator, load it with simulated nodes and return the measurements"""
+    ctx = multiprocessing.get_context('fork')
+    parent_conn, child_conn = ctx.Pipe()
+    aggregator = ctx.Process(target=_run_aggregator, args=(child_conn,), daemon=True)
+    aggregator.start()
+    http_port, udp_port = parent_conn.recv()
+    address = ('127.0.0.1', http_port if transport == 'http' else udp_port)
+
+    names = [f"node-{i:04d}" for i in range(nodes)]
+    queue = ctx.Queue()
+    start = time.time() + 0.5  # Let every process spawn its threads first
+    workers = [ctx.Process(target=_load_process,
+                           args=(names[i::processes], transport, address, events, interval, start,
+                                 duration, queue))
+               for i in range(processes)]
+    for worker in workers:
+        worker.start()
+    results = [queue.get() for _ in workers]
+    for worker in workers:
+        worker.join()
+    time.sleep(0.5)  # Let the last datagrams be processed
+
+    stats = _get_json(http_port, '/api/stats')
+    view_start = time.perf_counter()
+    fleet = _get_json(http_port, '/api/fleet')
+    view_time = time.perf_counter() - view_start
+    parent_conn.send('stop')
+    aggregator.join(timeout=5)
+
+    sent = sum(r[0] for r in results)
+    latencies = sorted(latency for r in results for latency in r[2])
+    accepted = stats['batches']
+    return {
+        'transport': transport,
+        'scenario': 'paced' if interval else 'saturated',
+        'nodes': nodes,
+        'interval': interval,
+        'duration': duration,
+        'sent': sent,
+        'accepted': accepted,
+        'errors': sum(r[1] for r in results),
+        'lost': max(0, sent - accepted - stats['duplicates']),
+        'rejected': stats['rejected'],
+        'nodes_seen': fleet['nodes'],
+        'sent_per_second': sent / duration,
+        'batches_per_second': accepted / duration,
+        'events_per_second': stats['events'] / duration,
+        'bytes_per_second': stats['bytes'] / duration,
+        'p50_ms': latencies[len(latencies) // 2] * 1000 if latencies else 0.0,
+        'p99_ms': latencies[int(len(latencies) * 0.99)] * 1000 if latencies else 0.0,
+        'fleet_view_ms': view_time * 1000,
+    }
+
+
+def print_result(r):
+    latency = f"p50 {r['p50_ms']:.1f} ms, p99 {r['p99_ms']:.1f} ms" if r['transport'] == 'http' else "n/a"
+    capacity = ""
+    if r['scenario'] == 'saturated':
+        capacity = (f"; carries ~{int(r['batches_per_second'] * Config.FLEET_REPORT_INTERVAL)} nodes "
+                    f"at {Config.FLEET_REPORT_INTERVAL:g} s")
+    print(f"{r['transport']:<5}{r['scenario']:<10}{r['nodes']:>6} nodes: "
+          f"{r['batches_per_second']:8.0f} batches/s, {r['events_per_second']:9.0f} events/s, "
+          f"{r['bytes_per_second'] / 1e6:5.2f} MB/s")
+    print(f"{'':15}sent {r['sent']}, accepted {r['accepted']}, lost {r['lost']}, errors {r['errors']}, "
+          f"rejected {r['rejected']}, nodes seen {r['nodes_seen']}")
+    print(f"{'':15}latency {latency}; fleet view {r['fleet_view_ms']:.1f} ms{capacity}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the fleet aggregator with simulated nodes")
+    parser.add_argument('--nodes', type=int, default=500)
+    parser.add_argument('--duration', type=float, default=10.0, help="Seconds per scenario")
+    parser.add_argument('--interval', type=float, default=1.0, help="Seconds between batches per node (paced)")
+    parser.add_argument('--events', type=int, default=4, help="State changes per batch")
+    parser.add_argument('--processes', type=int, default=max(1, (os.cpu_count() or 2) - 1))
+    parser.add_argument('--transport', choices=['http', 'udp', 'both'], default='both')
+    parser.add_argument('--output', help="Write the results as JSON")
+    args = parser.parse_args()
+
+    transports = ['http', 'udp'] if args.transport == 'both' else [args.transport]
+    print(f"{args.nodes} simulated nodes, {args.events} events per batch, {args.processes} load "
+          f"processes, {os.cpu_count()} CPUs")
+    results = []
+    for transport in transports:
+        for interval in (args.interval, 0):
+            result = run_scenario(transport, args.nodes, args.processes, args.events, interval,
+                                  args.duration)
+            print_result(result)
+            results.append(result)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
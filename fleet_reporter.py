@@ -0,0 +1,163 @@
+"""
+Pushes this node's detection state to the fleet aggregator.
+
+record() is called once per detection cycle and only updates counters
+under a lock; detection state changes are buffered as compact
+[time, detected, confidence] events (at most FLEET_MAX_BUFFERED, oldest
+dropped). A background thread sends a batch every FLEET_REPORT_INTERVAL
+seconds, or sooner once FLEET_BATCH_EVENTS events are waiting. Every batch
+doubles as a heartbeat, so a node with nothing to report still shows as
+online. See fleet_aggregator.py for the batch format.
+
+FLEET_AGGREGATOR_URL selects the transport:
+    http://host:8100/ingest   acknowledged; a failed batch is resent with the
+                              same sequence number until it is accepted
+    udp://host:8101           fire and forget, one datagram per batch
+"""
+
+import json
+import logging
+import socket
+import threading
+import time
+from collections import deque
+from urllib.parse import urlparse
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+
+class FleetReporter:
+    def __init__(self, url=None, node=None):
+        self.config = Config()
+        self.url = url or self.config.FLEET_AGGREGATOR_URL
+        self.node = node or self.config.FLEET_NODE_ID or socket.gethostname()
+        self.started = time.time()
+        self.boot = int(self.started)  # With seq, identifies a batch across restarts
+
+        parsed = urlparse(self.url)
+        self.udp_address = (parsed.hostname, parsed.port) if parsed.scheme == 'udp' else None
+        self.socket = None
+        self.session = None
+        if self.udp_address:
+            self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self._send_errors = (OSError,)
+        else:
+            import requests  # Only the HTTP transport needs it
+            self.session = requests.Session()
+            self._send_errors = (OSError, requests.RequestException)
+
+        self.seq = 0
+        self.pending = None  # Built but not yet acknowledged (HTTP)
+        self.sent = 0
+        self.failed = 0
+        self._events = deque(maxlen=self.config.FLEET_MAX_BUFFERED)
+        self._frames = 0
+        self._detected_frames = 0
+        self._max_confidence = 0.0
+        self._detected = None
+        self._healthy = True
+        self._power = None
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def record(self, timestamp, analysis, power=None, healthy=True):
+        """Count one analyzed frame; a change of the detected state becomes an event"""
+        detected = bool(analysis['detected'])
+        confidence = float(analysis['confidence'])
+        with self._lock:
+            self._frames += 1
+            self._detected_frames += detected
+            self._max_confidence = max(self._max_confidence, confidence)
+            self._healthy = healthy
+            if power is not None:
+                self._power = power
+            if detected != self._detected:
+                self._detected = detected
+                self._events.append([round(timestamp, 3), int(detected), round(confidence, 3)])
+                if len(self._events) >= self.config.FLEET_BATCH_EVENTS:
+                    self._wake.set()
+
+    def _build_batch(self):
+        """Take up to FLEET_BATCH_EVENTS events and the counters since the last batch"""
+        now = time.time()
+        with self._lock:
+            count = min(len(self._events), self.config.FLEET_BATCH_EVENTS)
+            events = [self._events.popleft() for _ in range(count)]
+            heartbeat = {
+                't': round(now, 3),
+                'up': round(now - self.started, 1),
+                'frames': self._frames,
+                'det': self._detected_frames,
+                'conf': round(self._max_confidence, 3),
+                'ok': self._healthy,
+            }
+            if self._power is not None:
+                heartbeat['w'] = round(self._power, 1)
+            self._frames = self._detected_frames = 0
+            self._max_confidence = 0.0
+        self.seq += 1
+        return {'node': self.node, 'boot': self.boot, 'seq': self.seq, 'hb': heartbeat, 'events': events}
+
+    def _send(self, batch):
+        body = json.dumps(batch, separators=(',', ':')).encode()
+        if self.udp_address:
+            self.socket.sendto(body, self.udp_address)
+            return True
+        response = self.session.post(self.url, data=body, timeout=5,
+                                     headers={'Content-Type': 'application/json'})
+        return response.status_code in (200, 204)
+
+    def flush(self):
+        """Send the pending batch, then batches until the event buffer is empty"""
+        while True:
+            if self.pending is None:
+                self.pending = self._build_batch()
+            try:
+                ok = self._send(self.pending)
+            except self._send_errors as e:
+                logger.debug(f"Fleet report failed: {e}")
+                ok = False
+            if not ok:
+                self.failed += 1
+                return False  # Resent with the same seq next interval
+            self.pending = None
+            self.sent += 1
+            with self._lock:
+                if not self._events:
+                    return True
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.config.FLEET_REPORT_INTERVAL)
+            self._wake.clear()
+            if not self._stop.is_set():
+                self.flush()
+
+    def stop(self):
+        """Stop the sender thread after a final flush"""
+        self._stop.set()
+        self._wake.set()
+        self._thread.join(timeout=10)
+        if self._thread.is_alive():
+            # Still inside a send: flushing here would race it on pending and seq
+            logger.warning("Fleet reporter still sending after 10 s, skipping the final flush")
+        else:
+            self.flush()
+        if self.socket:
+            self.socket.close()
+
+
+def create_reporter():
+    """Fleet reporter, or None if no aggregator is configured"""
+    if not Config.FLEET_AGGREGATOR_URL:
+        return None
+    try:
+        return FleetReporter()
+    except Exception as e:
+        print(f"Fleet reporting disabled: {e}")
+        return None
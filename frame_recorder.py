@@ -0,0 +1,215 @@
+"""
+Memory-mapped raw frame recording.
+
+Frames are appended losslessly to a preallocated file with a fixed layout:
+
+    [header, 4 KiB][metadata table][frame slots]
+
+Each slot holds one uint8 frame of up to the recording's maximum shape and
+each metadata record stores the frame's timestamp, shape, ROI and exposure.
+The recording is a ring: once capacity is reached the oldest frames are
+overwritten. An existing file with a different layout is never overwritten;
+recording continues in capture-1.ldraw, capture-2.ldraw, ... instead. Readers
+map the file and return frames as zero-copy NumPy views.
+"""
+
+import os
+import struct
+import time
+
+import numpy as np
+
+MAGIC = b'LDRAW001'
+HEADER_SIZE = 4096
+ALIGN = 4096
+
+# magic, max height, max width, channels, capacity, frames written
+_HEADER = struct.Struct('<8sIIIIQ')
+_WRITTEN_OFFSET = _HEADER.size - 8
+
+METADATA_DTYPE = np.dtype([
+    ('timestamp', '<f8'),     # seconds since the epoch
+    ('height', '<u4'),
+    ('width', '<u4'),
+    ('roi', '<i4', (4,)),     # left, top, right, bottom in source frame pixels
+    ('exposure_us', '<u4'),
+    ('analog_gain', '<f4'),
+    ('sequence', '<u8'),      # frame number since the recording was created
+])
+
+
+def _align(size):
+    return (size + ALIGN - 1) // ALIGN * ALIGN
+
+
+def _layout(shape, capacity):
+    """Return (metadata offset, frames offset, slot size, total file size)"""
+    slot_size = _align(int(np.prod(shape)))
+    frames_offset = HEADER_SIZE + _align(METADATA_DTYPE.itemsize * capacity)
+    return HEADER_SIZE, frames_offset, slot_size, frames_offset + slot_size * capacity
+
+
+class _Recording:
+    """Shared mapping logic for recorders and readers"""
+
+    def _map(self, path, mode):
+        self.mmap = np.memmap(path, dtype=np.uint8, mode=mode)
+        magic, height, width, channels, capacity, _ = _HEADER.unpack_from(self.mmap, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a raw frame recording")
+
+        self.shape = (height, width, channels)
+        self.capacity = capacity
+        meta_offset, frames_offset, self.slot_size, total = _layout(self.shape, capacity)
+        if self.mmap.size < total:
+            raise ValueError(f"{path} is truncated ({self.mmap.size} of {total} bytes)")
+
+        self.metadata = self.mmap[meta_offset:meta_offset + METADATA_DTYPE.itemsize * capacity] \
+            .view(METADATA_DTYPE)
+        self.slots = self.mmap[frames_offset:total].reshape(capacity, self.slot_size)
+        self._written = self.mmap[_WRITTEN_OFFSET:_WRITTEN_OFFSET + 8].view('<u8')
+
+    @property
+    def written(self):
+        """Total frames ever appended (including overwritten ones)"""
+        return int(self._written[0])
+
+    def __len__(self):
+        return min(self.written, self.capacity)
+
+    def _slot_index(self, index):
+        """Map a 0-based index (oldest first) to its ring slot"""
+        count = len(self)
+        if index < 0:
+            index += count
+        if not 0 <= index < count:
+            raise IndexError(f"frame {index} out of range ({count} frames)")
+        return (self.written - count + index) % self.capacity
+
+    def frame(self, index):
+        """Return frame `index` (oldest first) as a zero-copy view"""
+        slot = self._slot_index(index)
+        record = self.metadata[slot]
+        height, width = int(record['height']), int(record['width'])
+        size = height * width * self.shape[2]
+        return self.slots[slot, :size].reshape(height, width, self.shape[2])
+
+    def frame_metadata(self, index):
+        """Return metadata for frame `index` as a dict"""
+        record = self.metadata[self._slot_index(index)]
+        return {
+            'timestamp': float(record['timestamp']),
+            'shape': (int(record['height']), int(record['width']), self.shape[2]),
+            'roi': tuple(int(v) for v in record['roi']),
+            'exposure_us': int(record['exposure_us']),
+            'analog_gain': float(record['analog_gain']),
+            'sequence': int(record['sequence']),
+        }
+
+    def close(self):
+        if self.mmap.mode != 'r':
+            self.mmap.flush()
+        # The mapping is released once outstanding frame views are gone
+        self.mmap = self.metadata = self.slots = self._written = None
+
+
+class FrameRecorder(_Recording):
+    """Append raw frames and metadata to a preallocated recording file"""
+
+    def __init__(self, path, max_shape, capacity):
+        max_shape = tuple(int(v) for v in max_shape)
+        if len(max_shape) == 2:
+            max_shape += (1,)
+
+        requested = path
+        path = self._free_path(path, max_shape, capacity)
+        if path != requested:
+            print(f"{requested} has a different layout, recording to {path} instead")
+        if not os.path.exists(path):
+            self._create(path, max_shape, capacity)
+        self.path = path
+        self._map(path, 'r+')
+
+    @classmethod
+    def _free_path(cls, path, shape, capacity):
+        """First of path, path-1, path-2, ... that is unused or has this layout"""
+        base, ext = os.path.splitext(path)
+        candidate, n = path, 0
+        while os.path.exists(candidate) and not cls._is_compatible(candidate, shape, capacity):
+            n += 1
+            candidate = f"{base}-{n}{ext}"
+        return candidate
+
+    @staticmethod
+    def _is_compatible(path, shape, capacity):
+        """Reuse an existing recording only if its layout matches"""
+        with open(path, 'rb') as f:
+            header = f.read(_HEADER.size)
+        if len(header) < _HEADER.size:
+            return False
+        magic, height, width, channels, file_capacity, _ = _HEADER.unpack(header)
+        return magic == MAGIC and (height, width, channels) == shape and file_capacity == capacity \
+            and os.path.getsize(path) >= _layout(shape, capacity)[3]
+
+    @staticmethod
+    def _create(path, shape, capacity):
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+
+        total = _layout(shape, capacity)[3]
+        with open(path, 'wb') as f:
+            f.write(_HEADER.pack(MAGIC, shape[0], shape[1], shape[2], capacity, 0))
+            f.flush()
+            try:
+                # Reserve the blocks up front so appends never hit ENOSPC mid-run
+                os.posix_fallocate(f.fileno(), 0, total)
+            except (AttributeError, OSError):
+                f.truncate(total)
+
+    def fits(self, shape):
+        """Whether a frame of this shape fits the recording's slots"""
+        height, width, channels = tuple(shape) + (1,) * (3 - len(shape))
+        return height <= self.shape[0] and width <= self.shape[1] and channels == self.shape[2]
+
+    def append(self, frame, timestamp=None, roi=(0, 0, 0, 0), exposure_us=0, analog_gain=0.0):
+        """Append one frame; returns False if it is larger than the slot shape"""
+        if frame.ndim == 2:
+            frame = frame[:, :, np.newaxis]
+        height, width, channels = frame.shape
+        if not self.fits(frame.shape):
+            print(f"Frame {frame.shape} does not fit recording slots {self.shape}")
+            return False
+
+        written = self.written
+        slot = written % self.capacity
+        size = height * width * channels
+        self.slots[slot, :size].reshape(height, width, channels)[:] = frame
+
+        record = self.metadata[slot]
+        record['timestamp'] = time.time() if timestamp is None else timestamp
+        record['height'] = height
+        record['width'] = width
+        record['roi'] = roi
+        record['exposure_us'] = exposure_us
+        record['analog_gain'] = analog_gain
+        record['sequence'] = written
+
+        # Publish the frame only after its pixels and metadata are in place
+        self._written[0] = written + 1
+        return True
+
+    def flush(self):
+        self.mmap.flush()
+
+
+class FrameReader(_Recording):
+    """Read-only, zero-copy access to a raw frame recording"""
+
+    def __init__(self, path):
+        self.path = path
+        self._map(path, 'r')
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self.frame(index)
@@ -0,0 +1,149 @@
+"""
+Pluggable frame sources for CameraManager.
+
+A frame source stands in for picamera2's capture_array(): read() returns the
+next BGR frame (or None when exhausted) and close() releases resources;
+sources with `precropped` set return RGB crops that skip conversion and crop. Replay
+sources feed recorded footage at a fixed FPS, or as fast as possible, so the
+full LightDetectionSystem can be load-tested and profiled without a camera.
+"""
+
+import abc
+import os
+import time
+
+import cv2
+import numpy as np
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+
+
+class ReplayFrameSource(abc.ABC):
+    """Base class handling pacing, looping and replay statistics"""
+
+    def __init__(self, fps=0, loop=True):
+        self.fps = fps  # 0 replays as fast as possible
+        self.loop = loop
+        self.position = 0
+        self.frames_served = 0
+        self.max_lag = 0.0  # Worst delay behind the FPS schedule (seconds)
+        self.precropped = False  # True when frames are already cropped RGB
+        self._start_time = None
+
+    @abc.abstractmethod
+    def __len__(self):
+        """Number of frames in the replay"""
+
+    @abc.abstractmethod
+    def _load_frame(self, index):
+        """Frame at a position in the replay"""
+
+    def _wait_for_next_frame(self):
+        """Sleep until the next frame is due according to the FPS schedule"""
+        now = time.monotonic()
+        if self._start_time is None:
+            self._start_time = now
+        if not self.fps:
+            return
+
+        due = self._start_time + self.frames_served / self.fps
+        if due > now:
+            time.sleep(due - now)
+        else:
+            self.max_lag = max(self.max_lag, now - due)
+
+    def read(self):
+        """Return the next frame, or None when the replay is exhausted"""
+        if len(self) == 0:
+            return None
+        if self.position >= len(self):
+            if not self.loop:
+                return None
+            self.position = 0
+
+        self._wait_for_next_frame()
+        frame = self._load_frame(self.position)
+        self.position += 1
+        self.frames_served += 1
+        return frame
+
+    def stats(self):
+        """Replay throughput statistics"""
+        elapsed = time.monotonic() - self._start_time if self._start_time else 0.0
+        return {
+            'frames_served': self.frames_served,
+            'elapsed': elapsed,
+            'fps': self.frames_served / elapsed if elapsed > 0 else 0.0,
+            'max_lag': self.max_lag,
+        }
+
+    def close(self):
+        pass
+
+
+class ImageSequenceSource(ReplayFrameSource):
+    """Replay a directory of still images in filename order"""
+
+    def __init__(self, directory, fps=0, loop=True, preload=False):
+        super().__init__(fps, loop)
+        self.paths = sorted(
+            os.path.join(directory, f) for f in os.listdir(directory)
+            if f.lower().endswith(IMAGE_EXTENSIONS)
+        )
+        # Preloading keeps JPEG decode cost out of load-test measurements
+        self.frames = [cv2.imread(p) for p in self.paths] if preload else None
+
+    def __len__(self):
+        return len(self.paths)
+
+    def _load_frame(self, index):
+        if self.frames is not None:
+            return self.frames[index]
+        return cv2.imread(self.paths[index])
+
+
+class ArrayFrameSource(ReplayFrameSource):
+    """Replay raw frames from a .npy array shaped (frames, height, width, 3)"""
+
+    def __init__(self, path, fps=0, loop=True):
+        super().__init__(fps, loop)
+        self.frames = np.load(path, mmap_mode='r')
+        if self.frames.ndim != 4:
+            raise ValueError(f"Expected (frames, height, width, channels) array, got {self.frames.shape}")
+
+    def __len__(self):
+        return self.frames.shape[0]
+
+    def _load_frame(self, index):
+        return np.ascontiguousarray(self.frames[index])
+
+
+class RecordingFrameSource(ReplayFrameSource):
+    """Replay a raw frame recording (see frame_recorder.py) without decoding"""
+
+    def __init__(self, path, fps=0, loop=True):
+        from frame_recorder import FrameReader
+
+        super().__init__(fps, loop)
+        self.reader = FrameReader(path)
+        self.precropped = True  # Recordings hold the RGB crops the detector saw
+
+    def __len__(self):
+        return len(self.reader)
+
+    def _load_frame(self, index):
+        return self.reader.frame(index)
+
+    def close(self):
+        self.reader.close()
+
+
+def create_frame_source(path, fps=0, loop=True):
+    """Pick a replay source for a directory of images or a raw frame file"""
+    if os.path.isdir(path):
+        return ImageSequenceSource(path, fps=fps, loop=loop)
+    if path.endswith('.npy'):
+        return ArrayFrameSource(path, fps=fps, loop=loop)
+    if path.endswith('.ldraw'):
+        return RecordingFrameSource(path, fps=fps, loop=loop)
+    raise ValueError(f"Unsupported frame source: {path}")
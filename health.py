@@ -0,0 +1,181 @@
+"""
+Health monitoring, camera self-healing and the systemd watchdog.
+
+HealthMonitor tracks the age of the last good frame, slow captures and
+consecutive capture errors. When the camera looks dead it is reinitialized
+in-process, with exponential backoff between attempts, instead of waiting
+for systemd to restart the whole service.
+
+Watchdog sends sd_notify messages over NOTIFY_SOCKET (READY=1, STATUS=...,
+WATCHDOG=1). Keep-alives are only sent while the monitor reports healthy, so
+a hung capture or a camera that in-process recovery cannot bring back lets
+WatchdogSec expire and systemd restarts the service. Outside systemd the
+notifications are no-ops.
+"""
+
+import os
+import socket
+import threading
+import time
+
+from config import Config
+
+
+def sd_notify(message):
+    """Send a notification to systemd; returns False when not run by systemd"""
+    address = os.environ.get('NOTIFY_SOCKET')
+    if not address:
+        return False
+    if address.startswith('@'):
+        address = '\0' + address[1:]  # Abstract socket namespace
+
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sock:
+            sock.connect(address)
+            sock.sendall(message.encode())
+        return True
+    except OSError as e:
+        print(f"sd_notify failed: {e}")
+        return False
+
+
+def watchdog_interval():
+    """Seconds between keep-alives (half of WatchdogSec), or None if the watchdog is off"""
+    usec = os.environ.get('WATCHDOG_USEC')
+    pid = os.environ.get('WATCHDOG_PID')
+    if not usec or (pid and int(pid) != os.getpid()):
+        return None
+    return int(usec) / 2e6
+
+
+class HealthMonitor:
+    def __init__(self, metrics=None):
+        self.config = Config()
+        self.metrics = metrics
+        self.started = time.monotonic()
+        self.last_frame = None
+        self.last_activity = self.started  # Last time the loop reported anything
+        self.error_streak = 0
+        self.slow_streak = 0
+        self.failed_recoveries = 0  # Consecutive recoveries not followed by a good frame
+        self.next_recovery = 0.0
+        self.recoveries = 0
+        self.rate_divisor = 1  # Set by thermal control when it slows the loop down
+
+    def interval(self):
+        """Expected seconds between frames"""
+        return self.config.DETECTION_INTERVAL * self.rate_divisor
+
+    def record_frame(self, latency):
+        """A frame was captured in `latency` seconds"""
+        now = time.monotonic()
+        self.last_frame = now
+        self.last_activity = now
+        self.error_streak = 0
+        self.failed_recoveries = 0
+        if latency > self.config.HEALTH_MAX_CAPTURE_LATENCY:
+            self.slow_streak += 1
+        else:
+            self.slow_streak = 0
+
+    def record_error(self):
+        """A capture failed (no frame or an exception)"""
+        self.last_activity = time.monotonic()
+        self.error_streak += 1
+
+    def frame_age(self):
+        """Seconds since the last good frame (or since start-up)"""
+        return time.monotonic() - (self.last_frame or self.started)
+
+    def max_frame_age(self):
+        # A frame is expected every interval, so never flag less than two intervals
+        return max(self.config.HEALTH_MAX_FRAME_AGE, 2 * self.interval())
+
+    def problem(self):
+        """Why the camera needs recovering, or None"""
+        if self.error_streak >= self.config.HEALTH_ERROR_STREAK:
+            return f"{self.error_streak} consecutive capture errors"
+        if self.slow_streak >= self.config.HEALTH_ERROR_STREAK:
+            return f"{self.slow_streak} consecutive captures slower than {self.config.HEALTH_MAX_CAPTURE_LATENCY}s"
+        if self.frame_age() > self.max_frame_age():
+            return f"no frame for {self.frame_age():.0f}s"
+        return None
+
+    def recover(self, camera):
+        """
+        Reinitialize the camera if it looks dead and the backoff has passed
+        Returns True if a recovery was attempted.
+        """
+        problem = self.problem()
+        now = time.monotonic()
+        if problem is None or now < self.next_recovery:
+            return False
+
+        self.failed_recoveries += 1
+        delay = min(self.config.HEALTH_BACKOFF_INITIAL * 2 ** (self.failed_recoveries - 1),
+                    self.config.HEALTH_BACKOFF_MAX)
+        self.next_recovery = now + delay
+        print(f"Camera unhealthy ({problem}), reinitializing "
+              f"(attempt {self.failed_recoveries}, next in {delay:.1f}s)")
+
+        self.recoveries += 1
+        if self.metrics:
+            self.metrics.inc('camera_recoveries')
+        try:
+            camera.reinitialize()
+        except Exception as e:
+            print(f"Camera reinitialization failed: {e}")
+
+        # Give the reopened camera a fresh start before judging it again
+        self.error_streak = 0
+        self.slow_streak = 0
+        self.last_activity = time.monotonic()
+        return True
+
+    def healthy(self):
+        """False when the loop has stalled or in-process recovery has given up"""
+        stalled = time.monotonic() - self.last_activity > self.interval() + self.config.HEALTH_STALL_TIMEOUT
+        return not stalled and self.failed_recoveries < self.config.HEALTH_MAX_RECOVERIES
+
+    def status(self):
+        """One-line summary for systemd STATUS= and logs"""
+        if self.last_frame is None:
+            return "Waiting for first frame"
+        text = f"Last frame {self.frame_age():.0f}s ago"
+        if self.error_streak:
+            text += f", {self.error_streak} errors in a row"
+        if self.recoveries:
+            text += f", {self.recoveries} camera recoveries"
+        return text
+
+
+class Watchdog:
+    """Sends systemd keep-alives from a background thread while healthy() is true"""
+
+    def __init__(self, healthy, status=None):
+        self.healthy = healthy
+        self.status = status
+        self.interval = watchdog_interval()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def ready(self):
+        """Tell systemd start-up is complete and start the keep-alives"""
+        sd_notify("READY=1")
+        if self.interval:
+            self._thread = threading.Thread(target=self._run, name='watchdog', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            if self.healthy():
+                message = "WATCHDOG=1"
+                if self.status:
+                    message += f"\nSTATUS={self.status()}"
+                sd_notify(message)
+
+    def stop(self):
+        sd_notify("STOPPING=1")
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
@@ -0,0 +1,71 @@
+"""
+In-memory LRU cache for archived images served by the web interface.
+
+File contents are cached up to IMAGE_CACHE_BYTES in total, least recently
+used first out. Entries are keyed by path and validated against the file's
+mtime and size on every request (one stat, no read), so a capture replaced
+within the same second is never served stale. The same stat gives the
+ETag and Last-Modified used to answer conditional requests with 304.
+"""
+
+import threading
+from collections import OrderedDict
+
+
+def etag_for(stat):
+    """Strong validator from a file's mtime and size"""
+    return f"{stat.st_mtime_ns:x}-{stat.st_size:x}"
+
+
+class ImageCache:
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0  # Requests answered with 304 (nothing read or sent)
+        self._entries = OrderedDict()  # path -> (etag, data)
+        self._lock = threading.Lock()  # Flask serves requests on several threads
+
+    def read(self, path, stat):
+        """Contents of path, from memory if the cached copy matches stat"""
+        etag = etag_for(stat)
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None and entry[0] == etag:
+                self._entries.move_to_end(path)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+        with open(path, 'rb') as f:
+            data = f.read()
+
+        with self._lock:
+            old = self._entries.pop(path, None)
+            if old is not None:
+                self.size -= len(old[1])
+            if len(data) <= self.max_bytes:
+                self._entries[path] = (etag, data)
+                self.size += len(data)
+                while self.size > self.max_bytes:
+                    _, (_, evicted) = self._entries.popitem(last=False)
+                    self.size -= len(evicted)
+        return data
+
+    def count_not_modified(self):
+        with self._lock:
+            self.not_modified += 1
+
+    def stats(self):
+        with self._lock:
+            served = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self.size,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'not_modified': self.not_modified,
+                'hit_ratio': self.hits / served if served else 0.0,
+            }
@@ -0,0 +1,275 @@
+"""
+Capture storage with a thumbnail pyramid and a SQLite index.
+
+ImageStore.save() writes the full JPEG and hands the frame to a background
+thread, which writes downscaled thumbnails (THUMBNAIL_WIDTHS, each level
+resized from the previous one), records the capture in the index and
+removes captures beyond MAX_IMAGES together with their thumbnails. The web
+interface pages through the index instead of listing IMAGE_DIR.
+
+When the background thread falls behind, new frames are dropped (counted as
+saves_dropped) rather than blocking the caller. On startup the index is
+reconciled with IMAGE_DIR, so captures written but never indexed (a crash
+with frames still queued) are indexed and fall under MAX_IMAGES. Other JPEGs in
+IMAGE_DIR are never deleted.
+"""
+
+import os
+import queue
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+import cv2
+
+from config import Config
+from metrics import NullMetrics
+
+THUMB_DIR = 'thumbs'
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS captures (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    filename TEXT UNIQUE NOT NULL,
+    timestamp REAL NOT NULL,
+    width INTEGER,
+    height INTEGER,
+    thumbnails TEXT NOT NULL DEFAULT ''
+)
+"""
+
+
+class ImageIndex:
+    """SQLite index of saved captures, newest first by id"""
+
+    def __init__(self, path, readonly=False):
+        self.path = path
+        if readonly:
+            self.conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True, timeout=5)
+        else:
+            directory = os.path.dirname(path)
+            if directory and not os.path.exists(directory):
+                os.makedirs(directory)
+            self.conn = sqlite3.connect(path, timeout=5, check_same_thread=False)
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute(_SCHEMA)
+            self.conn.commit()
+        self.conn.row_factory = sqlite3.Row
+
+    def add(self, filename, timestamp, width, height, thumbnails):
+        # A capture saved within the same second replaces the file, so replace its row too
+        with self.conn:
+            self.conn.execute("DELETE FROM captures WHERE filename = ?", (filename,))
+            self.conn.execute(
+                "INSERT INTO captures (filename, timestamp, width, height, thumbnails) VALUES (?, ?, ?, ?, ?)",
+                (filename, timestamp, width, height, ','.join(str(w) for w in thumbnails)))
+
+    def page(self, before=None, limit=50):
+        """Captures older than id `before` (newest first)"""
+        if before is None:
+            rows = self.conn.execute("SELECT * FROM captures ORDER BY id DESC LIMIT ?", (limit,))
+        else:
+            rows = self.conn.execute("SELECT * FROM captures WHERE id < ? ORDER BY id DESC LIMIT ?",
+                                     (before, limit))
+        return [dict(row) for row in rows]
+
+    def count(self):
+        return self.conn.execute("SELECT COUNT(*) FROM captures").fetchone()[0]
+
+    def filenames(self):
+        return {row[0] for row in self.conn.execute("SELECT filename FROM captures")}
+
+    def newest_timestamp(self):
+        return self.conn.execute("SELECT MAX(timestamp) FROM captures").fetchone()[0]
+
+    def expired(self, keep):
+        """Filenames and thumbnail widths beyond the newest `keep` captures"""
+        rows = self.conn.execute("SELECT filename, thumbnails FROM captures ORDER BY id DESC LIMIT -1 OFFSET ?",
+                                 (keep,))
+        return [(row['filename'], row['thumbnails']) for row in rows]
+
+    def remove(self, filenames):
+        with self.conn:
+            self.conn.executemany("DELETE FROM captures WHERE filename = ?", [(f,) for f in filenames])
+
+    def close(self):
+        self.conn.close()
+
+
+def index_path(config):
+    """IMAGE_INDEX_FILE, or index.db in IMAGE_DIR (which may be overridden at runtime)"""
+    return config.IMAGE_INDEX_FILE or os.path.join(config.IMAGE_DIR, 'index.db')
+
+
+def thumbnail_path(image_dir, width, filename):
+    return os.path.join(image_dir, THUMB_DIR, str(width), filename)
+
+
+class ImageStore:
+    def __init__(self, config=None, background=True, metrics=None):
+        self.config = config or Config()
+        self.metrics = metrics or NullMetrics()
+        self.image_dir = self.config.IMAGE_DIR
+        self.created = time.time()
+        self.index = None
+        self._queue = None
+        self._thread = None
+        if background:
+            self._queue = queue.Queue(maxsize=16)
+            self._thread = threading.Thread(target=self._worker, name='image-store', daemon=True)
+            self._thread.start()
+        else:
+            self._open_index()
+
+    def save(self, image):
+        """
+        Save an RGB image as a timestamped JPEG; thumbnails and indexing follow
+        Returns the filename, or None if the frame was dropped because the
+        background thread is behind.
+        """
+        if self._queue is not None and self._queue.full():
+            return self._drop()
+        if not os.path.exists(self.image_dir):
+            os.makedirs(self.image_dir)
+
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        filename = f"capture_{timestamp}.jpg"
+
+        # Convert RGB to BGR for saving
+        image_bgr = cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
+        cv2.imwrite(os.path.join(self.image_dir, filename), image_bgr)
+
+        if self._queue is None:
+            self._process(filename, image_bgr, time.time())
+            return filename
+        try:
+            # The BGR copy is private to the store, so the caller may reuse its buffer
+            self._queue.put_nowait((filename, image_bgr, time.time()))
+        except queue.Full:
+            os.remove(os.path.join(self.image_dir, filename))  # Never indexed, so never cleaned up
+            return self._drop()
+        return filename
+
+    def _drop(self):
+        self.metrics.inc('saves_dropped')
+        print("Image store busy, dropping capture")
+        return None
+
+    def cleanup(self):
+        """Remove captures (and thumbnails) beyond MAX_IMAGES"""
+        if self._queue is None:
+            self._cleanup()
+        else:
+            try:
+                self._queue.put_nowait(('cleanup', None, None))
+            except queue.Full:
+                pass  # Every queued capture runs the cleanup anyway
+
+    def flush(self):
+        """Wait until queued captures are indexed"""
+        if self._queue is not None:
+            self._queue.join()
+
+    def close(self):
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+        elif self.index is not None:
+            self.index.close()
+
+    def _open_index(self):
+        self.index = ImageIndex(index_path(self.config))
+        self._reconcile()
+
+    def _worker(self):
+        self._open_index()
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    break
+                filename, image_bgr, timestamp = item
+                if filename == 'cleanup':
+                    self._cleanup()
+                else:
+                    self._process(filename, image_bgr, timestamp)
+            except Exception as e:
+                print(f"Error indexing capture: {e}")
+            finally:
+                self._queue.task_done()
+        self.index.close()
+
+    def _process(self, filename, image_bgr, timestamp):
+        """Write thumbnails, index the capture and enforce MAX_IMAGES"""
+        widths = self._write_thumbnails(filename, image_bgr) if image_bgr is not None else []
+        height, width = image_bgr.shape[:2] if image_bgr is not None else (None, None)
+        self.index.add(filename, timestamp, width, height, widths)
+        self._cleanup()
+
+    def _write_thumbnails(self, filename, image_bgr):
+        """Write each pyramid level, resizing from the previous (larger) level"""
+        written = []
+        level = image_bgr
+        for width in sorted(self.config.THUMBNAIL_WIDTHS, reverse=True):
+            if width < level.shape[1]:
+                height = max(1, round(level.shape[0] * width / level.shape[1]))
+                level = cv2.resize(level, (width, height), interpolation=cv2.INTER_AREA)
+            path = thumbnail_path(self.image_dir, width, filename)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            cv2.imwrite(path, level, [cv2.IMWRITE_JPEG_QUALITY, self.config.THUMBNAIL_QUALITY])
+            written.append(width)
+        return written
+
+    def _cleanup(self):
+        expired = self.index.expired(self.config.MAX_IMAGES)
+        for filename, thumbnails in expired:
+            self._remove_files(filename, [w for w in thumbnails.split(',') if w])
+        if expired:
+            self.index.remove([filename for filename, _ in expired])
+
+    def _remove_files(self, filename, widths):
+        paths = [os.path.join(self.image_dir, filename)]
+        paths += [thumbnail_path(self.image_dir, w, filename) for w in widths]
+        for path in paths:
+            if os.path.exists(path):
+                os.remove(path)
+
+    def _reconcile(self):
+        """
+        Bring the index in line with IMAGE_DIR (one directory scan)
+        Rows whose JPEG is gone are removed. Unindexed captures newer than the
+        newest indexed one (all of them for a new index) were still queued when
+        the process stopped and are indexed. Older or unreadable JPEGs were put
+        there by hand and are left alone.
+        """
+        if not os.path.exists(self.image_dir):
+            return
+        indexed = self.index.filenames()
+        files = {f for f in os.listdir(self.image_dir) if f.endswith('.jpg')}
+
+        stale = indexed - files
+        for filename in stale:
+            self._remove_files(filename, self.config.THUMBNAIL_WIDTHS)
+        if stale:
+            self.index.remove(stale)
+
+        newest = self.index.newest_timestamp()
+        added = skipped = 0
+        for filename in sorted(files - indexed):
+            path = os.path.join(self.image_dir, filename)
+            mtime = os.path.getmtime(path)
+            if mtime >= self.created:
+                continue  # Saved by this process, indexed through the queue
+            image_bgr = cv2.imread(path) if newest is None or mtime >= newest else None
+            if image_bgr is None:
+                skipped += 1
+                continue
+            self.index.add(filename, mtime, image_bgr.shape[1], image_bgr.shape[0],
+                           self._write_thumbnails(filename, image_bgr))
+            added += 1
+        if stale or added or skipped:
+            print(f"Image index reconciled: {added} captures indexed, {skipped} older or unreadable "
+                  f"JPEGs left unindexed, {len(stale)} missing captures dropped")
+        self._cleanup()
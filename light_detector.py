@@ -2,30 +2,147 @@ import cv2
 import numpy as np
 from config import Config
 
+YUV_LUT_SHIFT = 2  # YUV lookup table uses 64 levels per channel
+YUV_LUT_BITS = 8 - YUV_LUT_SHIFT
+
+def split_yuv420(buffer, width, height):
+    """
+    Split a planar YUV420 (I420) buffer into Y, U and V planes (views, no copy)
+    The buffer is (height * 3 / 2, stride) as returned by picamera2 or OpenCV;
+    height must be a multiple of 4.
+    """
+    stride = buffer.shape[1]
+    quarter = height // 4
+    y = buffer[:height, :width]
+    u = buffer[height:height + quarter].reshape(height // 2, stride // 2)[:, :width // 2]
+    v = buffer[height + quarter:height + 2 * quarter].reshape(height // 2, stride // 2)[:, :width // 2]
+    return y, u, v
+
+def bgr_to_yuv420(image_bgr, full_range=True):
+    """Convert a BGR image to Y, U, V planes as a YUV420 camera stream delivers them"""
+    height, width = image_bgr.shape[:2]
+    if not full_range:
+        return split_yuv420(cv2.cvtColor(image_bgr, cv2.COLOR_BGR2YUV_I420), width, height)
+    
+    ycrcb = cv2.cvtColor(image_bgr, cv2.COLOR_BGR2YCrCb)
+    chroma = ycrcb[::2, ::2]  # Co-sited 2x2 chroma subsampling
+    return ycrcb[:, :, 0], chroma[:, :, 2], chroma[:, :, 1]
+
+class DetectionParams:
+    """
+    Detection settings compiled once from a Config
+    Holds the HSV bounds arrays (or the trained pixel classifier), pixel crop
+    boxes per frame size and the YUV lookup table. Instances are never modified after use starts, so a reload
+    swaps in a new instance and each frame sees one consistent set.
+    """
+    
+    def __init__(self, config):
+        self.threshold = config.RED_LIGHT_THRESHOLD
+        
+        # Define red color ranges (red wraps around 0/180 in HSV)
+        self.lower_red1 = np.array([0, config.RED_SATURATION_MIN, config.RED_VALUE_MIN])
+        self.upper_red1 = np.array([config.RED_HUE_MAX, 255, 255])
+        self.lower_red2 = np.array([160, config.RED_SATURATION_MIN, config.RED_VALUE_MIN])
+        self.upper_red2 = np.array([180, 255, 255])
+        
+        self.classifier = None
+        if config.DETECTOR_BACKEND == 'classifier':
+            from pixel_classifier import PixelClassifier
+            self.classifier = PixelClassifier.load(config.CLASSIFIER_MODEL_FILE)
+            self.threshold = self.classifier.ratio_threshold  # Fitted to the model's red ratios
+        
+        # Only pixels with R >= RED_VALUE_MIN can be red while R is the largest
+        # channel of every red hue (hue ranges within 0-30 and 150-180)
+        self.early_exit = config.EARLY_EXIT_ENABLED and self.classifier is None and config.RED_HUE_MAX <= 30
+        self.early_exit_max_area = config.EARLY_EXIT_MAX_AREA
+        
+        self.lores_full_range = config.LORES_FULL_RANGE
+        self.crop = (config.CROP_LEFT, config.CROP_TOP, config.CROP_RIGHT, config.CROP_BOTTOM)
+        self._crop_boxes = {}
+        self._yuv_lut = None
+    
+    def crop_box(self, height, width):
+        """Pixel box (left, top, right, bottom) of the CROP_* region for a frame size"""
+        box = self._crop_boxes.get((height, width))
+        if box is None:
+            left, top, right, bottom = self.crop
+            box = (int(width * left), int(height * top), int(width * right), int(height * bottom))
+            self._crop_boxes[(height, width)] = box
+        return box
+    
+    @property
+    def yuv_lut(self):
+        if self._yuv_lut is None:
+            self._yuv_lut = self._build_yuv_lut()
+        return self._yuv_lut
+    
+    def _build_yuv_lut(self):
+        """
+        Precompute which (Y, U, V) cells count as red under the HSV thresholds
+        Each cell center is converted to RGB with the BT.601 matrix for the
+        stream's range and classified by the same HSV ranges (or classifier)
+        as detect_red_light.
+        """
+        levels = 256 >> YUV_LUT_SHIFT
+        centers = (np.arange(levels, dtype=np.float32) * (1 << YUV_LUT_SHIFT)) + (1 << YUV_LUT_SHIFT) / 2
+        y, u, v = np.meshgrid(centers, centers, centers, indexing='ij')
+        u = u - 128
+        v = v - 128
+        
+        if self.lores_full_range:
+            r = y + 1.402 * v
+            g = y - 0.344136 * u - 0.714136 * v
+            b = y + 1.772 * u
+        else:
+            y = (y - 16) * 1.164
+            r = y + 1.596 * v
+            g = y - 0.392 * u - 0.813 * v
+            b = y + 2.017 * u
+        
+        rgb = np.clip(np.stack([r, g, b], axis=-1), 0, 255).round().astype(np.uint8)
+        if self.classifier is not None:
+            return self.classifier.classify_rgb(rgb.reshape(-1, 3))
+        
+        hsv = cv2.cvtColor(rgb.reshape(-1, 1, 3), cv2.COLOR_RGB2HSV)
+        red = (cv2.inRange(hsv, self.lower_red1, self.upper_red1) |
+               cv2.inRange(hsv, self.lower_red2, self.upper_red2)) > 0
+        
+        return red.ravel()  # Flat, indexed by packing the shifted (y, u, v)
+
 class LightDetector:
     def __init__(self):
         self.config = Config()
+        self.params = DetectionParams(self.config)  # Replaced as a whole on config reload
+        self.background = None
+        if self.config.BACKGROUND_MODEL_ENABLED and self.config.ROI_TRACKING_ENABLED:
+            # The tracked ROI re-centers every frame, which would reset the background every frame
+            print("Background model disabled: it cannot follow the moving ROI of ROI tracking")
+        elif self.config.BACKGROUND_MODEL_ENABLED:
+            from background_model import BackgroundModel
+            self.background = BackgroundModel(self.config)
+        
+    def red_mask(self, image, params=None):
+        """Binary mask (0/255) of the red pixels in an RGB image"""
+        params = params or self.params
+        if params.classifier is not None:
+            return params.classifier.red_mask(image)
+        
+        # Convert RGB to HSV for better color detection
+        hsv = cv2.cvtColor(image, cv2.COLOR_RGB2HSV)
         
-    def detect_red_light(self, image):
+        # Create masks for red detection
+        mask1 = cv2.inRange(hsv, params.lower_red1, params.upper_red1)
+        mask2 = cv2.inRange(hsv, params.lower_red2, params.upper_red2)
+        return mask1 + mask2
+    
+    def detect_red_light(self, image, params=None):
         """
         Detect red light in the image
         Returns: (detected: bool, confidence: float, red_pixels: int)
         """
+        params = params or self.params
         try:
-            # Convert RGB to HSV for better color detection
-            hsv = cv2.cvtColor(image, cv2.COLOR_RGB2HSV)
-            
-            # Define red color ranges (red wraps around 0/180 in HSV)
-            lower_red1 = np.array([0, self.config.RED_SATURATION_MIN, self.config.RED_VALUE_MIN])
-            upper_red1 = np.array([self.config.RED_HUE_MAX, 255, 255])
-            
-            lower_red2 = np.array([160, self.config.RED_SATURATION_MIN, self.config.RED_VALUE_MIN])
-            upper_red2 = np.array([180, 255, 255])
-            
-            # Create masks for red detection
-            mask1 = cv2.inRange(hsv, lower_red1, upper_red1)
-            mask2 = cv2.inRange(hsv, lower_red2, upper_red2)
-            red_mask = mask1 + mask2
+            red_mask = self.red_mask(image, params)
             
             # Count red pixels
             red_pixels = cv2.countNonZero(red_mask)
@@ -33,7 +150,7 @@ class LightDetector:
             red_ratio = red_pixels / total_pixels
             
             # Check if red light is detected
-            detected = red_ratio > self.config.RED_LIGHT_THRESHOLD
+            detected = red_ratio > params.threshold
             
             # Calculate confidence based on red pixel density
             confidence = min(red_ratio * 10, 1.0)  # Scale up for better confidence
@@ -44,15 +161,53 @@ class LightDetector:
             print(f"Error in light detection: {e}")
             return False, 0.0, 0
     
-    def analyze_image(self, image):
+    def detect_red_light_prefiltered(self, image, params=None):
+        """
+        Red light detection behind a full-resolution bounding-box prefilter
+        A red pixel has V == R, so pixels with R below RED_VALUE_MIN cannot be red.
+        Only the bounding box of the remaining pixels is converted to HSV, unless
+        it covers more than EARLY_EXIT_MAX_AREA of the frame. Nothing is decimated.
+        Returns: (detected, confidence, red_pixels, early_exit), the first three
+        always equal to detect_red_light's
+        """
+        params = params or self.params
+        candidates = cv2.compare(cv2.extractChannel(image, 0), float(params.lower_red1[2]), cv2.CMP_GE)
+        left, top, width, height = cv2.boundingRect(candidates)
+        total_pixels = image.shape[0] * image.shape[1]
+        if width * height > params.early_exit_max_area * total_pixels:
+            return (*self.detect_red_light(image, params), False)
+        
+        red_pixels = 0
+        if width * height:
+            red_pixels = cv2.countNonZero(self.red_mask(image[top:top + height, left:left + width], params))
+        red_ratio = red_pixels / total_pixels
+        return red_ratio > params.threshold, min(red_ratio * 10, 1.0), red_pixels, True
+    
+    def analyze_image(self, image, box=None):
         """
         Comprehensive image analysis
+        box is the detection box the crop was taken from; the background model
+        is reset when it changes.
         Returns: dict with detection results and metadata
         """
-        detected, confidence, red_pixels = self.detect_red_light(image)
+        params = self.params
+        early_exit = False
+        ambient_red = 0
+        total_pixels = image.shape[0] * image.shape[1]
+        if self.background is not None:
+            # Only red brighter than the pixel's background counts (needs the full mask every frame)
+            self.background.follow(box)
+            mask = self.red_mask(image, params)
+            red_pixels = self.background.foreground_rgb(image, mask)
+            ambient_red = cv2.countNonZero(mask) - red_pixels
+            detected = red_pixels / total_pixels > params.threshold
+            confidence = min(red_pixels / total_pixels * 10, 1.0)
+        elif params.early_exit:
+            detected, confidence, red_pixels, early_exit = self.detect_red_light_prefiltered(image, params)
+        else:
+            detected, confidence, red_pixels = self.detect_red_light(image, params)
         
         # Calculate additional metrics
-        total_pixels = image.shape[0] * image.shape[1]
         red_ratio = red_pixels / total_pixels
         
         # Get image statistics
@@ -66,7 +221,57 @@ class LightDetector:
             'total_pixels': total_pixels,
             'red_ratio': red_ratio,
             'brightness': brightness,
-            'image_shape': image.shape
+            'image_shape': image.shape,
+            'early_exit': early_exit,
+            'ambient_red_pixels': ambient_red
+        }
+    
+    def yuv_red_mask(self, y, u, v, params=None):
+        """Boolean red mask of YUV420 planes, at chroma resolution"""
+        lut = (params or self.params).yuv_lut
+        
+        # Chroma is subsampled 2x2, so classify one luma sample per chroma sample
+        y_sub = y[::2, ::2][:u.shape[0], :u.shape[1]]
+        index = (y_sub >> YUV_LUT_SHIFT).astype(np.uint32) << (2 * YUV_LUT_BITS)
+        index |= (u >> YUV_LUT_SHIFT).astype(np.uint32) << YUV_LUT_BITS
+        index |= v >> YUV_LUT_SHIFT
+        return lut.take(index)
+    
+    def analyze_yuv420(self, y, u, v, box=None):
+        """
+        Analyze Y, U, V planes (from a lores YUV420 stream) without converting to RGB
+        Red is classified per chroma sample through a YUV lookup table and
+        brightness is the mean of the Y plane. box is as for analyze_image.
+        Returns the same dict as analyze_image.
+        """
+        params = self.params
+        red_mask = self.yuv_red_mask(y, u, v, params)
+        
+        total_pixels = y.shape[0] * y.shape[1]
+        red_samples = np.count_nonzero(red_mask)
+        ambient_red = 0
+        if self.background is not None:
+            self.background.follow(box)
+            foreground = self.background.foreground_yuv(y, red_mask)
+            ambient_red = int(round((red_samples - foreground) / red_mask.size * total_pixels))
+            red_samples = foreground
+        red_ratio = red_samples / red_mask.size
+        red_pixels = int(round(red_ratio * total_pixels))
+        
+        # Full-range luma is the same weighted sum as RGB2GRAY
+        brightness = cv2.mean(y)[0]
+        if not params.lores_full_range:
+            brightness = (brightness - 16) * 255 / 219
+        
+        return {
+            'detected': red_ratio > params.threshold,
+            'confidence': min(red_ratio * 10, 1.0),
+            'red_pixels': red_pixels,
+            'total_pixels': total_pixels,
+            'red_ratio': red_ratio,
+            'brightness': brightness,
+            'image_shape': (y.shape[0], y.shape[1], 3),
+            'ambient_red_pixels': ambient_red
         }
     
     def create_debug_image(self, image, analysis_result):
@@ -1,14 +1,17 @@
 #!/usr/bin/env python3
 
+from startup_timer import StartupTimer
+startup = StartupTimer()
+
 import time
 import logging
 import signal
 import sys
+import threading
 from datetime import datetime
-from camera_manager import CameraManager
-from light_detector import LightDetector
-from alert_manager import AlertManager
 from config import Config
+from config_loader import load_config, start_watcher
+from metrics import create_metrics
 
 class LightDetectionSystem:
     def __init__(self):
@@ -18,23 +21,30 @@ class LightDetectionSystem:
         self.camera = None
         self.detector = None
         self.alert_manager = None
+        self.change_gate = None
+        self.pipeline = None
+        self.config_watcher = None
+        self.health = None
+        self.pulse_meter = None
+        self.watchdog = None
+        self.roi_stream = None
+        self.fleet = None
+        self.thermal = None
+        self.metrics = create_metrics()
         
         self.running = False
+        self.cycle = 0
+        startup.mark('imports')
         
         # Setup signal handlers for graceful shutdown
         signal.signal(signal.SIGINT, self.signal_handler)
         signal.signal(signal.SIGTERM, self.signal_handler)
     
     def setup_logging(self):
-        """Setup logging configuration"""
-        logging.basicConfig(
-            level=getattr(logging, self.config.LOG_LEVEL),
-            format='%(asctime)s - %(levelname)s - %(message)s',
-            handlers=[
-                logging.FileHandler(self.config.LOG_FILE),
-                logging.StreamHandler()
-            ]
-        )
+        """Log through a queue to a background writer (JSON lines with rotation)"""
+        from structured_logging import setup_logging
+        # Pipeline workers are forked and log through the same queue
+        self.log_listener = setup_logging(self.config, multiprocess=self.config.PIPELINE_ENABLED)
         self.logger = logging.getLogger(__name__)
     
     def initialize(self):
@@ -42,18 +52,49 @@ class LightDetectionSystem:
         try:
             self.logger.info("Initializing Light Detection System...")
             
-            # Initialize camera
-            self.camera = CameraManager()
-            self.logger.info("Camera initialized")
+            # Initialize camera in the background: its warm-up mostly waits on
+            # frames, so the detector and alert imports overlap with it
+            camera_errors = []
+            camera_thread = threading.Thread(target=self._init_camera, args=(camera_errors,))
+            camera_thread.start()
             
             # Initialize detector
+            from light_detector import LightDetector
             self.detector = LightDetector()
             self.logger.info("Light detector initialized")
             
             # Initialize alert manager
-            self.alert_manager = AlertManager()
+            from alert_manager import AlertManager
+            self.alert_manager = AlertManager(metrics=self.metrics)
             self.logger.info("Alert manager initialized")
             
+            if self.config.CHANGE_GATE_ENABLED:
+                from change_gate import ChangeGate
+                self.change_gate = ChangeGate()
+            
+            if self.config.PULSE_METER_ENABLED:
+                from pulse_meter import PulseMeter
+                self.pulse_meter = PulseMeter(metrics=self.metrics)
+            
+            from roi_stream import create_publisher
+            self.roi_stream = create_publisher()
+            from fleet_reporter import create_reporter
+            self.fleet = create_reporter()
+            startup.mark('detector+alerts')
+            
+            camera_thread.join()
+            if camera_errors:
+                raise camera_errors[0]
+            self.logger.info("Camera initialized")
+            startup.mark('camera')
+            
+            from health import HealthMonitor
+            self.health = HealthMonitor(self.metrics)
+            if self.config.THERMAL_CONTROL_ENABLED:
+                from thermal_control import ThermalController
+                self.thermal = ThermalController()
+            self.config_watcher = start_watcher(self.apply_config)
+            
             self.logger.info("System initialization complete")
             return True
             
@@ -61,56 +102,193 @@ class LightDetectionSystem:
             self.logger.error(f"Initialization failed: {e}")
             return False
     
+    def _init_camera(self, errors):
+        """Create the camera manager (runs on a background thread)"""
+        try:
+            from camera_manager import CameraManager
+            self.camera = CameraManager(metrics=self.metrics)
+        except Exception as e:
+            errors.append(e)
+    
+    def apply_config(self, changed):
+        """Swap in detection parameters compiled from reloaded settings"""
+        from light_detector import DetectionParams
+        params = DetectionParams(self.config)
+        if self.config.DETECTION_STREAM == 'lores':
+            params.yuv_lut  # Build the lookup table here rather than in the next cycle
+        
+        # Single attribute assignments, so a cycle sees either the old or the new set
+        self.detector.params = params
+        self.camera.set_params(params)
+        if self.change_gate:
+            self.change_gate.reset()
+        self.logger.info(f"Config reloaded: {', '.join(changed)}")
+    
+    def apply_thermal(self):
+        """Let thermal control pick a quality level and apply it before the next capture"""
+        quality = self.thermal.update()
+        if quality is None:
+            return
+        self.camera.set_quality(quality.capture_scale, quality.crop_scale)
+        self.health.rate_divisor = quality.rate_divisor
+        if self.change_gate:
+            self.change_gate.reset()
+    
     def run_detection_cycle(self):
         """Run one complete detection cycle"""
+        cycle_start = time.perf_counter()
+        self.cycle += 1
+        self.metrics.inc('cycles')
         try:
-            # Capture image
+            if self.thermal:
+                self.apply_thermal()
+            archive = self.thermal is None or self.thermal.quality.archive
+            
+            # Capture image (saved after the change gate when gating)
             self.logger.debug("Capturing image...")
-            image = self.camera.capture_image(save_image=True)
+            save_now = self.change_gate is None and archive
+            capture_start = time.perf_counter()
+            frame_time = time.time()
+            if self.config.DETECTION_STREAM == 'lores':
+                image = self.camera.capture_yuv(save_image=save_now)
+            else:
+                image = self.camera.capture_image(save_image=save_now)
             
             if image is None:
+                if self.camera.frame_source is not None:
+                    self.logger.info("Replay exhausted")
+                    self.running = False
+                    return
                 self.logger.error("Failed to capture image")
+                self.metrics.inc('errors')
+                self.health.record_error()
+                if self.health.recover(self.camera):
+                    self.logger.warning(f"Camera reinitialized ({self.health.status()})")
                 return
+            capture_time = time.perf_counter() - capture_start
+            self.health.record_frame(capture_time)
+            
+            detect_start = time.perf_counter()
+            analysis = self.change_gate.check(image) if self.change_gate else None
+            if analysis is not None:
+                self.metrics.inc('frames_unchanged')
+            else:
+                # Analyze image
+                self.logger.debug("Analyzing image...")
+                with self.metrics.time('detect'):
+                    if self.config.DETECTION_STREAM == 'lores':
+                        analysis = self.detector.analyze_yuv420(*image, box=self.camera.detection_box)
+                    else:
+                        analysis = self.detector.analyze_image(image, box=self.camera.detection_box)
+                
+                if self.change_gate:
+                    self.change_gate.store(analysis)
+            detect_time = time.perf_counter() - detect_start
+            if self.change_gate and archive and not analysis.get('reused'):
+                self.camera.save_last_capture()
             
-            # Analyze image
-            self.logger.debug("Analyzing image...")
-            analysis = self.detector.analyze_image(image)
+            if self.pulse_meter:
+                reading = self.pulse_meter.update(frame_time, analysis['detected'])
+                if reading:
+                    self.logger.info(f"Meter pulse: {reading[1]:.0f} W")
             
             # Log results
             self.logger.info(f"Detection result: {analysis['detected']}, "
                            f"Confidence: {analysis['confidence']:.2f}, "
-                           f"Red pixels: {analysis['red_pixels']}")
+                           f"Red pixels: {analysis['red_pixels']}"
+                           f"{' (unchanged frame)' if analysis.get('reused') else ''}",
+                           extra={'fields': {
+                               'event': 'detection',
+                               'cycle': self.cycle,
+                               'detected': bool(analysis['detected']),
+                               'confidence': round(float(analysis['confidence']), 4),
+                               'red_pixels': int(analysis['red_pixels']),
+                               'reused': bool(analysis.get('reused')),
+                               'timings_ms': {
+                                   'capture': round(capture_time * 1000, 2),
+                                   'detect': round(detect_time * 1000, 2),
+                               },
+                           }})
             
             # Trigger alert if red light detected
             if analysis['detected']:
-                self.logger.warning("RED LIGHT DETECTED!")
-                self.alert_manager.trigger_alert(analysis)
+                self.logger.warning("RED LIGHT DETECTED!",
+                                    extra={'fields': {'event': 'alert', 'cycle': self.cycle}})
+                self.metrics.inc('detections')
+                with self.metrics.time('alert'):
+                    self.alert_manager.trigger_alert(analysis)
             else:
                 self.logger.debug("No red light detected")
             
+            if self.roi_stream:
+                self.roi_stream.publish(image, analysis)
+            
+            if self.fleet:
+                self.fleet.record(frame_time, analysis, healthy=self.health.healthy(),
+                                  power=self.pulse_meter.detector.current_power() if self.pulse_meter else None)
+            
         except Exception as e:
             self.logger.error(f"Error in detection cycle: {e}")
+            self.metrics.inc('errors')
+        finally:
+            self.metrics.observe('cycle', time.perf_counter() - cycle_start)
+    
+    def run_pipeline(self, max_cycles=None):
+        """Run capture, analysis and I/O as separate processes until stopped"""
+        from pipeline import DetectionPipeline
+        
+        from health import Watchdog
+        
+        self.pipeline = DetectionPipeline(max_frames=max_cycles)
+        self.running = True
+        self.logger.info("Starting pipelined light detection system...")
+        self.pipeline.start()
+        self.watchdog = Watchdog(self.pipeline.healthy, self.pipeline.report)
+        self.watchdog.ready()
+        startup.mark('pipeline started')
+        self.logger.info(startup.report())
+        clean = self.pipeline.wait()
+        self.watchdog.stop()
+        self.logger.info("Pipeline stopped" if clean else "Pipeline stopped after a stage failed")
     
-    def run(self):
+    def run(self, max_cycles=None):
         """Main run loop"""
+        if self.config.PIPELINE_ENABLED:
+            self.run_pipeline(max_cycles)
+            return
+        
         if not self.initialize():
             self.logger.error("Failed to initialize system")
             return
         
+        from health import Watchdog
+        self.watchdog = Watchdog(self.health.healthy, self.health.status)
+        self.watchdog.ready()
+        
         self.running = True
         self.logger.info("Starting light detection system...")
         self.logger.info(f"Detection interval: {self.config.DETECTION_INTERVAL} seconds")
         
+        cycles = 0
         try:
             while self.running:
                 start_time = time.time()
                 
                 # Run detection cycle
                 self.run_detection_cycle()
+                if not self.running:
+                    break  # Replay exhausted
+                cycles += 1
+                if cycles == 1:
+                    startup.mark('first detection')
+                    self.logger.info(startup.report())
+                if max_cycles and cycles >= max_cycles:
+                    break
                 
-                # Calculate sleep time
+                # Calculate sleep time (thermal control divides the frame rate)
                 elapsed = time.time() - start_time
-                sleep_time = max(0, self.config.DETECTION_INTERVAL - elapsed)
+                divisor = self.thermal.quality.rate_divisor if self.thermal else 1
+                sleep_time = max(self.config.DETECTION_INTERVAL, elapsed) * divisor - elapsed
                 
                 if sleep_time > 0:
                     time.sleep(sleep_time)
@@ -120,35 +298,81 @@ class LightDetectionSystem:
         except Exception as e:
             self.logger.error(f"Unexpected error in main loop: {e}")
         finally:
+            if self.camera and self.camera.frame_source:
+                stats = self.camera.frame_source.stats()
+                self.logger.info(f"Replay: {stats['frames_served']} frames in {stats['elapsed']:.1f}s "
+                                 f"({stats['fps']:.1f} fps, max lag {stats['max_lag'] * 1000:.0f} ms)")
+            if self.change_gate:
+                stats = self.change_gate.stats()
+                self.logger.info(f"Change gate: {stats['reused']}/{stats['frames']} frames unchanged "
+                                 f"({stats['skip_rate']:.1%} skipped), {stats['analyzed']} analyzed")
             self.cleanup()
     
     def signal_handler(self, signum, frame):
         """Handle shutdown signals"""
         self.logger.info(f"Received signal {signum}, shutting down...")
         self.running = False
+        if self.pipeline:
+            self.pipeline.stop()
     
     def cleanup(self):
         """Clean up resources"""
         self.logger.info("Cleaning up...")
         
+        if self.watchdog:
+            self.watchdog.stop()
+        
+        if self.config_watcher:
+            self.config_watcher.stop()
+        
         if self.camera:
             self.camera.close()
         
         if self.alert_manager:
             self.alert_manager.cleanup()
         
+        if self.pulse_meter:
+            self.pulse_meter.close()
+        
+        if self.fleet:
+            self.fleet.stop()
+        
         self.logger.info("Cleanup complete")
 
 def main():
     """Main entry point"""
-    # Security check for secrets
-    from config import Config
-    missing = Config.check_secrets()
-    if missing:
-        print("[ERROR] Required secrets are missing. Please set them in your .env file before running.")
-        exit(1)
+    import argparse
+    parser = argparse.ArgumentParser(description="Light Detection System")
+    parser.add_argument('--replay', help="replay a directory of images or a raw frame file instead of the camera")
+    parser.add_argument('--replay-fps', type=float, help="replay rate (0 = as fast as possible)")
+    parser.add_argument('--interval', type=float, help="override DETECTION_INTERVAL in seconds")
+    parser.add_argument('--max-cycles', type=int, help="stop after this many detection cycles")
+    parser.add_argument('--pipeline', action='store_true',
+                        help="run capture, analysis and I/O in separate processes")
+    args = parser.parse_args()
+    
+    # File/environment overrides first, so command-line flags win
+    load_config()
+    if args.replay:
+        Config.CAMERA_SOURCE = args.replay
+    if args.replay_fps is not None:
+        Config.REPLAY_FPS = args.replay_fps
+    if args.interval is not None:
+        Config.DETECTION_INTERVAL = args.interval
+    if args.pipeline:
+        Config.PIPELINE_ENABLED = True
+    
+    # Security check for secrets (replay runs are offline)
+    if not Config.CAMERA_SOURCE:
+        missing = Config.check_secrets()
+        if missing:
+            print("[ERROR] Required secrets are missing. Please set them in your .env file before running.")
+            exit(1)
     system = LightDetectionSystem()
-    system.run()
+    try:
+        system.run(max_cycles=args.max_cycles)
+    finally:
+        system.log_listener.stop()  # Flush queued log records
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
@@ -0,0 +1,219 @@
+"""
+Lightweight pipeline metrics.
+
+Stage timings go into fixed-bucket histograms and events into counters. All
+values live in a small memory-mapped file so the detector process writes them
+and the web interface can render them in Prometheus text format.
+
+Each writing process (the detector, or each pipeline worker) claims its own
+slot in the file on its first update, so no two processes ever update the same
+value; readers sum the slots. A slot left by a process that exited is taken
+over with its totals by the next one.
+"""
+
+import bisect
+import fcntl
+import os
+import threading
+import time
+
+import numpy as np
+from config import Config
+
+STAGES = ('capture', 'color_convert', 'crop', 'detect', 'save', 'alert', 'cycle')
+COUNTERS = ('cycles', 'detections', 'alerts_sent', 'alerts_suppressed', 'errors', 'frames_unchanged',
+            'camera_recoveries', 'pulses', 'alerts_delivered', 'alert_delivery_failures', 'saves_dropped')
+
+# Histogram bucket upper bounds in seconds (+Inf is implicit)
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+_MAGIC = 0x4C444D32  # 'LDM2'
+_SLOTS = 8  # Writer processes sharing the file
+_HEADER = 5  # magic, stage count, counter count, bucket count, slot count
+_STAGE_WIDTH = len(BUCKETS) + 3  # buckets, +Inf, sum, count
+_SLOT_SIZE = 1 + len(COUNTERS) + len(STAGES) * _STAGE_WIDTH  # owner pid, counters, stages
+_SIZE = _HEADER + _SLOTS * _SLOT_SIZE
+
+_PREFIX = 'light_detector'
+
+
+class _StageTimer:
+    """Context manager that records its elapsed time into a stage histogram"""
+    __slots__ = ('metrics', 'stage', 'start')
+
+    def __init__(self, metrics, stage):
+        self.metrics = metrics
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.metrics.observe(self.stage, time.perf_counter() - self.start)
+        return False
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class PipelineMetrics:
+    def __init__(self, path=None):
+        self.config = Config()
+        self.path = path or self.config.METRICS_FILE
+        self.values = self._open(self.path)
+        self.slot = None  # This process's values, claimed on the first update
+        self._pid = None
+        self._lock = threading.Lock()  # Threads of one process share its slot
+        self._counter_index = {name: 1 + i for i, name in enumerate(COUNTERS)}
+        stage_base = 1 + len(COUNTERS)
+        self._stage_index = {name: stage_base + i * _STAGE_WIDTH for i, name in enumerate(STAGES)}
+
+    @staticmethod
+    def _open(path):
+        """Open the shared metrics file, (re)creating it if the layout changed"""
+        expected = (_MAGIC, len(STAGES), len(COUNTERS), len(BUCKETS), _SLOTS)
+        with open(path, 'ab') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)  # Processes starting together must not both recreate it
+            try:
+                if os.fstat(f.fileno()).st_size == _SIZE * 8:
+                    values = np.memmap(path, dtype=np.float64, mode='r+', shape=(_SIZE,))
+                    if tuple(values[:_HEADER]) == expected:
+                        return values
+
+                f.truncate(0)
+                f.truncate(_SIZE * 8)
+                values = np.memmap(path, dtype=np.float64, mode='r+', shape=(_SIZE,))
+                values[:_HEADER] = expected
+                return values
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _slots(self):
+        return self.values[_HEADER:].reshape(_SLOTS, _SLOT_SIZE)
+
+    def _claim(self):
+        """Take this process's slot: its own, a free one, or one whose owner exited"""
+        pid = os.getpid()
+        with open(self.path, 'rb') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)  # Claims from several processes are serialized
+            try:
+                slots = self._slots()
+                owners = [int(owner) for owner in slots[:, 0]]
+                if pid in owners:
+                    index = owners.index(pid)
+                else:
+                    free = [i for i, owner in enumerate(owners) if owner == 0 or not _alive(owner)]
+                    index = free[0] if free else None
+                    if index is not None:
+                        slots[index, 0] = pid
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+        self._pid = pid
+        if index is None:
+            print(f"All {_SLOTS} metrics slots are in use; this process's metrics are not exported")
+            self.slot = np.zeros(_SLOT_SIZE)
+        else:
+            self.slot = slots[index]
+
+    def _writable(self):
+        if self._pid != os.getpid():  # First update, or inherited across a fork
+            self._claim()
+        return self.slot
+
+    def inc(self, counter, amount=1):
+        """Increment a counter"""
+        with self._lock:
+            self._writable()[self._counter_index[counter]] += amount
+
+    def observe(self, stage, seconds):
+        """Record one stage duration in seconds"""
+        base = self._stage_index[stage]
+        with self._lock:
+            slot = self._writable()
+            slot[base + bisect.bisect_left(BUCKETS, seconds)] += 1
+            slot[base + len(BUCKETS) + 1] += seconds
+            slot[base + len(BUCKETS) + 2] += 1
+
+    def time(self, stage):
+        """Time a block: `with metrics.time('detect'): ...`"""
+        return _StageTimer(self, stage)
+
+    def reset(self):
+        """Zero all counters and histograms"""
+        self._slots()[:, 1:] = 0
+
+    def snapshot(self):
+        """Return counters and histograms summed over all writer processes"""
+        values = np.array(self._slots()).sum(axis=0)
+        counters = {name: int(values[i]) for name, i in self._counter_index.items()}
+        stages = {}
+        for name, base in self._stage_index.items():
+            stages[name] = {
+                'buckets': [int(v) for v in values[base:base + len(BUCKETS) + 1]],
+                'sum': float(values[base + len(BUCKETS) + 1]),
+                'count': int(values[base + len(BUCKETS) + 2]),
+            }
+        return {'counters': counters, 'stages': stages}
+
+    def render_prometheus(self):
+        """Render all metrics in Prometheus text exposition format"""
+        snapshot = self.snapshot()
+        lines = []
+
+        for name, value in snapshot['counters'].items():
+            lines.append(f"# TYPE {_PREFIX}_{name}_total counter")
+            lines.append(f"{_PREFIX}_{name}_total {value}")
+
+        metric = f"{_PREFIX}_stage_seconds"
+        lines.append(f"# HELP {metric} Time spent in each detection pipeline stage")
+        lines.append(f"# TYPE {metric} histogram")
+        for stage, hist in snapshot['stages'].items():
+            cumulative = 0
+            for bound, count in zip(BUCKETS + ('+Inf',), hist['buckets']):
+                cumulative += count
+                lines.append(f'{metric}_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+            lines.append(f'{metric}_sum{{stage="{stage}"}} {hist["sum"]:.6f}')
+            lines.append(f'{metric}_count{{stage="{stage}"}} {hist["count"]}')
+
+        return '\n'.join(lines) + '\n'
+
+
+class NullMetrics:
+    """Drop-in replacement for PipelineMetrics when metrics are disabled"""
+
+    class _NullTimer:
+        def __enter__(self):
+            return self
+
+        def __exit__(self, exc_type, exc, tb):
+            return False
+
+    _timer = _NullTimer()
+
+    def inc(self, counter, amount=1):
+        pass
+
+    def observe(self, stage, seconds):
+        pass
+
+    def time(self, stage):
+        return self._timer
+
+
+def create_metrics():
+    """Create the shared metrics recorder, or a no-op one if disabled or unavailable"""
+    if not Config.METRICS_ENABLED:
+        return NullMetrics()
+    try:
+        return PipelineMetrics()
+    except Exception as e:
+        print(f"Metrics disabled: {e}")
+        return NullMetrics()
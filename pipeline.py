@@ -0,0 +1,435 @@
+"""
+Multi-process capture / analysis / I/O pipeline.
+
+    capture process --(slot)--> analysis process --(slot, result)--> I/O process
+
+Frames travel through a ring of slots in one multiprocessing.shared_memory
+block; the queues only carry slot numbers, shapes and analysis dicts, so
+frames are never pickled. A slot returns to the free queue once the last
+stage that needs it is done.
+
+Backpressure: when no slot is free, the capture process either waits
+(PIPELINE_DROP_POLICY = 'block') or drops the new frame ('drop'). When more
+than PIPELINE_MAX_SAVE_BACKLOG frames wait for JPEG saving, further saves are
+skipped; analysis results and alerts are never dropped. A frame whose analysis
+raises is logged, counted as an error and its slot released, and the worker
+carries on. If a stage process dies, the others are killed rather than left
+blocked on its queues. Sustained throughput is bounded by the slowest stage rather than
+the sum of all stages.
+
+In 'lores' mode the ring carries the Y/U/V planes and frames are not archived.
+"""
+
+import logging
+import multiprocessing
+import queue
+import signal
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from config import Config
+from thermal_control import max_rate_divisor
+
+STAGES = ('capture', 'analysis', 'io')
+_FIELDS = ('frames', 'busy', 'dropped', 'latency', 'errors')  # Per-stage counters in the shared stats array
+
+logger = logging.getLogger(__name__)
+
+
+class SharedFrameRing:
+    """Fixed-size frame slots in one shared memory block"""
+
+    def __init__(self, slots, slot_bytes):
+        self.slots = slots
+        self.slot_bytes = slot_bytes
+        self.shm = shared_memory.SharedMemory(create=True, size=slots * slot_bytes)
+
+    def write(self, slot, arrays):
+        """Copy arrays into a slot back to back; returns their shapes, or None if too large"""
+        if sum(a.nbytes for a in arrays) > self.slot_bytes:
+            return None
+        offset = slot * self.slot_bytes
+        shapes = []
+        for array in arrays:
+            view = np.ndarray(array.shape, dtype=np.uint8, buffer=self.shm.buf, offset=offset)
+            np.copyto(view, array)
+            offset += array.nbytes
+            shapes.append(array.shape)
+        return shapes
+
+    def read(self, slot, shapes):
+        """Zero-copy views of the arrays stored in a slot"""
+        offset = slot * self.slot_bytes
+        arrays = []
+        for shape in shapes:
+            arrays.append(np.ndarray(shape, dtype=np.uint8, buffer=self.shm.buf, offset=offset))
+            offset += int(np.prod(shape))
+        return arrays
+
+    def close(self):
+        self.shm.close()
+        self.shm.unlink()
+
+
+class _StageStats:
+    """Per-stage counters shared between processes"""
+
+    def __init__(self, ctx):
+        self.values = ctx.Array('d', len(STAGES) * len(_FIELDS), lock=False)
+
+    def add(self, stage, field, amount=1):
+        self.values[STAGES.index(stage) * len(_FIELDS) + _FIELDS.index(field)] += amount
+
+    def snapshot(self):
+        values = list(self.values)
+        return {stage: dict(zip(_FIELDS, values[i * len(_FIELDS):(i + 1) * len(_FIELDS)]))
+                for i, stage in enumerate(STAGES)}
+
+
+def _ignore_signals():
+    """Workers leave shutdown to the parent, which drains the pipeline"""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+
+
+def _watch_config(on_change):
+    """Reload settings in a worker; Config changes in the parent do not reach it"""
+    from config_loader import start_watcher
+    return start_watcher(on_change)
+
+
+def _capture_worker(ring, free_slots, to_analysis, stop, stats, max_frames):
+    _ignore_signals()
+    from camera_manager import CameraManager
+    from health import HealthMonitor
+    from light_detector import DetectionParams
+    from metrics import create_metrics
+
+    config = Config()
+    metrics = create_metrics()
+    camera = CameraManager(metrics=metrics)
+    health = HealthMonitor(metrics)
+    watcher = _watch_config(lambda changed: camera.set_params(DetectionParams(config)))
+    thermal = None
+    if config.THERMAL_CONTROL_ENABLED:
+        from thermal_control import ThermalController
+        thermal = ThermalController()
+    lores = config.DETECTION_STREAM == 'lores'
+    captured = 0
+    try:
+        while not stop.is_set() and not (max_frames and captured >= max_frames):
+            cycle_start = time.monotonic()
+            quality = thermal.update() if thermal else None
+            if quality:
+                camera.set_quality(quality.capture_scale, quality.crop_scale)
+                health.rate_divisor = quality.rate_divisor
+            archive = thermal is None or thermal.quality.archive
+            image = camera.capture_yuv(save_image=False) if lores else camera.capture_image(save_image=False)
+            if image is None:
+                if camera.frame_source is not None:
+                    break  # Replay exhausted
+                stats.add('capture', 'dropped')
+                health.record_error()
+                health.recover(camera)
+            else:
+                health.record_frame(time.monotonic() - cycle_start)
+                arrays = image if lores else (image,)
+                if _enqueue(ring, free_slots, to_analysis, stop, config, arrays, archive, camera.detection_box):
+                    captured += 1
+                    stats.add('capture', 'frames')
+                else:
+                    stats.add('capture', 'dropped')
+            stats.add('capture', 'busy', time.monotonic() - cycle_start)
+
+            # Pace to the detection interval (0 = as fast as possible), divided by thermal control
+            elapsed = time.monotonic() - cycle_start
+            remaining = max(config.DETECTION_INTERVAL, elapsed) * health.rate_divisor - elapsed
+            if remaining > 0:
+                stop.wait(remaining)
+    finally:
+        to_analysis.put(None)
+        if watcher:
+            watcher.stop()
+        camera.close()
+
+
+def _enqueue(ring, free_slots, to_analysis, stop, config, arrays, archive=True, box=None):
+    """Copy a frame into a free slot and pass it on; False if it was dropped"""
+    slot = _next_slot(free_slots, stop, config.PIPELINE_DROP_POLICY)
+    if slot is None:
+        return False
+
+    shapes = ring.write(slot, [np.ascontiguousarray(a) for a in arrays])
+    if shapes is None:
+        logger.error(f"Frame {[a.shape for a in arrays]} does not fit a pipeline slot")
+        free_slots.put(slot)
+        return False
+
+    to_analysis.put((slot, shapes, time.time(), archive, box))
+    return True
+
+
+def _next_slot(free_slots, stop, policy):
+    """Take a free slot, waiting under the 'block' policy; None if the frame is dropped"""
+    if policy != 'block':
+        try:
+            return free_slots.get_nowait()
+        except queue.Empty:
+            return None
+
+    while not stop.is_set():
+        try:
+            return free_slots.get(timeout=0.5)
+        except queue.Empty:
+            continue
+    return None
+
+
+def _analysis_worker(ring, free_slots, from_capture, to_io, stats):
+    _ignore_signals()
+    from light_detector import DetectionParams, LightDetector
+    from metrics import create_metrics
+    from roi_stream import create_publisher
+
+    config = Config()
+    detector = LightDetector()
+    metrics = create_metrics()
+    roi_stream = create_publisher()
+    gate = None
+    if config.CHANGE_GATE_ENABLED:
+        from change_gate import ChangeGate
+        gate = ChangeGate()
+
+    def apply_config(changed):
+        params = DetectionParams(config)
+        if config.DETECTION_STREAM == 'lores':
+            params.yuv_lut  # Build the lookup table before the next frame needs it
+        detector.params = params
+        if gate:
+            gate.reset()
+        logger.info(f"Config reloaded: {', '.join(changed)}")
+
+    watcher = _watch_config(apply_config)
+
+    while True:
+        message = from_capture.get()
+        if message is None:
+            break
+        slot, shapes, timestamp, archive, box = message
+
+        start = time.monotonic()
+        arrays = ring.read(slot, shapes)
+        image = tuple(arrays) if config.DETECTION_STREAM == 'lores' else arrays[0]
+
+        try:
+            analysis = gate.check(image) if gate else None
+            if analysis is None:
+                with metrics.time('detect'):
+                    if config.DETECTION_STREAM == 'lores':
+                        analysis = detector.analyze_yuv420(*image, box=box)
+                    else:
+                        analysis = detector.analyze_image(image, box=box)
+                if gate:
+                    gate.store(analysis)
+            else:
+                metrics.inc('frames_unchanged')
+            analysis = dict(analysis, captured_at=timestamp)
+            if roi_stream:
+                roi_stream.publish(image, analysis)  # Copies the crop before the slot is released
+        except Exception as e:
+            logger.error(f"Error analyzing frame: {e}")
+            metrics.inc('errors')
+            stats.add('analysis', 'errors')
+            del arrays, image
+            free_slots.put(slot)
+            stats.add('analysis', 'busy', time.monotonic() - start)
+            continue
+
+        # Hand the frame to the I/O stage for saving unless it is backed up
+        save = archive and config.DETECTION_STREAM != 'lores' and not analysis.get('reused')
+        if save and to_io.qsize() >= config.PIPELINE_MAX_SAVE_BACKLOG:
+            save = False
+            stats.add('analysis', 'dropped')
+        del arrays, image
+        if not save:
+            free_slots.put(slot)
+        to_io.put((slot if save else None, shapes, analysis))
+
+        stats.add('analysis', 'frames')
+        stats.add('analysis', 'busy', time.monotonic() - start)
+
+    to_io.put(None)
+    if watcher:
+        watcher.stop()
+
+
+def _io_worker(ring, free_slots, from_analysis, stats):
+    _ignore_signals()
+    from alert_manager import AlertManager
+    from fleet_reporter import create_reporter
+    from image_store import ImageStore
+    from metrics import create_metrics
+
+    config = Config()
+    metrics = create_metrics()
+    alert_manager = AlertManager(metrics=metrics)
+    store = ImageStore(config, metrics=metrics)
+    meter = None
+    if config.PULSE_METER_ENABLED:
+        from pulse_meter import PulseMeter
+        meter = PulseMeter(metrics=metrics)
+    fleet = create_reporter()
+    watcher = _watch_config(lambda changed: None)  # Alert settings are read from Config as used
+
+    while True:
+        message = from_analysis.get()
+        if message is None:
+            break
+        slot, shapes, analysis = message
+
+        start = time.monotonic()
+        if slot is not None:
+            try:
+                with metrics.time('save'):
+                    store.save(ring.read(slot, shapes)[0])
+            except Exception as e:
+                logger.error(f"Error saving image: {e}")
+                metrics.inc('errors')
+            finally:
+                free_slots.put(slot)
+
+        metrics.inc('cycles')
+        if meter:
+            meter.update(analysis['captured_at'], analysis['detected'])
+        if analysis['detected']:
+            logger.warning("RED LIGHT DETECTED!", extra={'fields': {'event': 'alert'}})
+            metrics.inc('detections')
+            with metrics.time('alert'):
+                alert_manager.trigger_alert(analysis)
+        if fleet:
+            fleet.record(analysis['captured_at'], analysis,
+                         power=meter.detector.current_power() if meter else None)
+
+        stats.add('io', 'frames')
+        stats.add('io', 'busy', time.monotonic() - start)
+        stats.add('io', 'latency', time.time() - analysis['captured_at'])
+
+    if watcher:
+        watcher.stop()
+    store.close()
+    if meter:
+        meter.close()
+    if fleet:
+        fleet.stop()
+    alert_manager.cleanup()
+
+
+class DetectionPipeline:
+    """Runs capture, analysis and I/O in separate processes"""
+
+    def __init__(self, max_frames=None):
+        self.config = Config()
+        self.max_frames = max_frames
+        # fork keeps runtime Config overrides (e.g. --replay) in the workers
+        self.ctx = multiprocessing.get_context('fork')
+        width, height = self.config.CAMERA_RESOLUTION
+        self.ring = SharedFrameRing(self.config.PIPELINE_SLOTS, width * height * 3)
+        self.stats = _StageStats(self.ctx)
+        self.stop_event = self.ctx.Event()
+        self.free_slots = None
+        self.processes = []
+        self._last_frames = 0
+        self._last_progress = time.monotonic()
+
+    def start(self):
+        free_slots = self.free_slots = self.ctx.Queue()
+        for slot in range(self.ring.slots):
+            free_slots.put(slot)
+        to_analysis = self.ctx.Queue(self.ring.slots)
+        to_io = self.ctx.Queue(self.ring.slots)
+
+        self.processes = [
+            self.ctx.Process(target=_capture_worker, name='capture', daemon=True,
+                             args=(self.ring, free_slots, to_analysis, self.stop_event,
+                                   self.stats, self.max_frames)),
+            self.ctx.Process(target=_analysis_worker, name='analysis', daemon=True,
+                             args=(self.ring, free_slots, to_analysis, to_io, self.stats)),
+            self.ctx.Process(target=_io_worker, name='io', daemon=True,
+                             args=(self.ring, free_slots, to_io, self.stats)),
+        ]
+        self.started = time.monotonic()
+        for process in self.processes:
+            process.start()
+
+    def stop(self):
+        """Ask the capture stage to stop; queued frames still drain through"""
+        self.stop_event.set()
+
+    def wait(self, report_interval=None):
+        """
+        Wait for all stages to finish, logging throughput periodically
+        A stage that dies takes the others down with it, since its neighbours
+        would block on its queues forever. Returns True if every stage exited cleanly.
+        """
+        report_interval = report_interval or self.config.PIPELINE_REPORT_INTERVAL
+        last_report = time.monotonic()
+        try:
+            while any(p.is_alive() for p in self.processes):
+                self.processes[0].join(timeout=0.5)
+                failed = [p for p in self.processes if p.exitcode not in (None, 0)]
+                if failed:
+                    logger.error(f"Pipeline {failed[0].name} stage exited with code {failed[0].exitcode}, "
+                                 f"stopping the other stages")
+                    self.stop_event.set()
+                    for process in self.processes:
+                        if process.is_alive():
+                            process.kill()  # Workers ignore SIGTERM
+                    break
+                if time.monotonic() - last_report >= report_interval:
+                    logger.info(self.report())
+                    last_report = time.monotonic()
+        finally:
+            for process in self.processes:
+                process.join()
+            self.ring.close()
+        logger.info(self.report())
+        return all(p.exitcode == 0 for p in self.processes)
+
+    def healthy(self):
+        """True while every stage is running and captured frames keep arriving"""
+        frames = self.stats.snapshot()['capture']['frames']
+        now = time.monotonic()
+        if frames != self._last_frames:
+            self._last_frames = frames
+            self._last_progress = now
+        interval = self.config.DETECTION_INTERVAL * max_rate_divisor(self.config)  # Thermal control may slow capture
+        limit = max(self.config.HEALTH_MAX_FRAME_AGE, 2 * interval) + self.config.HEALTH_STALL_TIMEOUT
+        return all(p.is_alive() for p in self.processes) and now - self._last_progress <= limit
+
+    def throughput(self):
+        """Frames/s, utilization and drops per stage"""
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+        result = {}
+        for stage, values in self.stats.snapshot().items():
+            result[stage] = {
+                'frames': int(values['frames']),
+                'fps': values['frames'] / elapsed,
+                'utilization': values['busy'] / elapsed,
+                'dropped': int(values['dropped']),
+                'errors': int(values['errors']),
+            }
+        io = self.stats.snapshot()['io']
+        result['latency'] = io['latency'] / io['frames'] if io['frames'] else 0.0
+        return result
+
+    def report(self):
+        throughput = self.throughput()
+        parts = []
+        for stage in STAGES:
+            values = throughput[stage]
+            errors = f", {values['errors']} errors" if values['errors'] else ""
+            parts.append(f"{stage} {values['fps']:.1f} fps ({values['utilization']:.0%} busy, "
+                         f"{values['dropped']} dropped{errors})")
+        return f"Pipeline: {', '.join(parts)}; capture-to-alert latency {throughput['latency'] * 1000:.0f} ms"
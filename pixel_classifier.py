@@ -0,0 +1,344 @@
+#!/usr/bin/env python3
+"""
+Trainable pixel classifier, an alternative to the fixed HSV ranges.
+
+A logistic regression over quadratic RGB features decides per pixel whether
+it belongs to the lit LED. It is trained offline from labeled captures: in
+"on" images the LED pixels are positives (from a `<image>.mask.png` next to
+the image if present, otherwise the pixels the HSV ranges mark red, minus
+colors that the HSV ranges also mark red in "off" images); every pixel of an
+"off" image is a negative, and the red-looking ones (reflections, ambient
+red) are sampled preferentially as hard negatives. The image-level red ratio
+threshold is then chosen for the best F1 on the training images.
+
+At runtime the model is compiled into a 64x64x64 RGB lookup table (and the
+YUV table for the lores stream), so a frame costs one table lookup per pixel:
+about 1.2x the HSV conversion on RGB frames and the same as the HSV table on
+the lores stream (see benchmark.py). Select it with
+DETECTOR_BACKEND = 'classifier'; LightDetector is used unchanged.
+
+Usage:
+    python3 pixel_classifier.py train --on samples/on --off samples/off
+    python3 pixel_classifier.py evaluate --on samples/on --off samples/off
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from datetime import datetime
+
+import cv2
+import numpy as np
+
+from config import Config
+
+LUT_SHIFT = 2  # 64 levels per channel
+LUT_BITS = 8 - LUT_SHIFT
+FEATURES = ('bias', 'r', 'g', 'b', 'r*r', 'g*g', 'b*b', 'r*g', 'r*b', 'g*b')
+MASK_SUFFIX = '.mask.png'
+SEED_SHIFT = 3  # Color cells (32 per channel) for excluding "off" image reds from the seed
+
+
+def features(rgb):
+    """Quadratic feature matrix for (N, 3) RGB values"""
+    x = np.asarray(rgb, dtype=np.float64) / 255.0
+    r, g, b = x[:, 0], x[:, 1], x[:, 2]
+    return np.stack([np.ones_like(r), r, g, b, r * r, g * g, b * b, r * g, r * b, g * b], axis=1)
+
+
+def fit_logistic(x, y, sample_weight, l2=1e-3, iterations=30):
+    """Weighted L2-regularized logistic regression by Newton's method (IRLS)"""
+    w = np.zeros(x.shape[1])
+    penalty = l2 * np.eye(x.shape[1])
+    penalty[0, 0] = 0.0  # Leave the bias unregularized
+    for _ in range(iterations):
+        p = 1.0 / (1.0 + np.exp(-np.clip(x @ w, -30, 30)))
+        gradient = x.T @ (sample_weight * (p - y)) + penalty @ w
+        hessian = (x * (sample_weight * p * (1 - p))[:, None]).T @ x + penalty
+        step = np.linalg.solve(hessian + 1e-9 * np.eye(x.shape[1]), gradient)
+        w -= step
+        if np.abs(step).max() < 1e-6:
+            break
+    return w
+
+
+class PixelClassifier:
+    """Logistic pixel model compiled into RGB and YUV lookup tables"""
+
+    def __init__(self, weights, ratio_threshold, pixel_threshold=0.5, info=None):
+        self.weights = np.asarray(weights, dtype=np.float64)
+        self.ratio_threshold = float(ratio_threshold)
+        self.pixel_threshold = float(pixel_threshold)
+        self.info = info or {}
+        self._logit_threshold = np.log(self.pixel_threshold / (1 - self.pixel_threshold))
+        self.lut = self._build_lut()
+
+    def classify_rgb(self, rgb):
+        """Boolean LED decision for (N, 3) RGB values"""
+        return features(rgb) @ self.weights > self._logit_threshold
+
+    def _build_lut(self):
+        levels = 256 >> LUT_SHIFT
+        centers = np.arange(levels) * (1 << LUT_SHIFT) + (1 << LUT_SHIFT) // 2
+        r, g, b = np.meshgrid(centers, centers, centers, indexing='ij')
+        rgb = np.stack([r.ravel(), g.ravel(), b.ravel()], axis=1)
+        return np.where(self.classify_rgb(rgb), 255, 0).astype(np.uint8)  # Flat, indexed by packed (r, g, b)
+
+    def red_mask(self, image):
+        """Binary mask (0/255) of the LED pixels in an RGB image"""
+        shifted = image >> LUT_SHIFT
+        index = shifted[..., 0].astype(np.uint32) << (2 * LUT_BITS)
+        index |= shifted[..., 1].astype(np.uint32) << LUT_BITS
+        index |= shifted[..., 2]
+        return self.lut.take(index)
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            json.dump({
+                'features': FEATURES,
+                'weights': self.weights.tolist(),
+                'pixel_threshold': self.pixel_threshold,
+                'ratio_threshold': self.ratio_threshold,
+                'info': self.info,
+            }, f, indent=2)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'r') as f:
+            data = json.load(f)
+        if tuple(data.get('features', ())) != FEATURES:
+            raise ValueError(f"{path} was trained with different features")
+        return cls(data['weights'], data['ratio_threshold'], data['pixel_threshold'], data.get('info'))
+
+
+def load_samples(on_dirs, off_dirs, labels_csv):
+    """(path, label) pairs as for calibrate.py, without the mask files"""
+    from calibrate import load_labels
+    return [(path, label) for path, label in load_labels(on_dirs, off_dirs, labels_csv)
+            if not path.endswith(MASK_SUFFIX)]
+
+
+def read_image(path):
+    """(RGB image, LED mask or None) for a labeled capture"""
+    image = cv2.imread(path)
+    if image is None:
+        return None, None
+    mask = None
+    mask_path = os.path.splitext(path)[0] + MASK_SUFFIX
+    if os.path.exists(mask_path):
+        mask = cv2.imread(mask_path, cv2.IMREAD_GRAYSCALE)
+        if mask is not None and mask.shape != image.shape[:2]:
+            print(f"Ignoring {mask_path}: size differs from the image", file=sys.stderr)
+            mask = None
+    return cv2.cvtColor(image, cv2.COLOR_BGR2RGB), mask
+
+
+def _color_cells(pixels):
+    """Coarse color cell index of (N, 3) RGB values"""
+    shifted = (pixels >> SEED_SHIFT).astype(np.uint32)
+    bits = 8 - SEED_SHIFT
+    return (shifted[:, 0] << (2 * bits)) | (shifted[:, 1] << bits) | shifted[:, 2]
+
+
+def pixel_samples(image, label, mask, hsv_detector, off_colors, per_image, rng):
+    """
+    Sampled (rgb, target) pixels from one labeled image
+    off_colors flags the color cells found red in "off" images; without a
+    mask they are not taken as LED pixels.
+    """
+    pixels = image.reshape(-1, 3)
+    red = hsv_detector.red_mask(image).ravel() > 0
+    if label:
+        if mask is not None:
+            positive = mask.ravel() > 0
+        else:
+            positive = red & ~off_colors[_color_cells(pixels)]
+        groups = [(np.flatnonzero(positive), 1), (np.flatnonzero(~positive), 0)]
+    else:
+        # Red-looking pixels in an "off" image are exactly what the HSV ranges get wrong
+        groups = [(np.flatnonzero(red), 0), (np.flatnonzero(~red), 0)]
+
+    rgb, targets = [], []
+    for index, target in groups:
+        if len(index) > per_image:
+            index = rng.choice(index, per_image, replace=False)
+        rgb.append(pixels[index])
+        targets.append(np.full(len(index), target, dtype=np.float64))
+    return np.concatenate(rgb), np.concatenate(targets)
+
+
+def best_ratio_threshold(ratios, labels):
+    """Red ratio cut with the best F1, centered in the widest gap among equals"""
+    ratios = np.asarray(ratios, dtype=np.float64)
+    labels = np.asarray(labels, dtype=bool)
+    values = np.unique(np.concatenate([[0.0], ratios, [1.0]]))
+    best = None
+    for low, high in zip(values[:-1], values[1:]):
+        threshold = (low + high) / 2
+        detected = ratios > threshold
+        tp = np.sum(detected & labels)
+        f1 = 2 * tp / (np.sum(detected) + np.sum(labels)) if labels.any() else 0.0
+        key = (f1, high - low)
+        if best is None or key > best[0]:
+            best = (key, threshold)
+    return best[1]
+
+
+def train(images, per_image=2000, seed=0):
+    """
+    Train on a list of (RGB image, label, mask or None)
+    Returns a PixelClassifier with its ratio threshold fitted to the images.
+    """
+    from light_detector import LightDetector
+
+    labels = [label for _, label, _ in images]
+    if not any(labels) or all(labels):
+        raise ValueError("Need both 'on' and 'off' labeled images")
+
+    hsv_detector = LightDetector()
+    off_colors = np.zeros(1 << (3 * (8 - SEED_SHIFT)), dtype=bool)
+    for image, label, _ in images:
+        if not label:
+            pixels = image.reshape(-1, 3)
+            off_colors[_color_cells(pixels[hsv_detector.red_mask(image).ravel() > 0])] = True
+
+    rng = np.random.default_rng(seed)
+    rgb, targets = [], []
+    for image, label, mask in images:
+        pixels, target = pixel_samples(image, label, mask, hsv_detector, off_colors, per_image, rng)
+        rgb.append(pixels)
+        targets.append(target)
+    rgb, targets = np.concatenate(rgb), np.concatenate(targets)
+    if not targets.any():
+        raise ValueError("No LED pixels found in the 'on' images (add .mask.png files)")
+
+    # Balance the classes so the rare LED pixels count as much as the background
+    positives = targets.sum()
+    sample_weight = np.where(targets > 0, len(targets) / (2 * positives),
+                             len(targets) / (2 * (len(targets) - positives)))
+    weights = fit_logistic(features(rgb), targets, sample_weight)
+
+    model = PixelClassifier(weights, ratio_threshold=0.5)
+    ratios = [np.count_nonzero(model.red_mask(image)) / (image.shape[0] * image.shape[1])
+              for image, _, _ in images]
+    model.ratio_threshold = best_ratio_threshold(ratios, labels)
+    model.info = {
+        'trained': datetime.now().isoformat(timespec='seconds'),
+        'images': len(images),
+        'positive_images': int(sum(labels)),
+        'pixels': int(len(targets)),
+        'positive_pixels': int(positives),
+    }
+    return model
+
+
+def _median_ms(func, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - start) * 1000)
+    return float(np.median(samples))
+
+
+def evaluate(images, model, repeat=5):
+    """Image-level accuracy and per-frame detection cost of the HSV and classifier backends"""
+    from light_detector import DetectionParams, LightDetector
+
+    detector = LightDetector()
+    hsv_params = DetectionParams(detector.config)
+    hsv_params.classifier = None
+    hsv_params.threshold = detector.config.RED_LIGHT_THRESHOLD
+    classifier_params = DetectionParams(detector.config)
+    classifier_params.classifier = model
+    classifier_params.threshold = model.ratio_threshold
+
+    result = {}
+    for name, params in (('hsv', hsv_params), ('classifier', classifier_params)):
+        tp = fp = fn = tn = 0
+        times = []
+        for image, label, _ in images:
+            detected = detector.detect_red_light(image, params)[0]
+            tp += bool(detected and label)
+            fp += bool(detected and not label)
+            fn += bool(not detected and label)
+            tn += bool(not detected and not label)
+            times.append(_median_ms(lambda: detector.detect_red_light(image, params), repeat))
+        pixels = np.mean([image.shape[0] * image.shape[1] for image, _, _ in images])
+        result[name] = {
+            'accuracy': (tp + tn) / len(images),
+            'precision': tp / (tp + fp) if tp + fp else 1.0,
+            'recall': tp / (tp + fn) if tp + fn else 1.0,
+            'false_positives': fp,
+            'false_negatives': fn,
+            'frame_ms': float(np.median(times)),
+            'ns_per_pixel': float(np.median(times)) * 1e6 / pixels,
+        }
+    return result
+
+
+def print_evaluation(result, images):
+    print(f"\n{len(images)} images ({sum(label for _, label, _ in images)} on)")
+    print(f"{'backend':<11} {'accuracy':>8} {'precision':>9} {'recall':>7} {'FP':>4} {'FN':>4} "
+          f"{'ms/frame':>9} {'ns/pixel':>9}")
+    for name, r in result.items():
+        print(f"{name:<11} {r['accuracy']:>8.3f} {r['precision']:>9.3f} {r['recall']:>7.3f} "
+              f"{r['false_positives']:>4} {r['false_negatives']:>4} {r['frame_ms']:>9.3f} {r['ns_per_pixel']:>9.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Train or evaluate the LED pixel classifier")
+    parser.add_argument('command', choices=('train', 'evaluate'))
+    parser.add_argument('--on', nargs='+', help="directories of images with the LED on")
+    parser.add_argument('--off', nargs='+', help="directories of images with the LED off")
+    parser.add_argument('--labels', help="CSV file with 'path' and 'label' columns")
+    parser.add_argument('--model', default=Config.CLASSIFIER_MODEL_FILE, help="model file to write or read")
+    parser.add_argument('--holdout', type=float, default=0.25,
+                        help="share of images kept out of training for the evaluation")
+    parser.add_argument('--pixels-per-image', type=int, default=2000, help="pixels sampled per class and image")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    samples = load_samples(args.on, args.off, args.labels)
+    if not samples:
+        parser.error("no labeled images given (use --on/--off or --labels)")
+    images = []
+    for path, label in samples:
+        image, mask = read_image(path)
+        if image is None:
+            print(f"Skipping unreadable image: {path}", file=sys.stderr)
+            continue
+        images.append((image, label, mask))
+
+    if args.command == 'evaluate':
+        model = PixelClassifier.load(args.model)
+        print_evaluation(evaluate(images, model), images)
+        return
+
+    # Hold out a stratified share of the images for an honest evaluation
+    rng = np.random.default_rng(args.seed)
+    order = rng.permutation(len(images))
+    held = set()
+    for label in (0, 1):
+        members = [i for i in order if images[i][1] == label]
+        held.update(members[:int(len(members) * args.holdout)])
+    training = [images[i] for i in range(len(images)) if i not in held]
+    testing = [images[i] for i in sorted(held)]
+
+    start = time.monotonic()
+    model = train(training, args.pixels_per_image, args.seed)
+    model.info['training_seconds'] = round(time.monotonic() - start, 3)
+    model.save(args.model)
+    print(f"Trained on {model.info['pixels']:,} pixels from {len(training)} images in "
+          f"{model.info['training_seconds']:.2f}s; ratio threshold {model.ratio_threshold:.4f}")
+    print(f"Model written to {args.model} (set DETECTOR_BACKEND = 'classifier' to use it)")
+
+    print_evaluation(evaluate(testing or training, model), testing or training)
+    if not testing:
+        print("(too few images for a hold-out set; evaluated on the training images)")
+
+
+if __name__ == "__main__":
+    main()
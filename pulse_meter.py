@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+"""
+Pulse-to-power metering with multi-resolution rollups.
+
+Energy meters blink their LED once per 1/METER_IMPULSES_PER_KWH kWh. Each
+off->on transition is a pulse, timestamped halfway between the last dark
+frame and the first lit one (so the error is at most half a frame interval).
+The time between two pulses gives the average power over that interval:
+
+    W = 3.6e6 / (impulses_per_kWh * interval_seconds)
+
+Power samples are folded into 1 s / 1 min / 1 h / 1 day buckets holding
+min, max, sum and count, in memory first and then upserted into SQLite every
+ROLLUP_FLUSH_INTERVAL seconds. Each resolution keeps ROLLUP_RETENTION seconds
+of history, so a query over any range reads a few hundred precomputed rows
+instead of raw samples. Every sample is one pulse, so a bucket's energy is
+count / impulses_per_kWh kWh.
+
+Detection must run well above the pulse rate for this to work: use
+DETECTION_STREAM = 'lores' with a short DETECTION_INTERVAL.
+
+Usage:
+    python3 pulse_meter.py              # last hour of power readings
+    python3 pulse_meter.py --hours 24
+"""
+
+import argparse
+import os
+import sqlite3
+import time
+from datetime import datetime
+
+from config import Config
+
+RESOLUTIONS = (1, 60, 3600, 86400)  # Bucket widths in seconds
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS power_rollups (
+    resolution INTEGER NOT NULL,
+    bucket INTEGER NOT NULL,
+    min REAL NOT NULL,
+    max REAL NOT NULL,
+    sum REAL NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (resolution, bucket)
+) WITHOUT ROWID
+"""
+
+_UPSERT = """
+INSERT INTO power_rollups (resolution, bucket, min, max, sum, count) VALUES (?, ?, ?, ?, ?, ?)
+ON CONFLICT (resolution, bucket) DO UPDATE SET
+    min = MIN(min, excluded.min),
+    max = MAX(max, excluded.max),
+    sum = sum + excluded.sum,
+    count = count + excluded.count
+"""
+
+
+def pulse_power(interval, impulses_per_kwh):
+    """Average power in watts for one pulse interval in seconds"""
+    return 3.6e6 / (impulses_per_kwh * interval)
+
+
+class PulseDetector:
+    """Turns per-frame LED states into pulses and power readings"""
+
+    def __init__(self):
+        self.config = Config()
+        self.lit = False
+        self.last_dark = None  # Timestamp of the last frame with the LED off
+        self.last_pulse = None
+        self.power = None  # Watts over the last pulse interval
+        self.pulses = 0
+
+    def update(self, timestamp, detected):
+        """
+        Feed one frame's timestamp and LED state
+        Returns (pulse_time, watts) on a pulse with a known interval, else None.
+        """
+        if not detected:
+            self.lit = False
+            self.last_dark = timestamp
+            return None
+        if self.lit:
+            return None
+        self.lit = True
+
+        pulse_time = timestamp if self.last_dark is None else (self.last_dark + timestamp) / 2
+        previous = self.last_pulse
+        if previous is not None and pulse_time - previous < self.config.PULSE_MIN_INTERVAL:
+            return None  # Flicker within one blink, not a new pulse
+
+        self.last_pulse = pulse_time
+        self.pulses += 1
+        if previous is None:
+            return None  # First pulse only starts the interval
+        self.power = pulse_power(pulse_time - previous, self.config.METER_IMPULSES_PER_KWH)
+        return pulse_time, self.power
+
+    def current_power(self, now=None):
+        """
+        Latest power, decayed while no pulse arrives
+        The next pulse cannot come sooner than the time already waited, so the
+        load is at most what a pulse right now would report.
+        """
+        if self.power is None:
+            return None
+        now = time.time() if now is None else now
+        waited = now - self.last_pulse
+        if waited <= 0:
+            return self.power
+        return min(self.power, pulse_power(waited, self.config.METER_IMPULSES_PER_KWH))
+
+
+class RollupStore:
+    """Incremental min/max/mean/count buckets at each resolution in SQLite"""
+
+    def __init__(self, path=None, readonly=False):
+        self.config = Config()
+        self.path = path or self.config.ROLLUP_DB_FILE
+        if readonly:
+            self.conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, timeout=5)
+        else:
+            self.conn = sqlite3.connect(self.path, timeout=5, check_same_thread=False)
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute(_SCHEMA)
+            self.conn.commit()
+        self.conn.row_factory = sqlite3.Row
+        self._pending = {}  # (resolution, bucket) -> [min, max, sum, count]
+        self._last_flush = time.monotonic()
+        self._last_prune = 0.0
+
+    def add(self, timestamp, value):
+        """Fold one sample into the open bucket of every resolution"""
+        for resolution in RESOLUTIONS:
+            key = (resolution, int(timestamp // resolution) * resolution)
+            bucket = self._pending.get(key)
+            if bucket is None:
+                self._pending[key] = [value, value, value, 1]
+            else:
+                bucket[0] = min(bucket[0], value)
+                bucket[1] = max(bucket[1], value)
+                bucket[2] += value
+                bucket[3] += 1
+
+        if time.monotonic() - self._last_flush >= self.config.ROLLUP_FLUSH_INTERVAL:
+            self.flush()
+
+    def flush(self):
+        """Write pending buckets in one transaction and prune expired rows"""
+        self._last_flush = time.monotonic()
+        if self._pending:
+            rows = [key + tuple(values) for key, values in self._pending.items()]
+            with self.conn:
+                self.conn.executemany(_UPSERT, rows)
+            self._pending.clear()
+
+        if self._last_flush - self._last_prune >= 60:
+            self._last_prune = self._last_flush
+            self.prune()
+
+    def prune(self, now=None):
+        """Drop buckets older than each resolution's retention"""
+        now = time.time() if now is None else now
+        with self.conn:
+            for resolution, keep in zip(RESOLUTIONS, self.config.ROLLUP_RETENTION):
+                self.conn.execute("DELETE FROM power_rollups WHERE resolution = ? AND bucket < ?",
+                                  (resolution, now - keep))
+
+    def resolution_for(self, start, end, max_points):
+        """Finest resolution that covers the range in at most max_points buckets"""
+        now = time.time()
+        for resolution, keep in zip(RESOLUTIONS, self.config.ROLLUP_RETENTION):
+            if (end - start) / resolution <= max_points and start >= now - keep:
+                return resolution
+        return RESOLUTIONS[-1]
+
+    def query(self, start, end, max_points=500, resolution=None):
+        """Buckets between start and end (epoch seconds), oldest first"""
+        resolution = resolution or self.resolution_for(start, end, max_points)
+        rows = self.conn.execute(
+            "SELECT bucket, min, max, sum, count FROM power_rollups "
+            "WHERE resolution = ? AND bucket >= ? AND bucket < ? ORDER BY bucket",
+            (resolution, int(start // resolution) * resolution, end))
+        kwh_per_pulse = 1.0 / self.config.METER_IMPULSES_PER_KWH
+        return resolution, [{
+            'time': row['bucket'],
+            'min': row['min'],
+            'max': row['max'],
+            'mean': row['sum'] / row['count'],
+            'count': row['count'],
+            'energy_wh': row['count'] * kwh_per_pulse * 1000,
+        } for row in rows]
+
+    def close(self):
+        if self._pending:
+            self.flush()
+        self.conn.close()
+
+
+class PulseMeter:
+    """PulseDetector feeding a RollupStore"""
+
+    def __init__(self, metrics=None):
+        self.detector = PulseDetector()
+        self.store = RollupStore()
+        self.metrics = metrics
+
+    def update(self, timestamp, detected):
+        reading = self.detector.update(timestamp, detected)
+        if reading is not None:
+            self.store.add(*reading)
+            if self.metrics:
+                self.metrics.inc('pulses')
+        return reading
+
+    def close(self):
+        self.store.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Show metered power from the rollup store")
+    parser.add_argument('--hours', type=float, default=1.0, help="how far back to show")
+    parser.add_argument('--points', type=int, default=60, help="maximum number of rows")
+    args = parser.parse_args()
+
+    if not os.path.exists(Config.ROLLUP_DB_FILE):
+        print(f"No power data yet ({Config.ROLLUP_DB_FILE} does not exist)")
+        return
+
+    store = RollupStore(readonly=True)
+    end = time.time()
+    resolution, rows = store.query(end - args.hours * 3600, end, args.points)
+    print(f"{len(rows)} buckets of {resolution}s")
+    for row in rows:
+        print(f"{datetime.fromtimestamp(row['time']):%Y-%m-%d %H:%M:%S}  mean {row['mean']:8.1f} W  "
+              f"min {row['min']:8.1f} W  max {row['max']:8.1f} W  {row['energy_wh']:8.2f} Wh")
+    store.close()
+
+
+if __name__ == "__main__":
+    main()
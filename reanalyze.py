@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+"""
+Bulk re-analysis of archived captures.
+
+Walks a directory of images (IMAGE_DIR by default) and/or raw .ldraw
+recordings, runs LightDetector.analyze_image on every frame in a process pool
+and streams the results to CSV or JSONL with progress and throughput reports.
+
+Usage:
+    python3 reanalyze.py                                  # IMAGE_DIR -> stdout CSV
+    python3 reanalyze.py /path/to/archive -o results.jsonl
+    python3 reanalyze.py archive/ -o out.csv --threshold 0.2 --reduce 4
+"""
+
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+
+from config import Config
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+JPEG_EXTENSIONS = ('.jpg', '.jpeg')
+
+# libjpeg can decode directly at 1/2, 1/4 or 1/8 scale via DCT scaling
+REDUCED_DECODE_FLAGS = {
+    1: cv2.IMREAD_COLOR,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+}
+
+FIELDS = ['path', 'frame', 'detected', 'confidence', 'red_pixels', 'total_pixels',
+          'red_ratio', 'brightness', 'width', 'height', 'decode_ms', 'analyze_ms',
+          'early_exit', 'full_detected', 'error']
+
+# Per-worker state, created once by _init_worker
+_detector = None
+_reduce = 1
+_verify_early_exit = False
+_readers = {}
+
+
+def find_tasks(paths):
+    """Yield (path, frame_index) for every image and recorded frame under paths"""
+    for root_path in paths:
+        if os.path.isfile(root_path):
+            candidates = [root_path]
+        else:
+            candidates = []
+            for directory, _, files in os.walk(root_path):
+                candidates.extend(os.path.join(directory, f) for f in files)
+            candidates.sort()
+
+        for path in candidates:
+            lower = path.lower()
+            if lower.endswith(IMAGE_EXTENSIONS):
+                yield path, None
+            elif lower.endswith('.ldraw'):
+                from frame_recorder import FrameReader
+                reader = FrameReader(path)
+                count = len(reader)
+                reader.close()
+                for index in range(count):
+                    yield path, index
+
+
+def _init_worker(overrides, reduce):
+    """Create one detector per worker process"""
+    global _detector, _reduce, _verify_early_exit
+    # One OpenCV thread per process so workers scale across cores without contention
+    cv2.setNumThreads(1)
+    for name, value in overrides.items():
+        setattr(Config, name, value)
+
+    from light_detector import LightDetector
+    _detector = LightDetector()
+    _reduce = reduce
+    _verify_early_exit = Config.EARLY_EXIT_ENABLED
+
+
+def _load(path, index):
+    """Decode an image (reduced where possible) or read a recorded frame, as RGB"""
+    if index is not None:
+        from frame_recorder import FrameReader
+        if path not in _readers:
+            _readers[path] = FrameReader(path)
+        return _readers[path].frame(index)
+
+    flags = REDUCED_DECODE_FLAGS[_reduce] if path.lower().endswith(JPEG_EXTENSIONS) else cv2.IMREAD_COLOR
+    image = cv2.imread(path, flags)
+    if image is None:
+        raise ValueError("could not decode image")
+    return cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+
+
+def analyze_task(task):
+    """Analyze one frame; runs inside a worker process"""
+    path, index = task
+    row = {'path': path, 'frame': index}
+    try:
+        start = time.perf_counter()
+        image = _load(path, index)
+        decoded = time.perf_counter()
+        analysis = _detector.analyze_image(image)
+        done = time.perf_counter()
+
+        row.update({
+            'detected': bool(analysis['detected']),
+            'confidence': float(analysis['confidence']),
+            'red_pixels': int(analysis['red_pixels']),
+            'total_pixels': int(analysis['total_pixels']),
+            'red_ratio': float(analysis['red_ratio']),
+            'brightness': float(analysis['brightness']),
+            'width': image.shape[1],
+            'height': image.shape[0],
+            'decode_ms': (decoded - start) * 1000.0,
+            'analyze_ms': (done - decoded) * 1000.0,
+            'early_exit': bool(analysis['early_exit']),
+        })
+        if _verify_early_exit:
+            # Check the early-exit decision against the full path
+            row['full_detected'] = bool(_detector.detect_red_light(image)[0])
+    except Exception as e:
+        row['error'] = str(e)
+    return row
+
+
+class ResultWriter:
+    """Stream result rows as CSV or JSONL"""
+
+    def __init__(self, stream, fmt):
+        self.stream = stream
+        self.fmt = fmt
+        if fmt == 'csv':
+            self.writer = csv.DictWriter(stream, fieldnames=FIELDS, extrasaction='ignore')
+            self.writer.writeheader()
+
+    def write(self, row):
+        if self.fmt == 'csv':
+            self.writer.writerow(row)
+        else:
+            self.stream.write(json.dumps(row) + '\n')
+
+
+def run(paths, output=None, fmt=None, workers=None, reduce=1, overrides=None, chunksize=16):
+    """Analyze every frame under paths; returns a summary dict"""
+    tasks = list(find_tasks(paths))
+    workers = workers or os.cpu_count() or 1
+    fmt = fmt or ('jsonl' if output and output.endswith(('.jsonl', '.json')) else 'csv')
+
+    stream = open(output, 'w', newline='') if output else sys.stdout
+    writer = ResultWriter(stream, fmt)
+
+    print(f"Analyzing {len(tasks)} frames with {workers} workers (decode scale 1/{reduce})",
+          file=sys.stderr)
+
+    start = time.monotonic()
+    last_report = start
+    processed = detected = errors = early_exits = mismatches = 0
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(overrides or {}, reduce)) as pool:
+            for row in pool.map(analyze_task, tasks, chunksize=chunksize):
+                writer.write(row)
+                processed += 1
+                detected += 1 if row.get('detected') else 0
+                errors += 1 if row.get('error') else 0
+                early_exits += 1 if row.get('early_exit') else 0
+                if 'full_detected' in row and row['full_detected'] != row['detected']:
+                    mismatches += 1
+
+                now = time.monotonic()
+                if now - last_report >= 1.0:
+                    rate = processed / (now - start)
+                    eta = (len(tasks) - processed) / rate if rate > 0 else 0
+                    print(f"  {processed}/{len(tasks)} frames, {rate:.1f} frames/s, ETA {eta:.0f}s",
+                          file=sys.stderr)
+                    last_report = now
+    finally:
+        if output:
+            stream.close()
+
+    elapsed = time.monotonic() - start
+    summary = {
+        'frames': processed,
+        'detected': detected,
+        'errors': errors,
+        'workers': workers,
+        'elapsed': elapsed,
+        'frames_per_sec': processed / elapsed if elapsed > 0 else 0.0,
+    }
+    print(f"Done: {processed} frames in {elapsed:.1f}s ({summary['frames_per_sec']:.1f} frames/s), "
+          f"{detected} detected, {errors} errors", file=sys.stderr)
+
+    if (overrides or {}).get('EARLY_EXIT_ENABLED'):
+        summary['early_exits'] = early_exits
+        summary['early_exit_mismatches'] = mismatches
+        fraction = early_exits / processed if processed else 0.0
+        print(f"Early exit: {early_exits}/{processed} frames ({fraction:.1%}) decided from "
+              f"the candidate box, {mismatches} decisions differ from the full path", file=sys.stderr)
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Re-run light detection over archived captures")
+    parser.add_argument('paths', nargs='*', help="image directories, files or .ldraw recordings "
+                                                 "(default: IMAGE_DIR)")
+    parser.add_argument('-o', '--output', help="output file (.csv or .jsonl); default CSV to stdout")
+    parser.add_argument('--format', choices=['csv', 'jsonl'], help="output format")
+    parser.add_argument('-j', '--workers', type=int, help="worker processes (default: CPU count)")
+    parser.add_argument('--reduce', type=int, choices=sorted(REDUCED_DECODE_FLAGS), default=1,
+                        help="decode JPEGs at 1/N resolution")
+    parser.add_argument('--threshold', type=float, help="override RED_LIGHT_THRESHOLD")
+    parser.add_argument('--hue-max', type=int, help="override RED_HUE_MAX")
+    parser.add_argument('--saturation-min', type=int, help="override RED_SATURATION_MIN")
+    parser.add_argument('--value-min', type=int, help="override RED_VALUE_MIN")
+    parser.add_argument('--early-exit', action='store_true',
+                        help="use early-exit detection and report early exits against the full path")
+    args = parser.parse_args()
+
+    overrides = {'EARLY_EXIT_ENABLED': True} if args.early_exit else {}
+    for name, value in (('RED_LIGHT_THRESHOLD', args.threshold), ('RED_HUE_MAX', args.hue_max),
+                        ('RED_SATURATION_MIN', args.saturation_min), ('RED_VALUE_MIN', args.value_min)):
+        if value is not None:
+            overrides[name] = value
+
+    run(args.paths or [Config.IMAGE_DIR], output=args.output, fmt=args.format,
+        workers=args.workers, reduce=args.reduce, overrides=overrides)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+"""
+ROI-only live stream.
+
+The detector already crops every frame to the detection region (CROP_* or
+the tracked LED ROI). It copies that crop, with the detection result, into a
+small memory-mapped file on tmpfs at up to ROI_STREAM_FPS, and only while
+someone is watching. The file holds only its header until the first viewer
+connects and then grows to the crop size (never shrinking, as readers may
+have it mapped). The web interface (/stream/roi) and
+`stream_camera.py roi` read the newest crop from there, scale it by
+ROI_STREAM_SCALE, draw the detection overlay and serve it as MJPEG. The
+camera is never opened a second time, so no separate rpicam-vid runs, and
+a crop of a few thousand pixels encodes to a few kB instead of a
+1280x720 frame.
+
+A frame is encoded once per new crop however many viewers are connected.
+The stream can be no faster than the detection loop (DETECTION_INTERVAL).
+
+Usage:
+    python3 roi_stream.py capture.jpg    # compare full-frame and ROI stream cost
+"""
+
+import os
+import sys
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from config import Config
+
+_MAGIC = 0x4C445231  # 'LDR1'
+# Header slots (float64): magic, sequence, frame time, height, width,
+# detected, confidence, last viewed
+_MAGIC_SLOT, _SEQ, _TIME, _HEIGHT, _WIDTH, _DETECTED, _CONFIDENCE, _VIEWED = range(8)
+_HEADER_BYTES = 16 * 8
+_IDLE_TIMEOUT = 5.0  # Stop publishing this many seconds after the last viewer poll
+
+
+def yuv420_to_rgb(y, u, v, full_range=True):
+    """RGB image from Y, U, V planes (chroma upsampled to luma size)"""
+    height, width = y.shape
+    u = cv2.resize(u, (width, height), interpolation=cv2.INTER_NEAREST)
+    v = cv2.resize(v, (width, height), interpolation=cv2.INTER_NEAREST)
+    if not full_range:
+        # Expand limited (16-235/240) range to the full range YCrCb expects
+        y = np.clip((y.astype(np.float32) - 16) * (255 / 219), 0, 255).astype(np.uint8)
+        u = np.clip((u.astype(np.float32) - 128) * (255 / 224) + 128, 0, 255).astype(np.uint8)
+        v = np.clip((v.astype(np.float32) - 128) * (255 / 224) + 128, 0, 255).astype(np.uint8)
+    return cv2.cvtColor(cv2.merge((y, v, u)), cv2.COLOR_YCrCb2RGB)
+
+
+def _open_buffer(path, size):
+    """Map the stream file (at least size bytes), creating it if missing or of another layout"""
+    if os.path.exists(path) and os.path.getsize(path) >= size:
+        buffer = np.memmap(path, dtype=np.uint8, mode='r+', shape=(os.path.getsize(path),))
+        if buffer[:_HEADER_BYTES].view(np.float64)[_MAGIC_SLOT] == _MAGIC:
+            return buffer
+
+    buffer = np.memmap(path, dtype=np.uint8, mode='w+', shape=(size,))
+    buffer[:_HEADER_BYTES].view(np.float64)[_MAGIC_SLOT] = _MAGIC
+    return buffer
+
+
+class RoiStreamPublisher:
+    """Detector side: shares the latest detection-region crop"""
+
+    def __init__(self, config=None):
+        self.config = config or Config()
+        width, height = self.config.CAMERA_RESOLUTION
+        self.max_bytes = width * height * 3  # Largest crop shared
+        self._map(_open_buffer(self.config.ROI_STREAM_FILE, _HEADER_BYTES))
+        self.last_publish = 0.0
+        self.published = 0
+
+    def _map(self, buffer):
+        self.buffer = buffer
+        self.header = buffer[:_HEADER_BYTES].view(np.float64)
+        self.capacity = len(buffer) - _HEADER_BYTES
+
+    def _grow(self, nbytes):
+        """Extend the file in place so readers' existing mappings stay valid"""
+        size = _HEADER_BYTES + nbytes
+        with open(self.config.ROI_STREAM_FILE, 'r+b') as f:
+            f.truncate(size)
+        self._map(np.memmap(self.config.ROI_STREAM_FILE, dtype=np.uint8, mode='r+', shape=(size,)))
+
+    def publish(self, image, analysis):
+        """
+        Share an RGB crop (or lores Y, U, V planes) if a viewer is connected
+        and the stream rate allows; returns True if the frame was published.
+        """
+        now = time.time()
+        if now - self.header[_VIEWED] > _IDLE_TIMEOUT or \
+                now - self.last_publish < 1.0 / self.config.ROI_STREAM_FPS:
+            return False
+        try:
+            if isinstance(image, tuple):
+                image = yuv420_to_rgb(*image, full_range=self.config.LORES_FULL_RANGE)
+            if image.nbytes > self.max_bytes:
+                return False
+            if image.nbytes > self.capacity:
+                self._grow(image.nbytes)
+
+            # Odd sequence numbers mark a write in progress
+            seq = self.header[_SEQ]
+            self.header[_SEQ] = seq + 1
+            self.buffer[_HEADER_BYTES:_HEADER_BYTES + image.nbytes] = image.reshape(-1)
+            self.header[_TIME] = now
+            self.header[_HEIGHT], self.header[_WIDTH] = image.shape[:2]
+            self.header[_DETECTED] = bool(analysis['detected'])
+            self.header[_CONFIDENCE] = analysis['confidence']
+            self.header[_SEQ] = seq + 2
+        except Exception as e:
+            print(f"Error publishing ROI stream frame: {e}")
+            return False
+
+        self.last_publish = now
+        self.published += 1
+        return True
+
+
+def create_publisher():
+    """ROI stream publisher, or None if disabled or the stream file cannot be created"""
+    if not Config.ROI_STREAM_ENABLED:
+        return None
+    try:
+        return RoiStreamPublisher()
+    except Exception as e:
+        print(f"ROI stream disabled: {e}")
+        return None
+
+
+def render_jpeg(image, detected, confidence, scale, quality):
+    """Scale an RGB crop, draw the detection overlay and encode it as JPEG"""
+    height, width = image.shape[:2]
+    size = (max(1, int(round(width * scale))), max(1, int(round(height * scale))))
+    interpolation = cv2.INTER_NEAREST if scale >= 1 else cv2.INTER_AREA  # Keep the LED edges sharp
+    frame = cv2.cvtColor(cv2.resize(image, size, interpolation=interpolation), cv2.COLOR_RGB2BGR)
+
+    color = (0, 0, 255) if detected else (160, 160, 160)
+    cv2.rectangle(frame, (0, 0), (size[0] - 1, size[1] - 1), color, 2)
+    label = f"{'ON' if detected else 'off'} {confidence:.2f}"
+    font_scale = max(0.3, min(size) / 250)
+    cv2.putText(frame, label, (4, 4 + int(22 * font_scale)), cv2.FONT_HERSHEY_SIMPLEX, font_scale,
+                color, 1, cv2.LINE_AA)
+
+    ok, jpeg = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, int(quality)])
+    return jpeg.tobytes() if ok else None
+
+
+class RoiStreamReader:
+    """Viewer side: newest crop from the detector, encoded once per frame"""
+
+    def __init__(self, path=None):
+        self.path = path or Config.ROI_STREAM_FILE
+        self.buffer = None
+        self.header = None
+        self._lock = threading.Lock()  # Viewers share one encoded frame
+        self._cached_key = None
+        self._cached_jpeg = None
+
+    def _attach(self):
+        """Map the stream file; re-map if the detector recreated it"""
+        try:
+            size = os.path.getsize(self.path)
+        except OSError:
+            self.buffer = self.header = None
+            return False
+        if self.buffer is None or len(self.buffer) != size:
+            self.buffer = np.memmap(self.path, dtype=np.uint8, mode='r+', shape=(size,))
+            self.header = self.buffer[:_HEADER_BYTES].view(np.float64)
+        return self.header[_MAGIC_SLOT] == _MAGIC
+
+    def latest(self):
+        """(key, RGB copy, detected, confidence, frame time) of the newest crop, or None"""
+        if not self._attach():
+            return None
+        self.header[_VIEWED] = time.time()  # Keeps the detector publishing
+
+        for _ in range(3):
+            seq = self.header[_SEQ]
+            if seq == 0 or seq % 2:
+                time.sleep(0.001)
+                continue
+            height, width = int(self.header[_HEIGHT]), int(self.header[_WIDTH])
+            image = np.array(self.buffer[_HEADER_BYTES:_HEADER_BYTES + height * width * 3]).reshape(
+                height, width, 3)
+            frame_time = self.header[_TIME]
+            detected, confidence = bool(self.header[_DETECTED]), float(self.header[_CONFIDENCE])
+            if self.header[_SEQ] == seq:
+                return (seq, frame_time), image, detected, confidence, frame_time
+        return None
+
+    def jpeg(self, scale=None, quality=None):
+        """(key, JPEG bytes) of the newest crop with overlay, or None before the first frame"""
+        scale = scale or Config.ROI_STREAM_SCALE
+        quality = quality or Config.ROI_STREAM_QUALITY
+        with self._lock:
+            frame = self.latest()
+            if frame is None:
+                return None
+            key, image, detected, confidence, _ = frame
+            if self._cached_key != (key, scale, quality):
+                self._cached_jpeg = render_jpeg(image, detected, confidence, scale, quality)
+                self._cached_key = (key, scale, quality)
+            return key, self._cached_jpeg
+
+
+def mjpeg_frames(reader, fps=None, scale=None, quality=None):
+    """multipart/x-mixed-replace chunks (boundary 'frame'), one per new crop"""
+    interval = 1.0 / (fps or Config.ROI_STREAM_FPS)
+    last_key = None
+    while True:
+        start = time.monotonic()
+        frame = reader.jpeg(scale, quality)
+        if frame is not None and frame[0] != last_key and frame[1] is not None:
+            last_key, jpeg = frame
+            yield (b'--frame\r\nContent-Type: image/jpeg\r\nContent-Length: ' +
+                   str(len(jpeg)).encode() + b'\r\n\r\n' + jpeg + b'\r\n')
+        time.sleep(max(0.0, interval - (time.monotonic() - start)))
+
+
+def compare(path):
+    """Print per-frame size and encode time of the full-frame and ROI streams"""
+    from light_detector import DetectionParams
+
+    config = Config()
+    image_bgr = cv2.imread(path)
+    if image_bgr is None:
+        print(f"Could not read {path}")
+        return
+    image_rgb = cv2.cvtColor(image_bgr, cv2.COLOR_BGR2RGB)
+    left, top, right, bottom = DetectionParams(config).crop_box(*image_rgb.shape[:2])
+    crop = image_rgb[top:bottom, left:right]
+
+    def measure(encode):
+        start = time.perf_counter()
+        for _ in range(20):
+            data = encode()
+        return len(data), (time.perf_counter() - start) / 20
+
+    full_size, full_time = measure(lambda: cv2.imencode('.jpg', image_bgr)[1].tobytes())
+    roi_size, roi_time = measure(lambda: render_jpeg(crop, False, 0.0, config.ROI_STREAM_SCALE,
+                                                     config.ROI_STREAM_QUALITY))
+    full_rate, roi_rate = 30, config.ROI_STREAM_FPS
+    print(f"Full frame {image_rgb.shape[1]}x{image_rgb.shape[0]} @ {full_rate} fps: "
+          f"{full_size / 1024:.1f} kB/frame, {full_size * full_rate * 8 / 1e6:.2f} Mbit/s, "
+          f"encode {full_time * 1000:.1f} ms ({full_time * full_rate:.0%} of a core)")
+    print(f"ROI {crop.shape[1]}x{crop.shape[0]} x{config.ROI_STREAM_SCALE:g} @ {roi_rate:g} fps: "
+          f"{roi_size / 1024:.1f} kB/frame, {roi_size * roi_rate * 8 / 1e6:.3f} Mbit/s, "
+          f"encode {roi_time * 1000:.2f} ms ({roi_time * roi_rate:.1%} of a core)")
+    print(f"Bandwidth reduced {full_size * full_rate / (roi_size * roi_rate):.0f}x")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print("Usage: python3 roi_stream.py <image>")
+        sys.exit(1)
+    compare(sys.argv[1])
@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+"""
+LED blob discovery and ROI tracking.
+
+A full-frame scan labels the red mask with connected components and proposes
+a tight, square ROI around the largest blob. While running, each frame's
+mask (covering only the ROI) gives the blob centroid and size, and the ROI
+is shifted and resized to follow it, so camera drift corrects itself and
+the detector only processes pixels around the LED.
+
+ROIs are stored as fractions of the frame (left, top, right, bottom) like
+the CROP_* settings, so the same ROI applies to the main and lores streams.
+
+Usage:
+    python3 roi_tracker.py capture.jpg     # propose CROP_*/CAMERA_ROI values
+"""
+
+import sys
+import time
+
+import cv2
+
+from config import Config
+
+
+class RoiTracker:
+    def __init__(self):
+        self.config = Config()
+        self.roi = None  # (left, top, right, bottom) fractions, None until an LED is found
+        self.last_scan = None
+        self.scans = 0
+        self.misses = 0  # Consecutive frames without a blob in the ROI
+
+    def needs_scan(self):
+        """True when a full-frame scan is due"""
+        return self.last_scan is None or \
+            time.monotonic() - self.last_scan >= self.config.ROI_RESCAN_INTERVAL
+
+    def find_candidates(self, mask):
+        """LED candidates in a full-frame red mask, largest first"""
+        count, _, stats, centroids = cv2.connectedComponentsWithStats(mask, connectivity=8)
+        candidates = []
+        for label in range(1, count):  # Label 0 is the background
+            x, y, w, h, area = stats[label]
+            if area >= self.config.ROI_MIN_BLOB_AREA:
+                candidates.append({
+                    'area': int(area),
+                    'centroid': (float(centroids[label][0]), float(centroids[label][1])),
+                    'bbox': (int(x), int(y), int(w), int(h)),
+                })
+        candidates.sort(key=lambda c: c['area'], reverse=True)
+        return candidates
+
+    def discover(self, mask):
+        """
+        Full-frame scan for the LED
+        Keeps the current ROI while a candidate is inside it (or the LED is off);
+        otherwise moves to the largest candidate. Returns the ROI (or None).
+        """
+        self.last_scan = time.monotonic()
+        self.scans += 1
+
+        candidates = self.find_candidates(mask)
+        if not candidates:
+            return self.roi
+
+        height, width = mask.shape[:2]
+        if self.roi is not None:
+            left, top, right, bottom = self.roi
+            for candidate in candidates:
+                cx, cy = candidate['centroid']
+                if left <= cx / width <= right and top <= cy / height <= bottom:
+                    return self.roi
+
+        blob = candidates[0]
+        cx, cy = blob['centroid']
+        self.roi = self._square(cx, cy, max(blob['bbox'][2:]) * self.config.ROI_BLOB_SCALE,
+                                width, height)
+        self.misses = 0
+        return self.roi
+
+    def update(self, mask):
+        """Follow the LED using the red mask of the current ROI crop"""
+        if self.roi is None or mask.size == 0:
+            return self.roi
+
+        moments = cv2.moments(mask, binaryImage=True)
+        if moments['m00'] < self.config.ROI_MIN_BLOB_AREA:
+            self.misses += 1  # LED off or lost; a later scan finds it again
+            return self.roi
+        self.misses = 0
+
+        # Crop pixels -> full-frame pixels at the mask's resolution
+        height, width = mask.shape[:2]
+        left, top, right, bottom = self.roi
+        frame_width = width / (right - left)
+        frame_height = height / (bottom - top)
+        cx = left * frame_width + moments['m10'] / moments['m00']
+        cy = top * frame_height + moments['m01'] / moments['m00']
+
+        old_side = max(width, height)
+        x, y, w, h = cv2.boundingRect(mask)
+        edge = max(cv2.countNonZero(mask[0]), cv2.countNonZero(mask[-1]),
+                   cv2.countNonZero(mask[:, 0]), cv2.countNonZero(mask[:, -1]))
+        if edge > old_side / 2:
+            # Blob is cut off by the ROI edge: widen so the next frame sees all of it
+            side = old_side * 1.5
+        else:
+            # Re-center on the centroid at once; smooth the size, which is noisier
+            side = old_side + self.config.ROI_SMOOTHING * (
+                max(w, h) * self.config.ROI_BLOB_SCALE - old_side)
+        self.roi = self._square(cx, cy, side, frame_width, frame_height)
+        return self.roi
+
+    def _square(self, cx, cy, side, frame_width, frame_height):
+        """Square box centered on (cx, cy) in pixels, as clamped frame fractions"""
+        side = max(side, self.config.ROI_MIN_SIZE * frame_width)
+        left = min(max(cx - side / 2, 0), max(frame_width - side, 0))
+        top = min(max(cy - side / 2, 0), max(frame_height - side, 0))
+        return (left / frame_width, top / frame_height,
+                min(left + side, frame_width) / frame_width,
+                min(top + side, frame_height) / frame_height)
+
+    def stats(self):
+        """Tracking state for logs and status output"""
+        area = (self.roi[2] - self.roi[0]) * (self.roi[3] - self.roi[1]) if self.roi else None
+        return {'roi': self.roi, 'frame_fraction': area, 'scans': self.scans, 'misses': self.misses}
+
+
+def main():
+    if len(sys.argv) != 2:
+        print("Usage: python3 roi_tracker.py <image>")
+        sys.exit(1)
+
+    image = cv2.imread(sys.argv[1])
+    if image is None:
+        print(f"Could not read image: {sys.argv[1]}")
+        sys.exit(1)
+
+    from light_detector import LightDetector
+
+    image_rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+    tracker = RoiTracker()
+    mask = LightDetector().red_mask(image_rgb)
+    candidates = tracker.find_candidates(mask)
+    if not candidates:
+        print("No LED candidates found (is the LED on?)")
+        sys.exit(1)
+
+    height, width = mask.shape
+    print(f"{len(candidates)} LED candidate(s):")
+    for candidate in candidates[:10]:
+        x, y, w, h = candidate['bbox']
+        print(f"  area {candidate['area']:>6} px at ({candidate['centroid'][0]:.0f}, "
+              f"{candidate['centroid'][1]:.0f}), {w}x{h}")
+
+    left, top, right, bottom = tracker.discover(mask)
+    full_pixels = (Config.CROP_RIGHT - Config.CROP_LEFT) * (Config.CROP_BOTTOM - Config.CROP_TOP)
+    print(f"\nProposed ROI covers {(right - left) * (bottom - top) * width * height:.0f} px, "
+          f"{full_pixels / ((right - left) * (bottom - top)):.0f}x fewer than the current crop")
+    print(f"    CROP_LEFT = {left:.4f}")
+    print(f"    CROP_TOP = {top:.4f}")
+    print(f"    CROP_RIGHT = {right:.4f}")
+    print(f"    CROP_BOTTOM = {bottom:.4f}")
+    print(f"    CAMERA_ROI = ({left:.4f}, {top:.4f}, {right - left:.4f}, {bottom - top:.4f})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+"""
+Startup timing report.
+
+Measures milestones relative to the moment the process was started (not when
+Python got around to importing this module), so interpreter start-up and
+imports show up in the report too.
+"""
+
+import os
+import time
+
+
+def process_start_time():
+    """Wall-clock time the current process started (falls back to now)"""
+    try:
+        with open('/proc/self/stat', 'r') as f:
+            # Fields after the ')' of the command name start at field 3
+            fields = f.read().rsplit(')', 1)[1].split()
+        start_ticks = int(fields[19])  # Field 22: starttime in clock ticks since boot
+        with open('/proc/uptime', 'r') as f:
+            uptime = float(f.read().split()[0])
+        age = uptime - start_ticks / os.sysconf('SC_CLK_TCK')
+        return time.time() - max(age, 0.0)
+    except (OSError, ValueError, IndexError):
+        return time.time()
+
+
+class StartupTimer:
+    def __init__(self):
+        self.start = process_start_time()
+        self.marks = []
+
+    def mark(self, name):
+        """Record a milestone; returns seconds since process start"""
+        elapsed = time.time() - self.start
+        self.marks.append((name, elapsed))
+        return elapsed
+
+    def report(self):
+        """One-line summary with the time spent in each step"""
+        parts = []
+        previous = 0.0
+        for name, elapsed in self.marks:
+            parts.append(f"{name} +{(elapsed - previous) * 1000:.0f}ms")
+            previous = elapsed
+        return f"Startup {previous:.2f}s: " + ", ".join(parts)
@@ -223,15 +223,61 @@ with socketserver.TCPServer(("", 8080), CameraHandler) as httpd:
         subprocess.run(['pkill', '-f', 'python3.*camera_server'], capture_output=True)
         print("Stream stopped")
 
+def start_roi_stream():
+    """Serve the detector's ROI crop as MJPEG (no rpicam-vid; the detector must be running)"""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    from roi_stream import RoiStreamReader, mjpeg_frames
+    
+    reader = RoiStreamReader()
+    
+    class RoiHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path == '/':
+                self.send_response(200)
+                self.send_header('Content-type', 'text/html')
+                self.end_headers()
+                self.wfile.write(b'<html><head><title>LED View</title></head><body>'
+                                 b'<h1>LED View</h1><img src="/stream" /></body></html>')
+            elif self.path == '/stream':
+                self.send_response(200)
+                self.send_header('Content-type', 'multipart/x-mixed-replace; boundary=frame')
+                self.end_headers()
+                try:
+                    for chunk in mjpeg_frames(reader):
+                        self.wfile.write(chunk)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+            else:
+                self.send_response(404)
+                self.end_headers()
+        
+        def log_message(self, format, *args):
+            pass
+    
+    print("Starting ROI stream from the running detector...")
+    print("Access via web browser: http://192.168.29.91:8080")
+    server = ThreadingHTTPServer(("", 8080), RoiHandler)
+    server.daemon_threads = True
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\nStopping stream...")
+    finally:
+        server.server_close()
+        print("Stream stopped")
+
 if __name__ == "__main__":
     if len(sys.argv) > 1:
         if sys.argv[1] == "mjpeg":
             start_simple_stream()
         elif sys.argv[1] == "web":
             start_web_stream()
+        elif sys.argv[1] == "roi":
+            start_roi_stream()
         else:
-            print("Usage: python3 stream_camera.py [mjpeg|web]")
+            print("Usage: python3 stream_camera.py [mjpeg|web|roi]")
             print("  mjpeg: Simple MJPEG stream")
             print("  web: Web-based stream with custom server")
+            print("  roi: Detection region only, from the running detector (low bandwidth)")
     else:
         start_web_stream() 
\ No newline at end of file
@@ -0,0 +1,139 @@
+"""
+Queue-based structured logging.
+
+Log calls on the detection thread only put the record on a queue; a
+QueueListener thread formats it and does the disk I/O. LOG_FILE holds one
+JSON object per line:
+
+    {"time": "2024-01-01T12:00:00.123", "ts": 1704110400.123, "level": "INFO",
+     "logger": "__main__", "message": "Detection result: ...", "event": "detection",
+     "cycle": 42, "detected": false, "confidence": 0.02, "timings_ms": {...}}
+
+Extra fields are passed as logger.info(msg, extra={'fields': {...}}). The
+file rotates at LOG_MAX_BYTES or every LOG_ROTATE_INTERVAL seconds, keeping
+LOG_BACKUP_COUNT old files. The console (journal) keeps the plain format.
+
+In pipelined mode the queue is a multiprocessing queue, so the worker
+processes log through the parent's writer and only one process rotates.
+"""
+
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import time
+from datetime import datetime
+
+from config import Config
+
+_CONSOLE_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record, with the record's extra 'fields' merged in"""
+
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'ts': record.created,
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        if record.processName != 'MainProcess':
+            entry['process'] = record.processName
+        entry.update(getattr(record, 'fields', None) or {})
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class RotatingLogHandler(logging.handlers.RotatingFileHandler):
+    """Rotates when the file reaches max_bytes or is older than interval seconds"""
+
+    def __init__(self, filename, max_bytes, backup_count, interval):
+        super().__init__(filename, maxBytes=max_bytes, backupCount=backup_count, delay=True)
+        self.interval = interval
+        self.opened = self._file_start()
+
+    def _file_start(self):
+        """Time of the first record in an existing log file, else now"""
+        try:
+            with open(self.baseFilename, 'r') as f:
+                return float(json.loads(f.readline())['ts'])
+        except (OSError, ValueError, KeyError, TypeError):
+            return time.time()
+
+    def shouldRollover(self, record):
+        if self.interval and time.time() - self.opened >= self.interval:
+            return True
+        return super().shouldRollover(record)
+
+    def doRollover(self):
+        super().doRollover()
+        self.opened = time.time()
+
+
+def setup_logging(config=None, multiprocess=False):
+    """
+    Route all logging through a queue to a background writer
+    Returns the QueueListener; call stop() on it at exit to flush.
+    """
+    config = config or Config()
+    file_handler = RotatingLogHandler(config.LOG_FILE, config.LOG_MAX_BYTES, config.LOG_BACKUP_COUNT,
+                                      config.LOG_ROTATE_INTERVAL)
+    file_handler.setFormatter(JsonFormatter())
+    console_handler = logging.StreamHandler()
+    console_handler.setFormatter(logging.Formatter(_CONSOLE_FORMAT))
+
+    if multiprocess:
+        import multiprocessing
+        log_queue = multiprocessing.get_context('fork').Queue()
+    else:
+        log_queue = queue.SimpleQueue()
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(logging.handlers.QueueHandler(log_queue))
+    root.setLevel(getattr(logging, config.LOG_LEVEL))
+
+    listener = logging.handlers.QueueListener(log_queue, file_handler, console_handler)
+    listener.start()
+    return listener
+
+
+def _tail_lines(f, limit, block=65536):
+    """Last `limit` lines of a binary file, reading backwards from the end"""
+    end = f.seek(0, os.SEEK_END)
+    data = b''
+    while end > 0 and data.count(b'\n') <= limit:
+        start = max(0, end - block)
+        f.seek(start)
+        data = f.read(end - start) + data
+        end = start
+    return data.splitlines()[-limit:]
+
+
+def read_records(path, limit=None):
+    """
+    Parsed records from a JSON log file (newest last); non-JSON lines are skipped
+    With a limit only the end of the file is read.
+    """
+    if not os.path.exists(path):
+        return []
+    with open(path, 'rb') as f:
+        lines = _tail_lines(f, limit) if limit else f.read().splitlines()
+    records = []
+    for line in lines:
+        try:
+            records.append(json.loads(line))
+        except ValueError:
+            continue  # Plain-text lines from before structured logging
+    return records
+
+
+def format_record(record):
+    """Human-readable line for a parsed record"""
+    return f"{record.get('time', '')} - {record.get('level', '')} - {record.get('message', '')}"
@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+"""
+Thermal- and CPU-aware quality control.
+
+A Pi in a closed meter cabinet heats up until the firmware throttles it, and
+a throttled Pi can miss detection cycles. ThermalController reads the SoC
+temperature, the firmware throttling flags and the CPU load every
+THERMAL_CHECK_INTERVAL seconds. It then moves between the THERMAL_LEVELS
+quality levels, full quality first:
+
+- step down one level while the SoC is above THERMAL_SOFT_LIMIT (unless it
+  is already cooling), the firmware reports throttling, or the CPU is busier
+  than THERMAL_CPU_BUDGET
+- jump to the lowest level at THERMAL_HARD_LIMIT
+- step back up one level once the SoC is THERMAL_RESUME_MARGIN below the
+  soft limit, the CPU is well under budget and the current level has been
+  held for THERMAL_HOLD_TIME
+
+Each level sets the capture scale (main stream resolution), the crop scale
+(the configured detection region shrinks around its center; 1.0 at every
+default level, so the LED is never cropped out), a frame rate
+divisor and whether captures are archived. Detection itself is never
+switched off. Every decision is logged as a structured 'thermal' event.
+
+Readings come from a SysfsReader rooted at THERMAL_SYSFS_ROOT. Point it at a
+directory with the same layout (sys/class/thermal/..., proc/stat) to fake a
+hot Pi, or pass any object with a read() method to the controller.
+
+Usage:
+    python3 thermal_control.py                  # current readings and decision
+    python3 thermal_control.py --watch          # keep checking and log decisions
+    python3 thermal_control.py --root /tmp/hot  # read a fake sysfs tree
+"""
+
+import argparse
+import logging
+import os
+import time
+from collections import namedtuple
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+QualityLevel = namedtuple('QualityLevel', 'capture_scale crop_scale rate_divisor archive')
+
+# get_throttled bits for the current state (bits 16+ are "has occurred since boot")
+UNDER_VOLTAGE = 0x1
+FREQUENCY_CAPPED = 0x2
+THROTTLED = 0x4
+SOFT_TEMPERATURE_LIMIT = 0x8
+_THROTTLING = FREQUENCY_CAPPED | THROTTLED | SOFT_TEMPERATURE_LIMIT
+
+_RESUME_LOAD = 0.75  # Fraction of THERMAL_CPU_BUDGET the load must be under to step up
+_COOLING_RATE = 0.1  # °C per check; a falling temperature holds the level instead of stepping down
+
+
+class SysfsReader:
+    """SoC temperature, firmware throttling flags and CPU load from sysfs and /proc"""
+
+    TEMPERATURE = 'sys/class/thermal/thermal_zone0/temp'  # Millidegrees
+    THROTTLED = 'sys/devices/platform/soc/soc:firmware/get_throttled'  # Hex flags
+    FREQUENCY = 'sys/devices/system/cpu/cpu0/cpufreq/scaling_cur_freq'  # kHz
+    STAT = 'proc/stat'
+
+    def __init__(self, root='/'):
+        self.root = root
+        self._last_cpu = None
+
+    def _read(self, relative):
+        try:
+            with open(os.path.join(self.root, relative)) as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def temperature(self):
+        """SoC temperature in °C, or None"""
+        value = self._read(self.TEMPERATURE)
+        try:
+            return int(value) / 1000.0
+        except (TypeError, ValueError):
+            return None
+
+    def throttled(self):
+        """Firmware throttling flags, or None where the firmware does not report them"""
+        value = self._read(self.THROTTLED)
+        try:
+            return int(value.strip(), 16)
+        except (AttributeError, ValueError):
+            return None
+
+    def frequency(self):
+        """Current CPU clock in MHz, or None"""
+        value = self._read(self.FREQUENCY)
+        try:
+            return int(value) / 1000.0
+        except (TypeError, ValueError):
+            return None
+
+    def cpu_load(self):
+        """Busy fraction of all cores since the previous call (None on the first)"""
+        stat = self._read(self.STAT)
+        if not stat or not stat.startswith('cpu '):
+            return None
+        ticks = [int(v) for v in stat.split('\n', 1)[0].split()[1:9]]
+        idle = ticks[3] + ticks[4]  # idle + iowait
+        total = sum(ticks)
+        previous, self._last_cpu = self._last_cpu, (idle, total)
+        if previous is None or total <= previous[1]:
+            return None
+        return 1.0 - (idle - previous[0]) / (total - previous[1])
+
+    def read(self):
+        return {
+            'temperature': self.temperature(),
+            'throttled': self.throttled(),
+            'frequency': self.frequency(),
+            'cpu_load': self.cpu_load(),
+        }
+
+
+def max_rate_divisor(config=None):
+    """Largest frame rate divisor the controller may apply (1 when disabled)"""
+    config = config or Config()
+    if not config.THERMAL_CONTROL_ENABLED:
+        return 1
+    return max(level[2] for level in config.THERMAL_LEVELS)
+
+
+class ThermalController:
+    """Chooses a THERMAL_LEVELS entry from the readings and logs each decision"""
+
+    def __init__(self, reader=None, config=None, clock=time.monotonic):
+        self.config = config or Config()
+        self.reader = reader or SysfsReader(self.config.THERMAL_SYSFS_ROOT)
+        self.clock = clock
+        self.level = 0
+        self.changed_at = clock()
+        self.next_check = 0.0
+        self.last_reading = None
+        self.previous_temperature = None
+
+    @property
+    def quality(self):
+        return QualityLevel(*self.config.THERMAL_LEVELS[self.level])
+
+    def decide(self, reading, now):
+        """(level, decision, reason) for a reading; decision is down, emergency, up or hold"""
+        config = self.config
+        lowest = len(config.THERMAL_LEVELS) - 1
+        temperature, flags, load = reading['temperature'], reading['throttled'], reading['cpu_load']
+
+        if temperature is not None and temperature >= config.THERMAL_HARD_LIMIT:
+            return lowest, 'emergency', f"{temperature:.1f}°C at or above {config.THERMAL_HARD_LIMIT:g}°C"
+
+        reasons = []
+        if temperature is not None and temperature > config.THERMAL_SOFT_LIMIT:
+            cooling = self.previous_temperature is not None and \
+                temperature <= self.previous_temperature - _COOLING_RATE
+            if not cooling:
+                reasons.append(f"{temperature:.1f}°C above {config.THERMAL_SOFT_LIMIT:g}°C")
+        if flags is not None and flags & _THROTTLING:
+            reasons.append(f"firmware throttling (0x{flags:x})")
+        if load is not None and load > config.THERMAL_CPU_BUDGET:
+            reasons.append(f"CPU {load:.0%} over {config.THERMAL_CPU_BUDGET:.0%} budget")
+        if reasons:
+            if self.level < lowest:
+                return self.level + 1, 'down', '; '.join(reasons)
+            return self.level, 'hold', 'already at the lowest level: ' + '; '.join(reasons)
+
+        if self.level == 0:
+            hot = temperature is not None and temperature > config.THERMAL_SOFT_LIMIT
+            return 0, 'hold', f"{temperature:.1f}°C, cooling" if hot else 'within budget'
+        if temperature is not None and temperature > config.THERMAL_SOFT_LIMIT - config.THERMAL_RESUME_MARGIN:
+            return self.level, 'hold', f"{temperature:.1f}°C, cooling"
+        if load is not None and load > config.THERMAL_CPU_BUDGET * _RESUME_LOAD:
+            return self.level, 'hold', f"CPU {load:.0%} not yet well under budget"
+        if now - self.changed_at < config.THERMAL_HOLD_TIME:
+            return self.level, 'hold', f"holding for {config.THERMAL_HOLD_TIME - (now - self.changed_at):.0f}s"
+        return self.level - 1, 'up', 'recovered'
+
+    def update(self, now=None):
+        """
+        Take a reading if THERMAL_CHECK_INTERVAL has passed and apply the decision
+        Returns the new QualityLevel when the level changed, else None.
+        """
+        now = self.clock() if now is None else now
+        if now < self.next_check:
+            return None
+        self.next_check = now + self.config.THERMAL_CHECK_INTERVAL
+
+        try:
+            reading = self.reader.read()
+        except Exception as e:
+            logger.error(f"Thermal reading failed: {e}")
+            return None
+        level, decision, reason = self.decide(reading, now)
+        self.last_reading = reading
+        if reading['temperature'] is not None:
+            self.previous_temperature = reading['temperature']
+
+        previous = self.level
+        self.level = level
+        if level != previous:
+            self.changed_at = now
+        self._log(decision, reason, previous, reading)
+        return self.quality if level != previous else None
+
+    def _log(self, decision, reason, previous, reading):
+        quality = self.quality
+        temperature, load = reading['temperature'], reading['cpu_load']
+        change = f"level {previous} -> {self.level}" if previous != self.level else f"level {self.level}"
+        message = (f"Thermal {decision}: {change} ({reason}); "
+                   f"{'-' if temperature is None else f'{temperature:.1f}°C'}, "
+                   f"CPU {'-' if load is None else f'{load:.0%}'}")
+        level = logging.WARNING if decision in ('down', 'emergency') else logging.INFO
+        logger.log(level, message, extra={'fields': {
+            'event': 'thermal',
+            'decision': decision,
+            'reason': reason,
+            'quality_level': self.level,  # 'level' is the log level
+            'previous_quality_level': previous,
+            'temperature': temperature,
+            'cpu_load': None if load is None else round(load, 3),
+            'throttled': reading['throttled'],
+            'frequency_mhz': reading['frequency'],
+            'quality': quality._asdict(),
+        }})
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Show thermal readings and quality control decisions")
+    parser.add_argument('--root', default=Config.THERMAL_SYSFS_ROOT, help="Root of the sysfs tree to read")
+    parser.add_argument('--watch', action='store_true', help="Keep checking every THERMAL_CHECK_INTERVAL")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    controller = ThermalController(SysfsReader(args.root))
+    controller.reader.cpu_load()  # Load is measured between two reads
+    time.sleep(1.0)
+    while True:
+        controller.update()
+        print(f"Quality: {controller.quality}")
+        if not args.watch:
+            break
+        time.sleep(max(0.0, controller.next_check - controller.clock()))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,18 +1,23 @@
 #!/usr/bin/env python3
 
-from flask import Flask, render_template, jsonify, send_file
+from flask import Flask, Response, abort, render_template, jsonify, request
 import os
 import json
-from datetime import datetime
-import cv2
-import numpy as np
+import time
+from email.utils import formatdate
 from config import Config
+from config_loader import load_config
+from image_cache import ImageCache, etag_for
+from roi_stream import RoiStreamReader, mjpeg_frames
+from structured_logging import format_record, read_records
 
 app = Flask(__name__)
+load_config()
 config = Config()
+image_cache = ImageCache(config.IMAGE_CACHE_BYTES)
+roi_stream = RoiStreamReader()
 
-# Create templates directory and HTML template
-os.makedirs('templates', exist_ok=True)
+STATUS_LOG_RECORDS = 5000  # Log records (one per cycle) scanned for the detection count
 
 # Create HTML template
 html_template = """
@@ -42,6 +47,9 @@ html_template = """
         .stat-card { background: #e9ecef; padding: 15px; border-radius: 5px; text-align: center; }
         .stat-value { font-size: 24px; font-weight: bold; color: #007bff; }
         .stat-label { color: #6c757d; font-size: 14px; }
+        .gallery { display: grid; grid-template-columns: repeat(auto-fill, minmax(96px, 1fr)); gap: 8px; max-height: 400px; overflow-y: auto; }
+        .gallery a { text-align: center; font-size: 11px; color: #6c757d; text-decoration: none; }
+        .gallery img { width: 96px; border-radius: 3px; display: block; margin: 0 auto; }
     </style>
 </head>
 <body>
@@ -58,7 +66,7 @@ html_template = """
         <div class="stats">
             <div class="stat-card">
                 <div class="stat-value" id="detectionCount">-</div>
-                <div class="stat-label">Total Detections</div>
+                <div class="stat-label">Recent Detections</div>
             </div>
             <div class="stat-card">
                 <div class="stat-value" id="lastDetection">-</div>
@@ -88,9 +96,17 @@ html_template = """
                 <button class="button" onclick="testDetection()">🔍 Test Detection</button>
                 <button class="button danger" onclick="restartSystem()">🔄 Restart System</button>
                 <button class="button" onclick="clearLogs()">🗑️ Clear Logs</button>
+                <button class="button" onclick="toggleLiveView()">📺 Live LED View</button>
+                <div class="latest-image" id="liveView"></div>
             </div>
         </div>
         
+        <div class="card">
+            <h3>Capture History</h3>
+            <div class="gallery" id="gallery" onscroll="galleryScrolled(this)"></div>
+            <button class="button" id="loadMore" onclick="loadGallery()">Load more</button>
+        </div>
+        
         <div class="card">
             <h3>Recent Logs</h3>
             <div class="log" id="logContent">
@@ -124,6 +140,35 @@ html_template = """
                 });
         }
         
+        let galleryBefore = null;
+        let galleryLoading = false;
+        
+        function loadGallery() {
+            if (galleryLoading) return;
+            galleryLoading = true;
+            const url = '/api/images?limit=60' + (galleryBefore ? '&before=' + galleryBefore : '');
+            fetch(url)
+                .then(response => response.json())
+                .then(data => {
+                    const gallery = document.getElementById('gallery');
+                    data.images.forEach(image => {
+                        const thumb = image.thumbnails.small || image.url;
+                        const time = new Date(image.timestamp * 1000).toLocaleString();
+                        gallery.insertAdjacentHTML('beforeend',
+                            `<a href="${image.url}" target="_blank"><img src="${thumb}" loading="lazy" alt="${time}" />${time}</a>`);
+                    });
+                    galleryBefore = data.next_before;
+                    document.getElementById('loadMore').style.display = galleryBefore ? '' : 'none';
+                    galleryLoading = false;
+                });
+        }
+        
+        function galleryScrolled(element) {
+            if (galleryBefore && element.scrollTop + element.clientHeight >= element.scrollHeight - 50) {
+                loadGallery();
+            }
+        }
+        
         function updateLogs() {
             fetch('/api/logs')
                 .then(response => response.json())
@@ -171,6 +216,12 @@ html_template = """
             }
         }
         
+        function toggleLiveView() {
+            const view = document.getElementById('liveView');
+            // Closing the image ends the stream, so the detector stops publishing
+            view.innerHTML = view.innerHTML ? '' : '<img src="/stream/roi" alt="Live LED view" />';
+        }
+        
         // Update every 5 seconds
         setInterval(() => {
             updateStatus();
@@ -184,14 +235,48 @@ html_template = """
         updateStatus();
         updateLatestImage();
         updateLogs();
+        loadGallery();
     </script>
 </body>
 </html>
 """
 
-# Write template to file
-with open('templates/index.html', 'w') as f:
-    f.write(html_template)
+def write_template():
+    """Write the dashboard template, skipping the disk write when it is unchanged"""
+    template_dir = os.path.join(app.root_path, 'templates')
+    template_path = os.path.join(template_dir, 'index.html')
+    if os.path.exists(template_path):
+        with open(template_path, 'r') as f:
+            if f.read() == html_template:
+                return
+    os.makedirs(template_dir, exist_ok=True)
+    with open(template_path, 'w') as f:
+        f.write(html_template)
+
+write_template()
+
+def open_image_index():
+    """Read-only handle on the capture index, or None before the first indexed capture"""
+    from image_store import ImageIndex, index_path
+    path = index_path(config)
+    if not os.path.exists(path):
+        return None
+    return ImageIndex(path, readonly=True)
+
+def image_entry(row):
+    """JSON description of an indexed capture"""
+    widths = sorted(int(w) for w in row['thumbnails'].split(',') if w)
+    return {
+        'id': row['id'],
+        'url': f'/images/{row["filename"]}',
+        'timestamp': row['timestamp'],
+        'width': row['width'],
+        'height': row['height'],
+        'thumbnails': {
+            'small': f'/thumbs/{widths[0]}/{row["filename"]}' if widths else None,
+            'large': f'/thumbs/{widths[-1]}/{row["filename"]}' if widths else None,
+        },
+    }
 
 @app.route('/')
 def index():
@@ -204,22 +289,18 @@ def api_status():
         # Check if system is running
         system_running = os.path.exists('/tmp/light_detector.pid')
         
-        # Get detection count from logs
-        detection_count = 0
-        last_detection = "Never"
-        if os.path.exists(config.LOG_FILE):
-            with open(config.LOG_FILE, 'r') as f:
-                lines = f.readlines()
-                detection_count = len([l for l in lines if "DETECTED" in l])
-                for line in reversed(lines):
-                    if "DETECTED" in line:
-                        last_detection = line.split(' - ')[0]
-                        break
+        # Get the recent detection count from the end of the structured log
+        detections = [r for r in read_records(config.LOG_FILE, limit=STATUS_LOG_RECORDS)
+                      if r.get('event') == 'detection' and r.get('detected')]
+        detection_count = len(detections)
+        last_detection = detections[-1]['time'] if detections else "Never"
         
         # Get image count
         image_count = 0
-        if os.path.exists(config.IMAGE_DIR):
-            image_count = len([f for f in os.listdir(config.IMAGE_DIR) if f.endswith('.jpg')])
+        index = open_image_index()
+        if index is not None:
+            image_count = index.count()
+            index.close()
         
         # Calculate uptime (simplified)
         uptime = "Unknown"
@@ -228,12 +309,15 @@ def api_status():
                 uptime_seconds = float(f.read().split()[0])
                 uptime = f"{int(uptime_seconds // 3600)}h {int((uptime_seconds % 3600) // 60)}m"
         
+        outbox = read_outbox_stats()
+        
         return jsonify({
             'status': 'Online' if system_running else 'Offline',
             'detection_count': detection_count,
             'last_detection': last_detection,
             'uptime': uptime,
-            'image_count': image_count
+            'image_count': image_count,
+            'alert_backlog': outbox['backlog'] if outbox else 0
         })
     except Exception as e:
         return jsonify({'error': str(e)})
@@ -242,30 +326,155 @@ def api_status():
 def api_latest_image():
     """Get latest captured image"""
     try:
-        if os.path.exists(config.IMAGE_DIR):
-            images = [f for f in os.listdir(config.IMAGE_DIR) if f.endswith('.jpg')]
-            if images:
-                latest = sorted(images)[-1]
-                return jsonify({'image_url': f'/images/{latest}'})
+        index = open_image_index()
+        if index is not None:
+            rows = index.page(limit=1)
+            index.close()
+            if rows:
+                return jsonify({'image_url': f'/images/{rows[0]["filename"]}'})
         return jsonify({'image_url': None})
     except Exception as e:
         return jsonify({'error': str(e)})
 
+@app.route('/api/images')
+def api_images():
+    """Page through indexed captures, newest first: /api/images?before=<id>&limit=<n>"""
+    try:
+        before = request.args.get('before', type=int)
+        limit = min(max(request.args.get('limit', 50, type=int), 1), 500)
+        index = open_image_index()
+        if index is None:
+            return jsonify({'images': [], 'next_before': None})
+        rows = index.page(before=before, limit=limit)
+        index.close()
+        
+        images = [image_entry(row) for row in rows]
+        next_before = images[-1]['id'] if len(images) == limit else None
+        return jsonify({'images': images, 'next_before': next_before})
+    except Exception as e:
+        return jsonify({'error': str(e)})
+
+def read_outbox_stats():
+    """Alert outbox backlog and delivery lag, or None before the first network alert"""
+    if not os.path.exists(config.ALERT_OUTBOX_FILE):
+        return None
+    from alert_outbox import AlertOutbox
+    outbox = AlertOutbox(config.ALERT_OUTBOX_FILE, readonly=True)
+    try:
+        return outbox.stats()
+    finally:
+        outbox.close()
+
+@app.route('/api/alerts')
+def api_alerts():
+    """Alert outbox status: backlog, age of the oldest pending alert, last delivery lag"""
+    try:
+        return jsonify(read_outbox_stats() or {'backlog': 0})
+    except Exception as e:
+        return jsonify({'error': str(e)})
+
+@app.route('/api/power')
+def api_power():
+    """Metered power rollups: /api/power?hours=<h>&points=<n> or ?start=<epoch>&end=<epoch>"""
+    try:
+        if not os.path.exists(config.ROLLUP_DB_FILE):
+            return jsonify({'resolution': None, 'points': []})
+        from pulse_meter import RollupStore
+        end = request.args.get('end', time.time(), type=float)
+        start = request.args.get('start', end - request.args.get('hours', 24, type=float) * 3600, type=float)
+        points = min(max(request.args.get('points', 500, type=int), 1), 5000)
+        store = RollupStore(readonly=True)
+        resolution, rows = store.query(start, end, points)
+        store.close()
+        return jsonify({'resolution': resolution, 'points': rows})
+    except Exception as e:
+        return jsonify({'error': str(e)})
+
+def serve_cached_image(directory, filename):
+    """Serve a JPEG from the memory cache, answering conditional requests with 304"""
+    if filename != os.path.basename(filename) or filename.startswith('.'):
+        abort(404)
+    path = os.path.join(directory, filename)
+    try:
+        stat = os.stat(path)
+    except OSError:
+        abort(404)
+    
+    etag = etag_for(stat)
+    if request.if_none_match.contains(etag) or (
+            not request.if_none_match and request.if_modified_since is not None
+            and int(stat.st_mtime) <= request.if_modified_since.timestamp()):
+        image_cache.count_not_modified()
+        response = Response(status=304)
+    else:
+        response = Response(image_cache.read(path, stat), mimetype='image/jpeg')
+    
+    response.set_etag(etag)
+    response.headers['Last-Modified'] = formatdate(stat.st_mtime, usegmt=True)
+    # Names are timestamped to the second, so a file can only be replaced during its own second
+    if time.time() - stat.st_mtime > 2:
+        response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    else:
+        response.headers['Cache-Control'] = 'no-cache'
+    return response
+
 @app.route('/images/<filename>')
 def serve_image(filename):
     """Serve captured images"""
-    return send_file(os.path.join(config.IMAGE_DIR, filename))
+    return serve_cached_image(config.IMAGE_DIR, filename)
+
+@app.route('/thumbs/<int:width>/<filename>')
+def serve_thumbnail(width, filename):
+    """Serve capture thumbnails"""
+    return serve_cached_image(os.path.join(config.IMAGE_DIR, 'thumbs', str(width)), filename)
+
+@app.route('/stream/roi')
+def stream_roi():
+    """MJPEG stream of the detection region with the detection overlay"""
+    fps = min(max(request.args.get('fps', config.ROI_STREAM_FPS, type=float), 0.1), 30)
+    scale = min(max(request.args.get('scale', config.ROI_STREAM_SCALE, type=float), 0.25), 8)
+    return Response(mjpeg_frames(roi_stream, fps, scale), mimetype='multipart/x-mixed-replace; boundary=frame',
+                    headers={'Cache-Control': 'no-cache'})
+
+@app.route('/api/cache')
+def api_cache():
+    """Image cache size and hit ratio"""
+    return jsonify(image_cache.stats())
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """Expose pipeline metrics in Prometheus text format"""
+    try:
+        from metrics import PipelineMetrics
+        text = PipelineMetrics().render_prometheus()
+        cache = image_cache.stats()
+        text += (f"# TYPE light_detector_image_cache_hits_total counter\n"
+                 f"light_detector_image_cache_hits_total {cache['hits']}\n"
+                 f"# TYPE light_detector_image_cache_misses_total counter\n"
+                 f"light_detector_image_cache_misses_total {cache['misses']}\n"
+                 f"# TYPE light_detector_image_cache_not_modified_total counter\n"
+                 f"light_detector_image_cache_not_modified_total {cache['not_modified']}\n"
+                 f"# TYPE light_detector_image_cache_bytes gauge\n"
+                 f"light_detector_image_cache_bytes {cache['bytes']}\n")
+        outbox = read_outbox_stats()
+        if outbox:
+            text += (f"# TYPE light_detector_alert_backlog gauge\n"
+                     f"light_detector_alert_backlog {outbox['backlog']}\n"
+                     f"# TYPE light_detector_alert_oldest_pending_seconds gauge\n"
+                     f"light_detector_alert_oldest_pending_seconds {outbox['oldest_pending_age']:.3f}\n")
+        return Response(text, mimetype='text/plain; version=0.0.4')
+    except Exception as e:
+        return Response(f"# metrics unavailable: {e}\n", status=503, mimetype='text/plain')
 
 @app.route('/api/logs')
 def api_logs():
-    """Get recent logs"""
+    """Get recent logs (formatted text plus the parsed records)"""
     try:
-        if os.path.exists(config.LOG_FILE):
-            with open(config.LOG_FILE, 'r') as f:
-                lines = f.readlines()
-                recent_lines = lines[-50:]  # Last 50 lines
-                return jsonify({'logs': ''.join(recent_lines)})
-        return jsonify({'logs': 'No logs available'})
+        records = read_records(config.LOG_FILE, limit=50)  # Last 50 records
+        if records:
+            return jsonify({'logs': '\n'.join(format_record(r) for r in records) + '\n',
+                            'records': records})
+        return jsonify({'logs': 'No logs available', 'records': []})
     except Exception as e:
         return jsonify({'error': str(e)})
 
@@ -292,13 +501,15 @@ def api_test_detection():
         from light_detector import LightDetector
         
         # Get latest image
-        if os.path.exists(config.IMAGE_DIR):
-            images = [f for f in os.listdir(config.IMAGE_DIR) if f.endswith('.jpg')]
-            if images:
-                latest = sorted(images)[-1]
-                image_path = os.path.join(config.IMAGE_DIR, latest)
+        index = open_image_index()
+        if index is not None:
+            rows = index.page(limit=1)
+            index.close()
+            if rows:
+                image_path = os.path.join(config.IMAGE_DIR, rows[0]['filename'])
                 
                 # Test detection
+                import cv2
                 image = cv2.imread(image_path)
                 if image is not None:
                     image_rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
@@ -327,11 +538,14 @@ def api_restart():
 
 @app.route('/api/clear-logs', methods=['POST'])
 def api_clear_logs():
-    """Clear log files"""
+    """Clear log files (including rotated ones)"""
     try:
         if os.path.exists(config.LOG_FILE):
             with open(config.LOG_FILE, 'w') as f:
                 f.write('')
+        for i in range(1, config.LOG_BACKUP_COUNT + 1):
+            if os.path.exists(f"{config.LOG_FILE}.{i}"):
+                os.remove(f"{config.LOG_FILE}.{i}")
         return jsonify({'success': True, 'message': 'Logs cleared'})
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)})